@@ -0,0 +1,149 @@
+import math
+from array import array
+from collections import Counter, defaultdict
+
+from .title_match import normalize_title_text, strip_numbering
+
+
+def _grams(text, n=3):
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class _PrefixMax:
+    """Fenwick tree over pages 1..size answering "best (value, node) on any page <= p"."""
+    def __init__(self, size):
+        self.size = size
+        self.tree = [(0.0, -1)] * (size + 1)
+
+    def update(self, page, entry):
+        while page <= self.size:
+            if entry[0] > self.tree[page][0]:
+                self.tree[page] = entry
+            page += page & -page
+
+    def query(self, page):
+        best = (0.0, -1)
+        while page > 0:
+            if self.tree[page][0] > best[0]:
+                best = self.tree[page]
+            page -= page & -page
+        return best
+
+
+class PageAligner:
+    """
+    Places section titles on pages without the LLM.
+
+    Every page is indexed by the character trigrams of its normalized text
+    that occur in one of the `titles`, so the index grows with the TOC and not
+    with the document. A (title, page) pair scores how much of the title's
+    trigrams the page holds, weighted by rarity across the document (0.7),
+    plus 0.3 when a line of the page reads as the title (numbering aside),
+    i.e. it looks like the heading and not a mention. `align` then picks the
+    order-preserving assignment with the best total score over all titles at
+    once.
+    """
+    def __init__(self, page_texts, titles, first_page=1, skip_pages=()):
+        self.titles = list(titles)
+        self.first_page = first_page
+        self.num_pages = 0
+        self._index = defaultdict(lambda: array("l"))
+        self._headings = defaultdict(set)
+        vocabulary, heading_keys = set(), set()
+        for title in self.titles:
+            keys, grams = self._title_keys(title)
+            heading_keys.update(keys)
+            vocabulary |= grams
+        skip = set(skip_pages)
+        # One pass, in page order: a mapped page list streams through
+        for offset, text in enumerate(page_texts):
+            page = first_page + offset
+            self.num_pages = offset + 1
+            if page in skip:
+                continue
+            for gram in _grams(normalize_title_text(text)) & vocabulary:
+                self._index[gram].append(page)
+            for line in (text or "").splitlines():
+                for key in {normalize_title_text(line), normalize_title_text(strip_numbering(line))} & heading_keys:
+                    self._headings[key].add(page)
+
+    @staticmethod
+    def _title_keys(title):
+        """(heading keys, trigrams) of a title."""
+        full = normalize_title_text(title)
+        stripped = normalize_title_text(strip_numbering(title))
+        keys = [key for key in {full, stripped} if len(key) >= 3] or [full]
+        return keys, _grams(stripped if len(stripped) >= 3 else full)
+
+    def _weight(self, gram):
+        pages = self._index.get(gram)
+        if not pages:
+            # Unseen trigram: counts against every page
+            return math.log(self.num_pages + 1)
+        return math.log((self.num_pages + 1) / len(pages))
+
+    def scores(self, title, min_score=0.3, max_candidates=50):
+        """{page: score} of the pages most likely to hold `title`, one of the aligner's titles."""
+        keys, grams = self._title_keys(title)
+        weights = {gram: self._weight(gram) for gram in grams}
+        total = sum(weights.values())
+        if not total:
+            return {}
+
+        found = Counter()
+        for gram, weight in weights.items():
+            if weight > 0:
+                for page in self._index.get(gram, ()):
+                    found[page] += weight
+        headings = set().union(*(self._headings.get(key, ()) for key in keys))
+        # Pages with the title as a heading always stay candidates, however common its words are
+        pages = {page for page, _ in found.most_common(max_candidates)} | headings
+        scores = {}
+        for page in pages:
+            containment = found[page] / total
+            if containment >= min_score:
+                scores[page] = 0.7 * containment + (0.3 if page in headings else 0.0)
+        return scores
+
+    def align(self, same_page_penalty=0.05):
+        """
+        [(physical_index or None, confidence)] for the titles, in document order.
+
+        Pages never go backwards from one title to the next. Several titles may
+        share a page, at a small `same_page_penalty` so that a page merely listing
+        titles does not win ties against the pages they head. A title that does
+        not fit the best chain gets None. The confidence is the pair's score,
+        lowered by how much better the title scored on some page outside the chain.
+        """
+        titles = self.titles
+        candidates = [self.scores(title) for title in titles]
+        tree = _PrefixMax(self.first_page + self.num_pages)
+        ending_at = {}
+        nodes = []
+        for i, scores in enumerate(candidates):
+            # All of one title's candidates extend chains of earlier titles only
+            updates = []
+            for page, score in scores.items():
+                value, previous = tree.query(page - 1)
+                same_value, same_previous = ending_at.get(page, (0.0, -1))
+                if same_previous != -1 and same_value - same_page_penalty > value:
+                    value, previous = same_value - same_page_penalty, same_previous
+                nodes.append((i, page, previous))
+                # Ties go to the earlier page: a running header repeats a title on every page after its start
+                updates.append((page, (value + score - page * 1e-9, len(nodes) - 1)))
+            for page, entry in updates:
+                tree.update(page, entry)
+                if entry[0] > ending_at.get(page, (0.0, -1))[0]:
+                    ending_at[page] = entry
+
+        result = [(None, 0.0)] * len(titles)
+        node = tree.query(self.first_page + self.num_pages)[1]
+        while node != -1:
+            i, page, previous = nodes[node]
+            score = candidates[i][page]
+            best = max(candidates[i].values())
+            result[i] = (page, max(0.0, score - (best - score)))
+            node = previous
+        return result
@@ -0,0 +1,106 @@
+import asyncio
+import weakref
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .streaming import SSEParser, delta_content
+from .retry import LLMError, LLMConnectionError, LLMEmptyResponseError, error_for_response
+
+
+class AsyncLLMClient:
+    """
+    Native asyncio client for streaming chat completions.
+
+    One aiohttp session (and connection pool) is kept per event loop, since
+    aiohttp sessions cannot be shared across loops. A streaming response only
+    costs a coroutine, not an OS thread, so thousands of calls can be in flight.
+    """
+    def __init__(self, pool_size=100, keep_alive=True, dns_cache_ttl=300, verify=False, read_chunk_size=4096):
+        if aiohttp is None:
+            raise ImportError("aiohttp is required for AsyncLLMClient")
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.dns_cache_ttl = dns_cache_ttl
+        self.verify = verify
+        self.read_chunk_size = read_chunk_size
+        self._sessions = weakref.WeakKeyDictionary()
+
+    def _session(self):
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                ttl_dns_cache=self.dns_cache_ttl if self.dns_cache_ttl > 0 else None,
+                use_dns_cache=self.dns_cache_ttl > 0,
+                force_close=not self.keep_alive,
+                ssl=None if self.verify else False,
+            )
+            # trust_env=False: proxies are disabled process-wide in utils
+            session = aiohttp.ClientSession(connector=connector, trust_env=False)
+            self._sessions[loop] = session
+        return session
+
+    async def stream_chat(self, url, headers, payload, timeout=180, on_delta=None, stop_when=None):
+        """
+        POSTs a streaming chat request and returns the concatenated content deltas.
+        Raises the matching LLMError for HTTP failures, transport errors and empty
+        streams. `on_delta` is called with each content delta as it arrives; once
+        `stop_when(delta)` returns True the stream is abandoned and the content so
+        far is returned.
+        """
+        client_timeout = aiohttp.ClientTimeout(total=timeout)
+        try:
+            async with self._session().post(url, headers=headers, json=payload, timeout=client_timeout) as response:
+                content_type = response.headers.get("Content-Type", "")
+                body = ""
+                if response.status != 200:
+                    body = await response.text(errors="replace")
+                error = error_for_response(
+                    response.status, content_type,
+                    retry_after=response.headers.get("Retry-After"), body=body, url=url,
+                )
+                if error:
+                    raise error
+
+                parser = SSEParser()
+                parts = []
+                stopped = False
+                async for chunk in response.content.iter_chunked(self.read_chunk_size):
+                    for data_part in parser.feed(chunk):
+                        content_str = delta_content(data_part)
+                        if content_str:
+                            parts.append(content_str)
+                            if on_delta: on_delta(content_str)
+                            if stop_when and stop_when(content_str):
+                                stopped = True
+                                break
+                    if parser.done or stopped:
+                        break
+                if stopped:
+                    # Don't drain the rest of the generation; drop the connection instead
+                    response.close()
+                else:
+                    for data_part in parser.flush():
+                        content_str = delta_content(data_part)
+                        if content_str:
+                            parts.append(content_str)
+                            if on_delta: on_delta(content_str)
+        except LLMError:
+            raise
+        except Exception as e:
+            raise LLMConnectionError(f"Connection error to {url}: {e!r}", url=url) from e
+
+        text = "".join(parts)
+        if not text.strip():
+            raise LLMEmptyResponseError(f"{url} returned an empty stream", status=200, url=url)
+        return text
+
+    async def close(self):
+        for session in list(self._sessions.values()):
+            if not session.closed:
+                await session.close()
+        self._sessions = weakref.WeakKeyDictionary()
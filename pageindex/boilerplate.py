@@ -0,0 +1,168 @@
+from collections import Counter
+
+from .page_labels import detect_printed_labels, normalize_label, page_number_of_line
+from .title_match import normalize_title_text
+from .toc_detect import has_toc_heading, toc_page_score
+
+
+class BoilerplateFilter:
+    """
+    Finds running headers, footers, page numbers and repeated disclaimers, and
+    strips them from page texts.
+
+    A line is boilerplate when it repeats at the same place, among the first or
+    last `edge_lines` lines of a page, on at least `min_fraction` of the pages
+    (and at least `min_repeats` of them). Page numbers count as one repeating
+    line whatever number they show, but only where the number belongs to a run
+    of page numbers across neighbouring pages: a lone "2024" or "II" is text. Lines of `min_line_length` characters or
+    more count wherever they are on the page, which catches legal notices.
+    Boilerplate is collapsed rather than deleted: a header or footer stays on
+    the first page of each run of pages showing it (one page without it does
+    not end the run, for headers that alternate between left and right
+    pages), so a running header that repeats a chapter title keeps the heading
+    it came from. Long lines found anywhere on the page stay on their first
+    page only. Pages that look like a table of contents, or open with a
+    "Contents" heading, are left alone and start no run: a TOC entry repeating
+    a running header does not take the heading away from the chapter's first
+    page. Runs of blank lines are collapsed to one.
+
+    Every removed line is remembered, so `original_text` and `original_line`
+    map a cleaned page back to the extracted text, e.g. for citations.
+    """
+    def __init__(self, page_texts, edge_lines=3, min_fraction=0.3, min_repeats=4, min_line_length=40,
+                 run_gap=1, toc_threshold=0.5):
+        self.edge_lines = edge_lines
+        self.min_line_length = min_line_length
+        self.run_gap = run_gap
+        self.toc_threshold = toc_threshold
+        self.removed = {}
+        # (zone, key) -> last page it was seen on
+        self._last_seen = {}
+
+        counts = Counter()
+        numbered = []
+        for text in page_texts:
+            keys, page_numbers = set(), []
+            for _, zone_keys, label in self._line_keys(text):
+                keys |= zone_keys
+                if label is not None:
+                    page_numbers.append((zone_keys, label))
+            counts.update(keys)
+            numbered.append(page_numbers)
+
+        # Lines showing the page's own number count under one key for all pages
+        self.page_labels = detect_printed_labels("\n".join(label for _, label in page_numbers) for page_numbers in numbered)
+        for expected, page_numbers in zip(self.page_labels, numbered):
+            plain, numbers = set(), set()
+            for zone_keys, label in page_numbers:
+                if self._is_page_number(label, expected):
+                    plain |= zone_keys
+                    numbers |= self._page_number_keys(zone_keys, label)
+            counts.subtract(plain)
+            counts.update(numbers)
+        threshold = max(min_repeats, min_fraction * len(numbered))
+        self.repeated = {zone_key for zone_key, count in counts.items() if count >= threshold}
+
+    @staticmethod
+    def _is_page_number(label, expected):
+        return label is not None and expected is not None and normalize_label(label) == expected
+
+    @staticmethod
+    def _page_number_keys(zone_keys, label):
+        return {(zone, "#" + key.replace(label.lower(), "", 1)) for zone, key in zone_keys}
+
+    def _starts_run(self, index, zone_key):
+        last = self._last_seen.get(zone_key)
+        if last is None:
+            return True
+        zone, key = zone_key
+        # Notices in the body and page numbers stay once; headings come back with each run
+        if zone == "body" or key.startswith("#"):
+            return False
+        return last < index - 1 - self.run_gap
+
+    def _line_keys(self, text):
+        """
+        (line number, {(zone, key)}, page number or None) for every line of a
+        page that could be boilerplate.
+        """
+        lines = (text or "").split("\n")
+        filled = [i for i, line in enumerate(lines) if line.strip()]
+        top, bottom = set(filled[:self.edge_lines]), set(filled[-self.edge_lines:])
+        for i in filled:
+            line = lines[i]
+            key = normalize_title_text(line)
+            if not key:
+                continue
+            zones = ({"top"} if i in top else set()) | ({"bottom"} if i in bottom else set())
+            label = page_number_of_line(line) if zones else None
+            if len(line.strip()) >= self.min_line_length:
+                zones.add("body")
+            if zones:
+                yield i, {(zone, key) for zone in zones}, label
+
+    def clean_page(self, index, text):
+        """
+        The text of page `index` (0-based) without its boilerplate. Pages must
+        be cleaned in document order for the first page of each run to keep
+        its lines.
+        """
+        if not text:
+            return text
+        if has_toc_heading(text) or toc_page_score(text) >= self.toc_threshold:
+            return text
+        lines = text.split("\n")
+        expected = self.page_labels[index] if index < len(self.page_labels) else None
+        drop = set()
+        for i, zone_keys, label in self._line_keys(text):
+            if self._is_page_number(label, expected):
+                zone_keys = self._page_number_keys(zone_keys, label)
+            repeated = zone_keys & self.repeated
+            if not repeated:
+                continue
+            if not any(self._starts_run(index, zone_key) for zone_key in repeated):
+                drop.add(i)
+            for zone_key in repeated:
+                self._last_seen[zone_key] = index
+
+        kept, removed = [], []
+        for i, line in enumerate(lines):
+            # A blank line right after another kept blank line (or a removed one) goes too
+            if i in drop or (not line.strip() and (not kept or not kept[-1].strip())):
+                removed.append((i, line))
+            else:
+                kept.append(line)
+        if not removed:
+            return text
+        self.removed[index] = removed
+        return "\n".join(kept)
+
+    def original_line(self, index, line_no):
+        """Line number in the extracted text of page `index` for line `line_no` of its cleaned text."""
+        original = line_no
+        for removed_no, _ in self.removed.get(index, ()):
+            if removed_no > original:
+                break
+            original += 1
+        return original
+
+    def original_text(self, index, text):
+        """Puts the removed lines of page `index` back into its cleaned `text`."""
+        removed = self.removed.get(index)
+        if not removed:
+            return text
+        kept = iter(text.split("\n"))
+        lines = []
+        for removed_no, line in removed:
+            while len(lines) < removed_no:
+                lines.append(next(kept))
+            lines.append(line)
+        lines.extend(kept)
+        return "\n".join(lines)
+
+    def stats(self):
+        return {
+            "repeated_lines": len(self.repeated),
+            "pages_changed": len(self.removed),
+            "lines_removed": sum(len(removed) for removed in self.removed.values()),
+        }
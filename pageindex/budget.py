@@ -0,0 +1,110 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+
+_current_budget = contextvars.ContextVar("pageindex_document_budget", default=None)
+
+
+class DocumentBudget:
+    """
+    Per-document allowance of LLM calls, tokens and wall time (0 = unlimited).
+
+    The LLM adapters charge every attempt against the budget of the document being
+    processed and refuse new calls once it is exhausted. Pipeline stages ask `low()`
+    to degrade early (sample verification, skip summaries, stop recursion), and
+    record what they dropped with `note()`, so the result can be marked partial.
+    """
+    def __init__(self, max_calls=0, max_tokens=0, max_seconds=0, low_water=0.2):
+        self.max_calls = max_calls
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+        self.low_water = low_water
+        self.started = time.monotonic()
+        self.calls = 0
+        self.tokens = 0
+        self.refused = 0
+        self.degradations = []
+        self._lock = threading.Lock()
+
+    def charge(self, calls=1, tokens=0):
+        with self._lock:
+            self.calls += calls
+            self.tokens += tokens
+
+    def refuse(self):
+        with self._lock:
+            self.refused += 1
+
+    def remaining_fraction(self):
+        """Smallest remaining share over the configured limits; 1.0 when nothing is limited."""
+        fractions = []
+        if self.max_calls:
+            fractions.append(1 - self.calls / self.max_calls)
+        if self.max_tokens:
+            fractions.append(1 - self.tokens / self.max_tokens)
+        if self.max_seconds:
+            fractions.append(1 - (time.monotonic() - self.started) / self.max_seconds)
+        return max(0.0, min(fractions)) if fractions else 1.0
+
+    def exhausted(self):
+        return self.remaining_fraction() <= 0
+
+    def low(self):
+        return self.remaining_fraction() < self.low_water
+
+    def note(self, degradation):
+        with self._lock:
+            if degradation not in self.degradations:
+                self.degradations.append(degradation)
+
+    @property
+    def partial(self):
+        return bool(self.degradations) or self.refused > 0
+
+    def report(self):
+        return {
+            'calls': self.calls,
+            'tokens': self.tokens,
+            'seconds': round(time.monotonic() - self.started, 3),
+            'max_calls': self.max_calls,
+            'max_tokens': self.max_tokens,
+            'max_seconds': self.max_seconds,
+            'refused_calls': self.refused,
+            'partial': self.partial,
+            'degradations': list(self.degradations),
+        }
+
+    @classmethod
+    def from_opt(cls, opt):
+        return cls(
+            max_calls=int(getattr(opt, 'doc_max_llm_calls', 0) or 0),
+            max_tokens=int(getattr(opt, 'doc_max_llm_tokens', 0) or 0),
+            max_seconds=float(getattr(opt, 'doc_max_seconds', 0) or 0),
+            low_water=float(getattr(opt, 'doc_budget_low_water', 0.2)),
+        )
+
+
+def get_document_budget():
+    """Budget of the document currently being processed, or None outside page_index_main."""
+    return _current_budget.get()
+
+
+def budget_low():
+    budget = _current_budget.get()
+    return budget is not None and budget.low()
+
+
+def budget_exhausted():
+    budget = _current_budget.get()
+    return budget is not None and budget.exhausted()
+
+
+@contextmanager
+def document_budget(budget):
+    token = _current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _current_budget.reset(token)
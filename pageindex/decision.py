@@ -0,0 +1,51 @@
+import re
+
+
+class DecisionReader:
+    """
+    Incremental reader for the one field a yes/no check actually uses.
+
+    Fed the streamed content deltas, it reports True as soon as `"key": "<value>"`
+    is complete, so the caller can stop the stream instead of waiting for the
+    rest of the JSON (typically the model's "thinking"). A leading <think> block
+    is skipped until it is closed.
+    """
+    def __init__(self, key):
+        self.key = key
+        self.value = None
+        self._pattern = re.compile(r'"%s"\s*:\s*"([^"]*)"' % re.escape(key))
+        self._key_pattern = re.compile(r'"%s"' % re.escape(key))
+        self._text = ""
+        self._scan_from = 0
+
+    def feed(self, delta):
+        if self.value is not None:
+            return True
+        self._text += delta
+
+        start = self._scan_from
+        if self._text.lstrip().startswith("<think>"):
+            end = self._text.find("</think>")
+            if end == -1:
+                return False
+            start = max(start, end + len("</think>"))
+
+        match = self._pattern.search(self._text, start)
+        if match:
+            self.value = match.group(1).strip()
+            return True
+        key_match = self._key_pattern.search(self._text, start)
+        if key_match:
+            # Key seen, value still streaming: resume from the key next time
+            self._scan_from = key_match.start()
+        else:
+            # Keep enough tail to catch a key split across deltas
+            self._scan_from = max(start, len(self._text) - len(self.key) - 2)
+        return False
+
+
+def read_decision(text, key):
+    """Value of `key` in a complete or truncated JSON reply, or None if it is not there."""
+    reader = DecisionReader(key)
+    reader.feed(text or "")
+    return reader.value
@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class Endpoint:
+    """One OpenAI-compatible chat completions URL plus its live health statistics."""
+    def __init__(self, url, api_key=None, model=None, weight=1.0, name=None):
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+        self.weight = max(float(weight), 0.01)
+        self.name = name or url
+        # health
+        self.latency_ewma = None
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.calls = 0
+        self.failures = 0
+
+    def score(self, default_latency):
+        """Expected cost of sending one more call here; lower is healthier."""
+        latency = self.latency_ewma if self.latency_ewma is not None else default_latency
+        return latency * (1 + self.in_flight) * (1 + 4 * self.error_rate) / self.weight
+
+    def snapshot(self):
+        return {
+            'name': self.name,
+            'url': self.url,
+            'state': self.state,
+            'latency_ewma': round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            'error_rate': round(self.error_rate, 3),
+            'in_flight': self.in_flight,
+            'calls': self.calls,
+            'failures': self.failures,
+        }
+
+
+class EndpointPool:
+    """
+    Routes LLM calls to the healthiest endpoint.
+
+    Each endpoint keeps an EWMA of latency and of its error rate, and a circuit
+    breaker: after `failure_threshold` consecutive failures it is OPEN for
+    `cooldown` seconds, then HALF_OPEN lets a single probe through; a success
+    closes it again, a failure re-opens it.
+    """
+    def __init__(self, endpoints, alpha=0.3, failure_threshold=5, cooldown=30.0):
+        if not endpoints:
+            raise ValueError("EndpointPool needs at least one endpoint")
+        self.endpoints = list(endpoints)
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, entries, default_url, default_api_key, **kwargs):
+        """
+        Builds the pool from the `llm_endpoints` list in config.yaml. Each entry has
+        `url` and optionally `api_key_env` (name of the env var holding the key),
+        `model` and `weight`. Falls back to a single default endpoint.
+        """
+        endpoints = []
+        for entry in entries or []:
+            if isinstance(entry, str):
+                entry = {'url': entry}
+            if not entry.get('url'):
+                continue
+            api_key = entry.get('api_key')
+            if entry.get('api_key_env'):
+                api_key = os.getenv(entry['api_key_env'], api_key)
+            endpoints.append(Endpoint(
+                entry['url'],
+                api_key=api_key or default_api_key,
+                model=entry.get('model'),
+                weight=entry.get('weight', 1.0),
+                name=entry.get('name'),
+            ))
+        if not endpoints:
+            endpoints.append(Endpoint(default_url, api_key=default_api_key))
+        return cls(endpoints, **kwargs)
+
+    def _available(self, endpoint, now, promote=True):
+        # A breaker that has cooled down lets a probe through; `promote` records that
+        cooled = endpoint.state == OPEN and now - endpoint.opened_at >= self.cooldown
+        if cooled and promote:
+            endpoint.state = HALF_OPEN
+        if endpoint.state == OPEN:
+            return cooled
+        if endpoint.state == HALF_OPEN and endpoint.probe_in_flight:
+            return False
+        return True
+
+    def _best(self, exclude, promote=True):
+        # Called with the lock held
+        now = time.monotonic()
+        candidates = [e for e in self.endpoints if e not in exclude]
+        if not candidates:
+            return None
+        known = [e.latency_ewma for e in self.endpoints if e.latency_ewma is not None]
+        default_latency = min(known) if known else 1.0
+        healthy = [e for e in candidates if self._available(e, now, promote)]
+        if healthy:
+            return min(healthy, key=lambda e: e.score(default_latency))
+        # Every breaker is open: try the one that has been cooling down longest
+        return min(candidates, key=lambda e: e.opened_at)
+
+    def peek(self):
+        """The endpoint `choose` would pick right now, without starting a call on it."""
+        with self._lock:
+            return self._best((), promote=False)
+
+    def choose(self, exclude=()):
+        """Picks the best endpoint not in `exclude` and marks a call as started on it, or returns None."""
+        with self._lock:
+            chosen = self._best(exclude)
+            if chosen is None:
+                return None
+            if chosen.state == HALF_OPEN:
+                chosen.probe_in_flight = True
+            chosen.in_flight += 1
+            chosen.calls += 1
+            return chosen
+
+    def record_success(self, endpoint, latency):
+        with self._lock:
+            endpoint.in_flight = max(0, endpoint.in_flight - 1)
+            if endpoint.latency_ewma is None:
+                endpoint.latency_ewma = latency
+            else:
+                endpoint.latency_ewma += self.alpha * (latency - endpoint.latency_ewma)
+            endpoint.error_rate *= (1 - self.alpha)
+            endpoint.consecutive_failures = 0
+            endpoint.state = CLOSED
+            endpoint.probe_in_flight = False
+
+    def record_failure(self, endpoint, counts_against=True):
+        """Ends a failed call. `counts_against=False` for errors that are not the endpoint's fault."""
+        with self._lock:
+            endpoint.in_flight = max(0, endpoint.in_flight - 1)
+            endpoint.probe_in_flight = False
+            if not counts_against:
+                return
+            endpoint.failures += 1
+            endpoint.error_rate += self.alpha * (1 - endpoint.error_rate)
+            endpoint.consecutive_failures += 1
+            if endpoint.state == HALF_OPEN or endpoint.consecutive_failures >= self.failure_threshold:
+                endpoint.state = OPEN
+                endpoint.opened_at = time.monotonic()
+
+    def snapshot(self):
+        with self._lock:
+            return [e.snapshot() for e in self.endpoints]
@@ -0,0 +1,128 @@
+import contextvars
+import queue
+import threading
+
+
+class CancelToken:
+    """
+    Lets another thread abandon a streaming attempt.
+
+    The attempt `bind`s its open response; `cancel` closes it, which makes the
+    reader fall out of its loop. The attempt then checks `cancelled` so a stream
+    cut short is never mistaken for a complete answer.
+    """
+    def __init__(self):
+        self.cancelled = False
+        self._response = None
+        self._lock = threading.Lock()
+
+    def bind(self, response):
+        with self._lock:
+            self._response = response
+            cancelled = self.cancelled
+        if cancelled:
+            response.close()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            response = self._response
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+
+class HedgePolicy:
+    """
+    Decides when a slow LLM call gets a duplicate request.
+
+    Only calls whose innermost pipeline stage is in `stages` are hedged. The
+    delay is the `percentile` of the time-to-first-token of the last `window`
+    calls of that stage, never below `min_delay`; until `min_samples` calls have
+    been seen, `initial_delay` is used.
+    """
+    def __init__(self, stages, percentile=0.9, min_delay=2.0, initial_delay=15.0, min_samples=5, window=50):
+        self.stages = set(stages or ())
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self.window = window
+
+    def applies(self, stage):
+        return stage.split("/")[-1] in self.stages
+
+    def delay_for(self, stage, registry):
+        samples = sorted(
+            r['ttft'] for r in registry.recent(stage, limit=self.window)
+            if r['ttft'] is not None and not r['cache_hit']
+        )
+        if len(samples) < self.min_samples:
+            return max(self.min_delay, self.initial_delay)
+        index = min(len(samples) - 1, int(self.percentile * len(samples)))
+        return max(self.min_delay, samples[index])
+
+    @classmethod
+    def from_opt(cls, opt):
+        return cls(
+            stages=getattr(opt, 'llm_hedge_stages', None) or (),
+            percentile=float(getattr(opt, 'llm_hedge_percentile', 0.9)),
+            min_delay=float(getattr(opt, 'llm_hedge_min_delay', 2.0)),
+            initial_delay=float(getattr(opt, 'llm_hedge_initial_delay', 15.0)),
+        )
+
+
+def hedged_call(primary, hedge, delay, acquire_hedge=None, release_hedge=None, on_hedge=None):
+    """
+    Runs `primary(cancel, first_token)` and, if `first_token` is not set within
+    `delay` seconds and `acquire_hedge()` allows it, `hedge(cancel, first_token)`
+    alongside it. Both are expected to set `first_token` on their first delta.
+
+    Returns the first successful result and cancels the other attempt. If both
+    fail, the primary's error is raised. `release_hedge` runs once the hedge has
+    finished, win or lose.
+    """
+    outcomes = queue.Queue()
+    tokens = []
+
+    def start(fn, name, release=None):
+        cancel, first_token = CancelToken(), threading.Event()
+        tokens.append(cancel)
+        # A context can only be entered by one thread at a time, so each attempt gets its own copy
+        ctx = contextvars.copy_context()
+
+        def run():
+            try:
+                outcomes.put((name, ctx.run(fn, cancel, first_token), None))
+            except BaseException as e:
+                outcomes.put((name, None, e))
+            finally:
+                first_token.set()
+                if release is not None:
+                    release()
+
+        threading.Thread(target=run, name=f"pageindex-llm-{name}", daemon=True).start()
+        return first_token
+
+    try:
+        pending = 1
+        primary_started = start(primary, "primary")
+        if not primary_started.wait(delay) and (acquire_hedge is None or acquire_hedge()):
+            if on_hedge is not None:
+                on_hedge()
+            start(hedge, "hedge", release_hedge)
+            pending += 1
+
+        errors = {}
+        while pending:
+            name, result, error = outcomes.get()
+            pending -= 1
+            if error is None:
+                return result
+            errors[name] = error
+        raise errors.get("primary") or errors["hedge"]
+    finally:
+        for cancel in tokens:
+            cancel.cancel()
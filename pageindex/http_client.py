@@ -0,0 +1,133 @@
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+
+class DNSCache:
+    """
+    TTL cache in front of socket.getaddrinfo.
+    Only hosts registered through `watch` are cached, everything else resolves normally.
+    """
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._hosts = set()
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._original = None
+
+    def watch(self, host):
+        if host:
+            with self._lock:
+                self._hosts.add(host.lower())
+
+    def install(self):
+        if self._original is not None or self.ttl <= 0:
+            return
+        self._original = socket.getaddrinfo
+        socket.getaddrinfo = self._getaddrinfo
+
+    def uninstall(self):
+        if self._original is not None:
+            socket.getaddrinfo = self._original
+            self._original = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _getaddrinfo(self, host, port, *args, **kwargs):
+        key_host = host.lower() if isinstance(host, str) else host
+        if key_host not in self._hosts:
+            return self._original(host, port, *args, **kwargs)
+
+        key = (key_host, port, args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit and hit[0] > now:
+                return hit[1]
+
+        result = self._original(host, port, *args, **kwargs)
+        with self._lock:
+            self._entries[key] = (now + self.ttl, result)
+        return result
+
+
+class _KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter that turns on TCP keep-alive probes for pooled sockets."""
+    def __init__(self, keep_alive=True, **kwargs):
+        self._keep_alive = keep_alive
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        options = list(HTTPConnection.default_socket_options)
+        if self._keep_alive:
+            options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+            # Linux only; other platforms keep the OS defaults
+            for name, value in (("TCP_KEEPIDLE", 60), ("TCP_KEEPINTVL", 15), ("TCP_KEEPCNT", 4)):
+                if hasattr(socket, name):
+                    options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+        kwargs["socket_options"] = options
+        super().init_poolmanager(*args, **kwargs)
+
+
+class PooledHTTPClient:
+    """
+    Shared HTTP client for the LLM endpoints.
+
+    Keeps one requests.Session (and therefore one urllib3 connection pool) per
+    endpoint origin, so repeated calls reuse the same TCP/TLS connection instead
+    of handshaking every time.
+    """
+    def __init__(self, pool_size=32, keep_alive=True, dns_cache_ttl=300, verify=False):
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.verify = verify
+        self.dns_cache = DNSCache(ttl=dns_cache_ttl)
+        self.dns_cache.install()
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _origin(self, url):
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}", parts.hostname
+
+    def session_for(self, url):
+        origin, host = self._origin(url)
+        with self._lock:
+            session = self._sessions.get(origin)
+            if session is None:
+                session = requests.Session()
+                # Proxies are disabled process-wide in utils; don't pick them up from env again
+                session.trust_env = False
+                adapter = _KeepAliveAdapter(
+                    keep_alive=self.keep_alive,
+                    pool_connections=1,
+                    pool_maxsize=self.pool_size,
+                    pool_block=False,
+                    max_retries=0,
+                )
+                session.mount(origin + "/", adapter)
+                if self.keep_alive:
+                    session.headers["Connection"] = "keep-alive"
+                else:
+                    session.headers["Connection"] = "close"
+                self.dns_cache.watch(host)
+                self._sessions[origin] = session
+            return session
+
+    def post(self, url, **kwargs):
+        kwargs.setdefault("verify", self.verify)
+        return self.session_for(url).post(url, **kwargs)
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+        self.dns_cache.uninstall()
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+from difflib import SequenceMatcher
+
+
+def page_hash(text):
+    return hashlib.blake2b((text or "").encode("utf-8"), digest_size=16).hexdigest()
+
+
+class PageDiff:
+    """
+    Page-level diff of two revisions of a document, from per-page text hashes.
+
+    `mapping` sends each unchanged old page to its new page (both 1-based), so
+    pages shifted by insertions or deletions still count as unchanged.
+    `changed` holds the new pages that have no unchanged counterpart.
+    """
+    def __init__(self, old_hashes, new_hashes):
+        self.mapping = {}
+        matcher = SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+        for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+            if tag == "equal":
+                for offset in range(old_end - old_start):
+                    self.mapping[old_start + offset + 1] = new_start + offset + 1
+        unchanged = set(self.mapping.values())
+        self.changed = {page for page in range(1, len(new_hashes) + 1) if page not in unchanged}
+        self.num_pages = len(new_hashes)
+
+    @property
+    def unchanged_ratio(self):
+        return 1 - len(self.changed) / self.num_pages if self.num_pages else 0.0
+
+    def touches_changed(self, start, end):
+        return any(page in self.changed for page in range(start, end + 1))
+
+
+def flatten_nodes(structure):
+    """(node, list holding it) for every node of a tree, in document (pre-)order."""
+    flat = []
+
+    def walk(nodes):
+        for node in nodes:
+            flat.append((node, nodes))
+            walk(node.get('nodes') or [])
+
+    walk(structure)
+    return flat
+
+
+def drop_node(node, siblings):
+    """Removes a node from its tree, moving its children up into its place."""
+    for i, sibling in enumerate(siblings):
+        if sibling is node:
+            siblings[i:i + 1] = node.get('nodes') or []
+            return
+
+
+def assign_new_node_ids(structure):
+    """Gives nodes without a node_id the next free ids; existing ids are left as they are."""
+    flat = [node for node, _ in flatten_nodes(structure)]
+    next_id = max((int(node['node_id']) for node in flat if str(node.get('node_id', '')).isdigit()), default=-1) + 1
+    for node in flat:
+        if not node.get('node_id'):
+            node['node_id'] = str(next_id).zfill(4)
+            next_id += 1
+    return structure
+
+
+def page_hashes_path(results_path):
+    """Where the page hashes of a `<name>_full.json` result are kept."""
+    return results_path[:-len("_full.json")] + "_pages.json" if results_path.endswith("_full.json") else results_path + ".pages.json"
+
+
+def save_page_hashes(results_path, hashes, extractor, options=None):
+    with open(page_hashes_path(results_path), "w", encoding="utf-8") as f:
+        json.dump({"extractor": extractor, "options": options or {}, "pages": hashes}, f)
+
+
+def load_previous_run(results_path, extractor, options=None):
+    """
+    (structure, page hashes) of the previous run saved at `results_path`, or None
+    when there is none, its pages were extracted by a different extractor, it
+    was built with different `options`, or it is partial (the LLM budget ran out).
+    """
+    hashes_path = page_hashes_path(results_path)
+    if not (os.path.exists(results_path) and os.path.exists(hashes_path)):
+        return None
+    try:
+        with open(hashes_path, encoding="utf-8") as f:
+            pages = json.load(f)
+        with open(results_path, encoding="utf-8") as f:
+            structure = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if pages.get("extractor") != extractor or not isinstance(structure, list):
+        return None
+    if pages.get("options", {}) != (options or {}):
+        return None
+    if any(isinstance(node, dict) and node.get("partial") for node in structure):
+        return None
+    return structure, pages.get("pages") or []
@@ -0,0 +1,167 @@
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from collections.abc import Sequence
+
+_MAGIC = b"PIPAGES1"
+_HEADER = struct.Struct("<8sq")
+
+
+class MappedPage(Sequence):
+    """
+    One page of a MappedPageList; unpacks like the `(text, tokens)` tuples of a
+    plain page_list. The text is only decoded when index 0 is read, so code that
+    just sums `page[1]` never touches the page text.
+    """
+    __slots__ = ("_pages", "_index")
+
+    def __init__(self, pages, index):
+        self._pages = pages
+        self._index = index
+
+    def __len__(self):
+        return 2
+
+    def __getitem__(self, item):
+        if item in (0, -2):
+            return self._pages.text(self._index)
+        if item in (1, -1):
+            return self._pages.tokens(self._index)
+        raise IndexError(item)
+
+
+class MappedPageList(Sequence):
+    """
+    Drop-in replacement for page_list backed by one memory-mapped file.
+
+    The file holds a header, an offsets array (n+1 int64), a token count array
+    (n int64) and the UTF-8 text of every page back to back. Only the pages
+    being read are paged in, so the resident size stays flat however long the
+    document is. Slicing returns a view on the same mapping, no text is copied.
+    """
+    def __init__(self, path, _parent=None, _start=0, _stop=None):
+        if _parent is None:
+            self.path = path
+            with open(path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, count = _HEADER.unpack_from(self._mmap, 0)
+            if magic != _MAGIC:
+                self._mmap.close()
+                raise ValueError(f"{path} is not a page file")
+            view = memoryview(self._mmap)
+            offsets_at = _HEADER.size
+            tokens_at = offsets_at + (count + 1) * 8
+            self._data_at = tokens_at + count * 8
+            self._offsets = view[offsets_at:tokens_at].cast("q")
+            self._tokens = view[tokens_at:self._data_at].cast("q")
+            self._view = view
+            self._count = count
+        else:
+            self.path = _parent.path
+            self._mmap, self._view = _parent._mmap, _parent._view
+            self._offsets, self._tokens = _parent._offsets, _parent._tokens
+            self._data_at, self._count = _parent._data_at, _parent._count
+        self._start = _start
+        self._stop = self._count if _stop is None else _stop
+
+    @classmethod
+    def build(cls, pages, path):
+        """
+        Writes `(text, tokens)` pairs to a page file at `path` and maps it.
+        `pages` may be a generator: texts are streamed to disk one at a time.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        offsets, tokens = array("q", [0]), array("q")
+        with tempfile.TemporaryFile(dir=directory) as data:
+            for text, token_count in pages:
+                data.write(text.encode("utf-8"))
+                offsets.append(data.tell())
+                tokens.append(token_count)
+            data.seek(0)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as out:
+                    out.write(_HEADER.pack(_MAGIC, len(tokens)))
+                    out.write(offsets.tobytes())
+                    out.write(tokens.tobytes())
+                    for block in iter(lambda: data.read(1024 * 1024), b""):
+                        out.write(block)
+                # Readers only ever see a complete file
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        return cls(path)
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def _absolute(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("page index out of range")
+        return self._start + index
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            stop = max(start, stop)
+            return MappedPageList(None, _parent=self, _start=self._start + start, _stop=self._start + stop)
+        return MappedPage(self, self._absolute(item) - self._start)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield MappedPage(self, i)
+
+    def page_bytes(self, index):
+        """Zero-copy memoryview of the page's UTF-8 text."""
+        i = self._absolute(index)
+        return self._view[self._data_at + self._offsets[i]:self._data_at + self._offsets[i + 1]]
+
+    def text(self, index):
+        return str(self.page_bytes(index), "utf-8")
+
+    def tokens(self, index):
+        return self._tokens[self._absolute(index)]
+
+    def close(self):
+        # Views share the parent's mapping; only close through the list that opened it
+        self._offsets.release()
+        self._tokens.release()
+        self._view.release()
+        self._mmap.close()
+
+
+class TaggedPages(Sequence):
+    """
+    Lazy `<physical_index_N>`-tagged view over a page_list (plain or mapped).
+
+    Item i is the tagged text of page_list[i], numbered from `start_index`;
+    strings are built on access instead of keeping a tagged copy of the document.
+    """
+    def __init__(self, page_list, start_index=1):
+        self.page_list = page_list
+        self.start_index = start_index
+
+    def __len__(self):
+        return len(self.page_list)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        page_number = item + self.start_index
+        return f"<physical_index_{page_number}>\n{self.page_list[item][0]}\n<physical_index_{page_number}>\n\n"
+
+    def pages(self, first, last):
+        """Tagged texts of page numbers first..last (inclusive), skipping pages outside the document."""
+        lo = max(first - self.start_index, 0)
+        hi = min(last - self.start_index + 1, len(self))
+        return [self[i] for i in range(lo, hi)]
@@ -0,0 +1,91 @@
+import logging
+import re
+import unicodedata
+from collections import deque
+
+import PyPDF2
+
+
+def _clean_title(title):
+    return re.sub(r"\s+", " ", str(title or "").replace("\x00", "")).strip()
+
+
+def _match_key(text):
+    # Case, width and spacing differ freely between bookmarks and the rendered heading
+    text = unicodedata.normalize("NFKC", text).lower()
+    return re.sub(r"[\W_]+", "", text)
+
+
+def read_outline(pdf):
+    """
+    Flattens the outline (bookmarks) of a PDF into TOC items in reading order:
+    [{'structure': '1.2', 'title': ..., 'physical_index': 1-based page or None}].
+    Returns [] for a PDF without an outline or with one PyPDF2 cannot read.
+    """
+    try:
+        reader = pdf if isinstance(pdf, PyPDF2.PdfReader) else PyPDF2.PdfReader(pdf)
+        outline = reader.outline
+    except Exception as e:
+        logging.warning(f"Could not read the PDF outline ({type(e).__name__}: {e})")
+        return []
+    num_pages = len(reader.pages)
+    items = []
+
+    def physical_index(entry):
+        try:
+            page = reader.get_destination_page_number(entry)
+        except Exception:
+            return None
+        return page + 1 if isinstance(page, int) and 0 <= page < num_pages else None
+
+    def walk(entries, prefix):
+        number = 0
+        queue = deque(entries)
+        while queue:
+            entry = queue.popleft()
+            if isinstance(entry, list):
+                if number:
+                    # A nested list holds the children of the entry before it
+                    walk(entry, f"{prefix}{number}.")
+                else:
+                    # Children without a parent: promote them to this level
+                    queue.extendleft(reversed(entry))
+                continue
+            title = _clean_title(getattr(entry, "title", None))
+            if not title:
+                continue
+            number += 1
+            items.append({
+                "structure": f"{prefix}{number}",
+                "title": title,
+                "physical_index": physical_index(entry),
+            })
+
+    walk(outline or [], "")
+    return items
+
+
+def outline_coverage(items, page_list):
+    """
+    Cheap check of how far an outline can be trusted, without any LLM call.
+
+    An entry counts as covered when it resolves to a page, does not go back
+    before the previous resolved entry, and its title occurs in that page's
+    text (pages without extractable text are given the benefit of the doubt).
+    Returns the covered fraction of all entries.
+    """
+    if not items:
+        return 0.0
+    covered = 0
+    previous = 0
+    for item in items:
+        page = item.get("physical_index")
+        if page is None or page > len(page_list):
+            continue
+        in_order = page >= previous
+        previous = max(previous, page)
+        page_key = _match_key(page_list[page - 1][0])
+        title_key = _match_key(item["title"])
+        if in_order and (not page_key or title_key[:40] in page_key):
+            covered += 1
+    return covered / len(items)
@@ -5,6 +5,7 @@ import math
 import random
 import re
 import asyncio
+import contextvars
 from io import BytesIO
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -13,15 +14,22 @@ from .utils import (
     ChatGPT_API,
     ChatGPT_API_async,
     ChatGPT_API_with_finish_reason,
+    ChatGPT_API_decision,
+    ChatGPT_API_decision_async,
+    decision_reply_format,
     add_node_text,
+    close_async_client,
     generate_summaries_for_structure,
     add_preface_if_needed,
     convert_page_to_int,
     clean_page_numbers,
     remove_structure_text,
     extract_json,
-    count_tokens,
+    count_tokens_batch,
     get_page_tokens,
+    normalize_page_list,
+    MappedPageList,
+    PAGE_EXTRACTOR_VERSION,
     write_node_id,
     post_processing,
     JsonLogger,
@@ -29,8 +37,19 @@ from .utils import (
     get_pdf_name,
     convert_physical_index_to_int,
     get_json_content,
+    get_llm_cache,
+    get_endpoint_pool,
     config
 )
+from .mapped_pages import TaggedPages
+from .outline import read_outline, outline_coverage
+from .toc_detect import toc_page_score
+from .title_match import heading_match_score, normalize_title_text, strip_numbering, title_match_score
+from .alignment import PageAligner
+from .page_labels import page_label_map
+from .incremental import PageDiff, page_hash, flatten_nodes, drop_node, assign_new_node_ids, save_page_hashes, load_previous_run
+from .budget import DocumentBudget, document_budget, get_document_budget, budget_low, budget_exhausted
+from .telemetry import run_report, start_metrics_server, tag_stage
 
 ################### check title in page #########################################################
 async def check_title_appearance(item, page_list, start_index=1, model=None):    
@@ -62,21 +81,176 @@ async def check_title_appearance(item, page_list, start_index=1, model=None):
     The given page_text is {page_text}.
     
     Reply format:
-    {{
-        "thinking": <why do you think the section appears or starts in the page_text>
-        "answer": "yes or no" (yes if the section appears or starts in the page_text, no otherwise)
-    }}
+    {decision_reply_format("answer", '"yes or no" (yes if the section appears or starts in the page_text, no otherwise)',
+                           '<why do you think the section appears or starts in the page_text>')}
     Directly return the final JSON structure. Do not output anything else."""
 
-    response = await ChatGPT_API_async(model=model, prompt=prompt)
-    response = extract_json(response)
-    if 'answer' in response:
-        answer = response['answer']
-    else:
-        answer = 'no'
+    answer = await ChatGPT_API_decision_async(model, prompt, "answer")
     return {'list_index': item.get('list_index'), 'answer': answer, 'title': title, 'page_number': page_number}
+
+
+def group_items_for_batch_check(items, batch_size=8, page_window=1):
+    """
+    Groups TOC items (already carrying an int physical_index) for batched verification.
+    Items are ordered by page; a group holds at most `batch_size` items whose pages
+    lie within `page_window` of the group's first page, so each prompt only carries
+    a handful of pages.
+    """
+    ordered = sorted(items, key=lambda x: int(x['physical_index']))
+    groups = []
+    current = []
+    for item in ordered:
+        page = int(item['physical_index'])
+        if current and (len(current) >= batch_size or page - int(current[0]['physical_index']) > page_window):
+            groups.append(current)
+            current = []
+        current.append(item)
+    if current:
+        groups.append(current)
+    return groups
+
+
+async def check_title_appearance_batch(items, page_list, start_index=1, model=None):
+    """
+    Batched variant of check_title_appearance: one LLM call answers yes/no for several
+    (title, page) pairs that sit on the same or nearby pages. Returns results in the
+    same shape as check_title_appearance, in input order. Items the model leaves out
+    of its answer are re-checked one by one.
+    """
+    results = {}
+    checkable = []
+    for pos, item in enumerate(items):
+        title = item['title']
+        try:
+            page_number = int(item['physical_index'])
+        except (KeyError, ValueError, TypeError):
+            results[pos] = {'list_index': item.get('list_index'), 'answer': 'no', 'title': title, 'page_number': None}
+            continue
+        list_idx = page_number - start_index
+        if list_idx < 0 or list_idx >= len(page_list):
+            results[pos] = {'list_index': item.get('list_index'), 'answer': 'no', 'title': title, 'page_number': page_number}
+            continue
+        checkable.append((pos, item, page_number))
+
+    if len(checkable) == 1:
+        pos, item, _ = checkable[0]
+        results[pos] = await check_title_appearance(item, page_list, start_index, model)
+    elif checkable:
+        pages = sorted({page_number for _, _, page_number in checkable})
+        page_text = ""
+        for page_number in pages:
+            page_text += f"<physical_index_{page_number}>\n{page_list[page_number - start_index][0]}\n<physical_index_{page_number}>\n\n"
+        questions = [
+            {'id': i, 'title': item['title'], 'physical_index': page_number}
+            for i, (_, item, page_number) in enumerate(checkable)
+        ]
+
+        prompt = f"""
+    Your job is to check, for each given section, if the section appears or starts in the page with the given physical_index.
+
+    Note: do fuzzy matching, ignore any space inconsistency in the page text.
+
+    The provided pages contain tags like <physical_index_X> and <physical_index_X> to indicate the physical location of the page X.
+
+    The given sections are:
+    {json.dumps(questions, ensure_ascii=False, indent=2)}
+
+    The given pages are:
+    {page_text}
+
+    Reply format (one entry per given section, same id):
+    [
+        {{"id": <id>, "answer": "yes or no"}} (yes if the section appears or starts in its page, no otherwise),
+        ...
+    ]
+    Directly return the final JSON structure. Do not output anything else."""
+
+        response = await ChatGPT_API_async(model=model, prompt=prompt)
+        response = extract_json(response)
+        answers = {}
+        if isinstance(response, list):
+            for entry in response:
+                if isinstance(entry, dict) and 'id' in entry and 'answer' in entry:
+                    try:
+                        answers[int(entry['id'])] = str(entry['answer']).strip().lower()
+                    except (ValueError, TypeError):
+                        continue
+
+        missing = []
+        for i, (pos, item, page_number) in enumerate(checkable):
+            if i in answers:
+                results[pos] = {'list_index': item.get('list_index'), 'answer': answers[i], 'title': item['title'], 'page_number': page_number}
+            else:
+                missing.append((pos, item))
+        if missing:
+            singles = await asyncio.gather(*[check_title_appearance(item, page_list, start_index, model) for _, item in missing])
+            for (pos, _), single in zip(missing, singles):
+                results[pos] = single
+
+    return [results[pos] for pos in range(len(items))]
+
+
+async def check_title_appearance_batched(items, page_list, start_index=1, model=None, batch_size=8, page_window=1):
+    """Verifies many items with batch_size items per prompt; returns results in input order."""
+    if batch_size <= 1:
+        return await asyncio.gather(*[check_title_appearance(item, page_list, start_index, model) for item in items])
+
+    keyed = []
+    unplaceable = []
+    for pos, item in enumerate(items):
+        try:
+            int(item['physical_index'])
+            keyed.append(dict(item, _batch_pos=pos))
+        except (KeyError, ValueError, TypeError):
+            unplaceable.append(pos)
+
+    groups = group_items_for_batch_check(keyed, batch_size=batch_size, page_window=page_window)
+    group_results = await asyncio.gather(*[
+        check_title_appearance_batch(group, page_list, start_index, model) for group in groups
+    ])
+
+    results = [None] * len(items)
+    for group, answers in zip(groups, group_results):
+        for item, answer in zip(group, answers):
+            results[item['_batch_pos']] = answer
+    for pos in unplaceable:
+        item = items[pos]
+        results[pos] = {'list_index': item.get('list_index'), 'answer': 'no', 'title': item['title'], 'page_number': None}
+    return results
+
+def title_match_thresholds(opt):
+    """(reject, accept) confidence bounds for local title matching, or None when it is off."""
+    if getattr(opt, 'local_title_match', 'no') != 'yes':
+        return None
+    return float(getattr(opt, 'title_match_reject', 0.5)), float(getattr(opt, 'title_match_accept', 0.9))
+
+
+def local_title_answer(title, page_text, thresholds, at_start=False, min_length=6):
+    """
+    'yes' or 'no' when the local matcher is confident either way, None when the LLM has to decide.
+
+    A title is only found locally where it stands as a heading; mentions in
+    running text, and titles shorter than `min_length` characters, are left to
+    the LLM.
+    """
+    if not thresholds:
+        return None
+    reject, accept = thresholds
+    score = title_match_score(title, page_text)
+    if score is None:
+        return None
+    if score < reject:
+        # Not on the page at all, so it cannot start it either
+        return 'no'
+    if len(normalize_title_text(strip_numbering(title)) or normalize_title_text(title)) < min_length:
+        return None
+    if heading_match_score(title, page_text, at_start=at_start) >= accept:
+        return 'yes'
+    return None
+
 #####################################################
 
+
 async def check_title_appearance_in_start(title, page_text, model=None, logger=None):    
     prompt = f"""
     You will be given the current section title and the current page_text.
@@ -90,20 +264,18 @@ async def check_title_appearance_in_start(title, page_text, model=None, logger=N
     The given page_text is {page_text}.
     
     reply format:
-    {{
-        "thinking": <why do you think the section appears or starts in the page_text>
-        "start_begin": "yes or no" (yes if the section starts in the beginning of the page_text, no otherwise)
-    }}
+    {decision_reply_format("start_begin", '"yes or no" (yes if the section starts in the beginning of the page_text, no otherwise)',
+                           '<why do you think the section appears or starts in the page_text>')}
     Directly return the final JSON structure. Do not output anything else."""
 
-    response = await ChatGPT_API_async(model=model, prompt=prompt)
-    response = extract_json(response)
+    start_begin = await ChatGPT_API_decision_async(model, prompt, "start_begin")
     if logger:
-        logger.info(f"Response: {response}")
-    return response.get("start_begin", "no")
+        logger.info(f"Response: start_begin={start_begin}")
+    return start_begin
 
 
-async def check_title_appearance_in_start_concurrent(structure, page_list, model=None, logger=None):
+@tag_stage('check_title_appearance_in_start')
+async def check_title_appearance_in_start_concurrent(structure, page_list, model=None, logger=None, title_match=None):
     if logger:
         logger.info("Checking title appearance in start concurrently")
     
@@ -118,6 +290,10 @@ async def check_title_appearance_in_start_concurrent(structure, page_list, model
             idx = int(item['physical_index'])
             if 0 < idx <= len(page_list):
                 page_text = page_list[idx - 1][0]
+                local_answer = local_title_answer(item['title'], page_text, title_match, at_start=True)
+                if local_answer is not None:
+                    item['appear_start'] = local_answer
+                    continue
                 tasks.append(check_title_appearance_in_start(item['title'], page_text, model=model, logger=logger))
                 valid_items.append(item)
 
@@ -140,17 +316,12 @@ def toc_detector_single_page(content, model=None):
     Given text: {content}
 
     return the following JSON format:
-    {{
-        "thinking": <why do you think there is a table of content in the given text>
-        "toc_detected": "<yes or no>",
-    }}
+    {decision_reply_format("toc_detected", '"<yes or no>"', '<why do you think there is a table of content in the given text>')}
 
     Directly return the final JSON structure. Do not output anything else.
     Please note: abstract,summary, notation list, figure list, table list, etc. are not table of contents."""
 
-    response = ChatGPT_API(model=model, prompt=prompt)
-    json_content = extract_json(response)    
-    return json_content.get('toc_detected', 'no')
+    return ChatGPT_API_decision(model, prompt, "toc_detected")
 
 
 def check_if_toc_extraction_is_complete(content, toc, model=None):
@@ -159,16 +330,11 @@ def check_if_toc_extraction_is_complete(content, toc, model=None):
     Your job is to check if the  table of contents is complete, which it contains all the main sections in the partial document.
 
     Reply format:
-    {{
-        "thinking": <why do you think the table of contents is complete or not>
-        "completed": "yes" or "no"
-    }}
+    {decision_reply_format("completed", '"yes" or "no"', '<why do you think the table of contents is complete or not>')}
     Directly return the final JSON structure. Do not output anything else."""
 
     prompt = prompt + '\n Document:\n' + content + '\n Table of contents:\n' + toc
-    response = ChatGPT_API(model=model, prompt=prompt)
-    json_content = extract_json(response)
-    return json_content.get('completed', 'no')
+    return ChatGPT_API_decision(model, prompt, "completed")
 
 
 def check_if_toc_transformation_is_complete(content, toc, model=None):
@@ -177,17 +343,13 @@ def check_if_toc_transformation_is_complete(content, toc, model=None):
     Your job is to check if the  table of contents is complete.
 
     Reply format:
-    {{
-        "thinking": <why do you think the cleaned table of contents is complete or not>
-        "completed": "yes" or "no"
-    }}
+    {decision_reply_format("completed", '"yes" or "no"', '<why do you think the cleaned table of contents is complete or not>')}
     Directly return the final JSON structure. Do not output anything else."""
 
     prompt = prompt + '\n Raw Table of contents:\n' + content + '\n Cleaned Table of contents:\n' + toc
-    response = ChatGPT_API(model=model, prompt=prompt)
-    json_content = extract_json(response)
-    return json_content.get('completed', 'no')
+    return ChatGPT_API_decision(model, prompt, "completed")
 
+@tag_stage('extract_toc_content')
 def extract_toc_content(content, model=None):
     prompt = f"""
     Your job is to extract the full table of contents from the given text, replace ... with :
@@ -218,6 +380,8 @@ def extract_toc_content(content, model=None):
         ]
         prompt = f"""please continue the generation of table of contents , directly output the remaining part of the structure"""
         new_response, finish_reason = ChatGPT_API_with_finish_reason(model=model, prompt=prompt, chat_history=chat_history)
+        if finish_reason == 'budget_exhausted':
+            break
         response = response + new_response
         if_complete = check_if_toc_transformation_is_complete(content, response, model)
         
@@ -236,16 +400,13 @@ def detect_page_index(toc_content, model=None):
     Given text: {toc_content}
 
     Reply format:
-    {{
-        "thinking": <why do you think there are page numbers/indices given within the table of contents>
-        "page_index_given_in_toc": "<yes or no>"
-    }}
+    {decision_reply_format("page_index_given_in_toc", '"<yes or no>"',
+                           '<why do you think there are page numbers/indices given within the table of contents>')}
     Directly return the final JSON structure. Do not output anything else."""
 
-    response = ChatGPT_API(model=model, prompt=prompt)
-    json_content = extract_json(response)
-    return json_content.get('page_index_given_in_toc', 'no')
+    return ChatGPT_API_decision(model, prompt, "page_index_given_in_toc")
 
+@tag_stage('toc_extractor')
 def toc_extractor(page_list, toc_page_list, model):
     def transform_dots_to_colon(text):
         text = re.sub(r'\.{5,}', ': ', text)
@@ -266,6 +427,7 @@ def toc_extractor(page_list, toc_page_list, model):
 
 
 
+@tag_stage('toc_index_extractor')
 def toc_index_extractor(toc, content, model=None):
     print('start toc_index_extractor')
     tob_extractor_prompt = """
@@ -296,6 +458,7 @@ def toc_index_extractor(toc, content, model=None):
 
 
 
+@tag_stage('toc_transformer')
 def toc_transformer(toc_content, model=None):
     print('start toc_transformer')
     init_prompt = """
@@ -344,6 +507,8 @@ def toc_transformer(toc_content, model=None):
         Please continue the json structure, directly output the remaining part of the json structure."""
 
         new_complete, finish_reason = ChatGPT_API_with_finish_reason(model=model, prompt=prompt)
+        if finish_reason == 'budget_exhausted':
+            break
 
         if new_complete.startswith('```json'):
             new_complete =  get_json_content(new_complete)
@@ -358,16 +523,56 @@ def toc_transformer(toc_content, model=None):
     except:
         return []
 
+def detect_toc_pages(page_indices, page_list, opt, logger=None):
+    """
+    {page index: 'yes' or 'no'} for the given pages. Pages the local scorer is sure
+    about are decided without the LLM; the ambiguous ones are asked concurrently.
+    """
+    if getattr(opt, 'toc_prefilter', 'no') != 'yes':
+        return {i: toc_detector_single_page(page_list[i][0], model=opt.model) for i in page_indices}
+
+    reject = float(getattr(opt, 'toc_prefilter_reject', 0.2))
+    accept = float(getattr(opt, 'toc_prefilter_accept', 0.75))
+    results, ambiguous = {}, []
+    for i in page_indices:
+        score = toc_page_score(page_list[i][0])
+        if score >= accept:
+            results[i] = 'yes'
+        elif score < reject:
+            results[i] = 'no'
+        else:
+            ambiguous.append(i)
+    if logger:
+        logger.info({'toc_prefilter': {'pages': len(page_indices), 'llm_checked': ambiguous}})
+
+    if ambiguous:
+        workers = min(len(ambiguous), int(getattr(opt, 'toc_detect_workers', 4)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Threads do not inherit contextvars: keep stage attribution and the document budget
+            futures = {
+                executor.submit(contextvars.copy_context().run, toc_detector_single_page, page_list[i][0], opt.model): i
+                for i in ambiguous
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+    return results
+
+
+@tag_stage('find_toc_pages')
 def find_toc_pages(start_page_index, page_list, opt, logger=None):
     print('start find_toc_pages')
     last_page_is_yes = False
     toc_page_list = []
+
+    # Pages within toc_check_page_num are decided up front; a TOC running past it is followed page by page
+    first_pages = range(start_page_index, min(len(page_list), opt.toc_check_page_num))
+    detected = detect_toc_pages(first_pages, page_list, opt, logger=logger)
     i = start_page_index
     
     while i < len(page_list):
         if i >= opt.toc_check_page_num and not last_page_is_yes:
             break
-        detected_result = toc_detector_single_page(page_list[i][0],model=opt.model)
+        detected_result = detected[i] if i in detected else detect_toc_pages([i], page_list, opt)[i]
         if detected_result == 'yes':
             if logger:
                 logger.info(f'Page {i} has toc')
@@ -438,10 +643,19 @@ def calculate_page_offset(pairs):
     most_common = max(difference_counts.items(), key=lambda x: x[1])[0]
     return most_common
 
-def add_page_offset_to_toc_json(data, offset):
+def add_page_offset_to_toc_json(data, offset, page_map=None):
+    previous = None
     for i in range(len(data)):
-        if data[i].get('page') is not None and isinstance(data[i]['page'], int):
-            data[i]['physical_index'] = data[i]['page'] + offset
+        physical_index = None
+        label = data[i].get('page_label', data[i].get('page'))
+        if page_map is not None and label is not None:
+            # Per-page map: handles roman front matter and numbering that restarts between parts
+            physical_index = page_map.physical_index(label, after=previous)
+        if physical_index is None and data[i].get('page') is not None and isinstance(data[i]['page'], int):
+            physical_index = data[i]['page'] + offset
+        if physical_index is not None:
+            data[i]['physical_index'] = physical_index
+            previous = physical_index
             # Keep 'page' for reference or delete it?
             # del data[i]['page'] 
     return data
@@ -517,6 +731,7 @@ def remove_first_physical_index_section(text):
         return text.replace(match.group(0), '', 1)
     return text
 
+@tag_stage('generate_toc_continue')
 def generate_toc_continue(toc_content, part, model="gpt-4o-2024-11-20"):
     print('start generate_toc_continue')
     prompt = """
@@ -548,9 +763,14 @@ def generate_toc_continue(toc_content, part, model="gpt-4o-2024-11-20"):
     response, finish_reason = ChatGPT_API_with_finish_reason(model=model, prompt=prompt)
     if finish_reason == 'finished':
         return extract_json(response)
+    elif finish_reason == 'budget_exhausted':
+        # Out of budget: the structure generated so far is all there will be
+        get_document_budget().note('stopped TOC generation')
+        return []
     else:
         raise Exception(f'finish reason: {finish_reason}')
     
+@tag_stage('generate_toc_init')
 def generate_toc_init(part, model=None):
     print('start generate_toc_init')
     prompt = """
@@ -582,21 +802,24 @@ def generate_toc_init(part, model=None):
 
     if finish_reason == 'finished':
          return extract_json(response)
+    elif finish_reason == 'budget_exhausted':
+        get_document_budget().note('stopped TOC generation')
+        return []
     else:
         raise Exception(f'finish reason: {finish_reason}')
 
+@tag_stage('process_no_toc')
 def process_no_toc(page_list, start_index=1, model=None, logger=None):
-    page_contents=[]
-    token_lengths=[]
-    for page_index in range(start_index, start_index+len(page_list)):
-        page_text = f"<physical_index_{page_index}>\n{page_list[page_index-start_index][0]}\n<physical_index_{page_index}>\n\n"
-        page_contents.append(page_text)
-        token_lengths.append(count_tokens(page_text, model))
+    page_contents = TaggedPages(page_list, start_index)
+    token_lengths = count_tokens_batch(page_contents, model)
     group_texts = page_list_to_group_text(page_contents, token_lengths)
     if logger: logger.info(f'len(group_texts): {len(group_texts)}')
 
     toc_with_page_number= generate_toc_init(group_texts[0], model)
     for group_text in group_texts[1:]:
+        if budget_exhausted():
+            get_document_budget().note('stopped TOC generation')
+            break
         toc_with_page_number_additional = generate_toc_continue(toc_with_page_number, group_text, model)    
         toc_with_page_number.extend(toc_with_page_number_additional)
     if logger: logger.info(f'generate_toc: {toc_with_page_number}')
@@ -606,15 +829,76 @@ def process_no_toc(page_list, start_index=1, model=None, logger=None):
 
     return toc_with_page_number
 
-def process_toc_no_page_numbers(toc_content, toc_page_list, page_list,  start_index=1, model=None, logger=None):
-    page_contents=[]
-    token_lengths=[]
+
+def alignment_threshold(opt):
+    """Confidence a locally aligned TOC entry needs to keep its page, or None when alignment is off."""
+    if getattr(opt, 'toc_alignment', 'no') != 'yes':
+        return None
+    return float(getattr(opt, 'toc_alignment_min_confidence', 0.75))
+
+
+def align_toc_items(toc_items, page_list, start_index=1, min_confidence=0.75, skip_pages=()):
+    """
+    Gives TOC items a physical_index from a document-wide, order-preserving
+    alignment of their titles to the pages. Items below `min_confidence` are left
+    without one, for process_none_page_numbers to place between their neighbours.
+    """
+    titles = [item.get('title') or '' for item in toc_items]
+    aligner = PageAligner((page[0] for page in page_list), titles, first_page=start_index, skip_pages=skip_pages)
+    placements = aligner.align()
+    for item, (page, confidence) in zip(toc_items, placements):
+        item.pop('page', None)
+        if page is not None and confidence >= min_confidence:
+            item['physical_index'] = page
+        else:
+            item.pop('physical_index', None)
+    return toc_items
+
+
+def align_missing_items(toc_items, page_list, start_index=1, min_confidence=0.75):
+    """
+    Places each run of consecutive items without a physical_index on the pages
+    between the items around it, by local alignment. Items it is not confident
+    about stay as they are.
+    """
+    last_page = start_index + len(page_list) - 1
+    i = 0
+    while i < len(toc_items):
+        if "physical_index" in toc_items[i]:
+            i += 1
+            continue
+        j = i
+        while j < len(toc_items) and "physical_index" not in toc_items[j]:
+            j += 1
+        prev_physical_index = next((item['physical_index'] for item in reversed(toc_items[:i]) if item.get('physical_index') is not None), start_index)
+        next_physical_index = next((item['physical_index'] for item in toc_items[j:] if item.get('physical_index') is not None), last_page)
+        lo, hi = max(prev_physical_index, start_index), min(next_physical_index, last_page)
+        if lo <= hi:
+            window = page_list[lo - start_index:hi - start_index + 1]
+            aligner = PageAligner((page[0] for page in window), [item.get('title') or '' for item in toc_items[i:j]], first_page=lo)
+            for item, (page, confidence) in zip(toc_items[i:j], aligner.align()):
+                if page is not None and confidence >= min_confidence:
+                    item['physical_index'] = page
+                    item.pop('page', None)
+        i = j
+    return toc_items
+
+
+@tag_stage('process_toc_no_page_numbers')
+def process_toc_no_page_numbers(toc_content, toc_page_list, page_list,  start_index=1, model=None, logger=None, min_confidence=None):
     toc_content = toc_transformer(toc_content, model)
     if logger: logger.info(f'toc_transformer: {toc_content}')
-    for page_index in range(start_index, start_index+len(page_list)):
-        page_text = f"<physical_index_{page_index}>\n{page_list[page_index-start_index][0]}\n<physical_index_{page_index}>\n\n"
-        page_contents.append(page_text)
-        token_lengths.append(count_tokens(page_text, model))
+
+    if min_confidence is not None and toc_content:
+        # Local alignment first; the LLM only places the entries it is unsure about
+        toc_pages = {start_index + i for i in toc_page_list}
+        toc_with_page_number = align_toc_items(copy.deepcopy(toc_content), page_list, start_index, min_confidence, skip_pages=toc_pages)
+        unresolved = sum(1 for item in toc_with_page_number if 'physical_index' not in item)
+        if logger: logger.info({'toc_alignment': {'items': len(toc_with_page_number), 'unresolved': unresolved}})
+        print(f'aligned {len(toc_with_page_number) - unresolved}/{len(toc_with_page_number)} TOC items locally')
+        return process_none_page_numbers(toc_with_page_number, page_list, start_index=start_index, model=model, min_confidence=min_confidence)
+    page_contents = TaggedPages(page_list, start_index)
+    token_lengths = count_tokens_batch(page_contents, model)
     
     group_texts = page_list_to_group_text(page_contents, token_lengths)
     if logger: logger.info(f'len(group_texts): {len(group_texts)}')
@@ -631,34 +915,39 @@ def process_toc_no_page_numbers(toc_content, toc_page_list, page_list,  start_in
 
 
 
-def process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_check_page_num=None, model=None, logger=None):
+def process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_check_page_num=None, model=None, logger=None, min_confidence=None, page_map=None):
     toc_with_page_number = toc_transformer(toc_content, model)
     if logger: logger.info(f'toc_with_page_number: {toc_with_page_number}')
 
-    toc_no_page_number = remove_page_number(copy.deepcopy(toc_with_page_number))
-    
-    start_page_index = toc_page_list[-1] + 1
-    main_content = ""
-    for page_index in range(start_page_index, min(start_page_index + toc_check_page_num, len(page_list))):
-        if page_index < len(page_list):
-            main_content += f"<physical_index_{page_index+1}>\n{page_list[page_index][0]}\n<physical_index_{page_index+1}>\n\n"
+    if page_map is not None:
+        # Printed page numbers were read off the pages: no LLM round trip to find the offset
+        offset = page_map.dominant_offset()
+        if logger: logger.info({'page_label_coverage': page_map.coverage, 'offset': offset})
+    else:
+        toc_no_page_number = remove_page_number(copy.deepcopy(toc_with_page_number))
+        
+        start_page_index = toc_page_list[-1] + 1
+        main_content = ""
+        for page_index in range(start_page_index, min(start_page_index + toc_check_page_num, len(page_list))):
+            if page_index < len(page_list):
+                main_content += f"<physical_index_{page_index+1}>\n{page_list[page_index][0]}\n<physical_index_{page_index+1}>\n\n"
 
-    toc_with_physical_index = toc_index_extractor(toc_no_page_number, main_content, model)
-    if logger: logger.info(f'toc_with_physical_index: {toc_with_physical_index}')
+        toc_with_physical_index = toc_index_extractor(toc_no_page_number, main_content, model)
+        if logger: logger.info(f'toc_with_physical_index: {toc_with_physical_index}')
 
-    toc_with_physical_index = convert_physical_index_to_int(toc_with_physical_index)
-    if logger: logger.info(f'toc_with_physical_index: {toc_with_physical_index}')
+        toc_with_physical_index = convert_physical_index_to_int(toc_with_physical_index)
+        if logger: logger.info(f'toc_with_physical_index: {toc_with_physical_index}')
 
-    matching_pairs = extract_matching_page_pairs(toc_with_page_number, toc_with_physical_index, start_page_index)
-    if logger: logger.info(f'matching_pairs: {matching_pairs}')
+        matching_pairs = extract_matching_page_pairs(toc_with_page_number, toc_with_physical_index, start_page_index)
+        if logger: logger.info(f'matching_pairs: {matching_pairs}')
 
-    offset = calculate_page_offset(matching_pairs)
-    if logger: logger.info(f'offset: {offset}')
+        offset = calculate_page_offset(matching_pairs)
+        if logger: logger.info(f'offset: {offset}')
 
-    toc_with_page_number = add_page_offset_to_toc_json(toc_with_page_number, offset)
+    toc_with_page_number = add_page_offset_to_toc_json(toc_with_page_number, offset, page_map)
     if logger: logger.info(f'toc_with_page_number: {toc_with_page_number}')
 
-    toc_with_page_number = process_none_page_numbers(toc_with_page_number, page_list, model=model)
+    toc_with_page_number = process_none_page_numbers(toc_with_page_number, page_list, model=model, min_confidence=min_confidence)
     if logger: logger.info(f'toc_with_page_number: {toc_with_page_number}')
 
     return toc_with_page_number
@@ -666,7 +955,10 @@ def process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_che
 
 
 ##check if needed to process none page numbers
-def process_none_page_numbers(toc_items, page_list, start_index=1, model=None):
+@tag_stage('process_none_page_numbers')
+def process_none_page_numbers(toc_items, page_list, start_index=1, model=None, min_confidence=None):
+    if min_confidence is not None:
+        align_missing_items(toc_items, page_list, start_index, min_confidence)
     for i, item in enumerate(toc_items):
         if "physical_index" not in item:
             # Find previous physical_index
@@ -683,14 +975,7 @@ def process_none_page_numbers(toc_items, page_list, start_index=1, model=None):
                     next_physical_index = toc_items[j]['physical_index']
                     break
 
-            page_contents = []
-            for page_index in range(prev_physical_index, next_physical_index+1):
-                list_index = page_index - start_index
-                if list_index >= 0 and list_index < len(page_list):
-                    page_text = f"<physical_index_{page_index}>\n{page_list[list_index][0]}\n<physical_index_{page_index}>\n\n"
-                    page_contents.append(page_text)
-                else:
-                    continue
+            page_contents = TaggedPages(page_list, start_index).pages(prev_physical_index, next_physical_index)
 
             item_copy = copy.deepcopy(item)
             if 'page' in item_copy: del item_copy['page']
@@ -744,8 +1029,43 @@ def check_toc(page_list, opt=None):
             return {'toc_content': toc_json['toc_content'], 'toc_page_list': toc_page_list, 'page_index_given_in_toc': 'no'}
 
 
+def printed_page_map(doc, page_list, opt, logger=None):
+    """
+    PageLabelMap of the document's printed page numbers (from /PageLabels or the
+    page headers and footers), or None when too few pages carry one.
+    """
+    if getattr(opt, 'page_labels', 'no') != 'yes':
+        return None
+    page_map = page_label_map((page[0] for page in page_list), pdf=doc)
+    if logger:
+        logger.info({'page_label_coverage': page_map.coverage})
+    if page_map.coverage < float(getattr(opt, 'page_labels_min_coverage', 0.5)):
+        return None
+    return page_map
+
+
+def outline_toc(doc, page_list, opt, logger=None):
+    """
+    TOC items straight from the PDF's own outline (bookmarks), or None when the
+    document has none or it does not cover enough of its entries to be trusted.
+    """
+    if getattr(opt, 'use_pdf_outline', 'no') != 'yes':
+        return None
+    items = read_outline(doc)
+    if len(items) < int(getattr(opt, 'outline_min_entries', 3)):
+        return None
+    coverage = outline_coverage(items, page_list)
+    if logger:
+        logger.info({'outline_entries': len(items), 'outline_coverage': coverage})
+    if coverage < float(getattr(opt, 'outline_min_coverage', 0.8)):
+        print(f'outline found but not used (coverage {coverage*100:.0f}%)')
+        return None
+    print(f'using the PDF outline ({len(items)} entries)')
+    return items
+
+
 ################### fix incorrect toc #########################################################
-def single_toc_item_index_fixer(section_title, content, model="gpt-4o-2024-11-20"):
+async def single_toc_item_index_fixer(section_title, content, model="gpt-4o-2024-11-20"):
     tob_extractor_prompt = """
     You are given a section title and several pages of a document, your job is to find the physical index of the start page of the section in the partial document.
 
@@ -759,20 +1079,21 @@ def single_toc_item_index_fixer(section_title, content, model="gpt-4o-2024-11-20
     Directly return the final JSON structure. Do not output anything else."""
 
     prompt = tob_extractor_prompt + '\nSection Title:\n' + str(section_title) + '\nDocument pages:\n' + content
-    response = ChatGPT_API(model=model, prompt=prompt)
+    response = await ChatGPT_API_async(model=model, prompt=prompt)
     json_content = extract_json(response)    
     return convert_physical_index_to_int([json_content])[0].get('physical_index')
 
 
 
-async def fix_incorrect_toc(toc_with_page_number, page_list, incorrect_results, start_index=1, model=None, logger=None):
+@tag_stage('fix_incorrect_toc')
+async def fix_incorrect_toc(toc_with_page_number, page_list, incorrect_results, start_index=1, model=None, logger=None, batch_size=1, page_window=1):
     print(f'start fix_incorrect_toc with {len(incorrect_results)} incorrect results')
     incorrect_indices = {result['list_index'] for result in incorrect_results}
     
     end_index = len(page_list) + start_index - 1
     
-    # Helper function to process and check a single incorrect item
-    async def process_and_check_item(incorrect_item):
+    # Helper function to find the new index of a single incorrect item
+    async def process_item(incorrect_item):
         try:
             list_index = incorrect_item['list_index']
             
@@ -801,37 +1122,23 @@ async def fix_incorrect_toc(toc_with_page_number, page_list, incorrect_results,
             if next_correct is None:
                 next_correct = end_index
             
-            page_contents=[]
-            for page_index in range(prev_correct, next_correct+1):
-                list_index_local = page_index - start_index
-                if list_index_local >= 0 and list_index_local < len(page_list):
-                    page_text = f"<physical_index_{page_index}>\n{page_list[list_index_local][0]}\n<physical_index_{page_index}>\n\n"
-                    page_contents.append(page_text)
-                else:
-                    continue
-            content_range = ''.join(page_contents)
+            content_range = ''.join(TaggedPages(page_list, start_index).pages(prev_correct, next_correct))
             
-            physical_index_int = single_toc_item_index_fixer(incorrect_item['title'], content_range, model)
+            physical_index_int = await single_toc_item_index_fixer(incorrect_item['title'], content_range, model)
             
             if physical_index_int is None:
                 return None
 
-            # Check if the result is correct
-            check_item = incorrect_item.copy()
-            check_item['physical_index'] = physical_index_int
-            check_result = await check_title_appearance(check_item, page_list, start_index, model)
-
             return {
                 'list_index': list_index,
                 'title': incorrect_item['title'],
                 'physical_index': physical_index_int,
-                'is_valid': check_result['answer'] == 'yes'
             }
         except Exception as e:
             if logger: logger.error(f"Error fixing item {incorrect_item}: {e}")
             return None
 
-    tasks = [process_and_check_item(item) for item in incorrect_results]
+    tasks = [process_item(item) for item in incorrect_results]
     results = await asyncio.gather(*tasks, return_exceptions=True)
     
     valid_results = []
@@ -839,6 +1146,14 @@ async def fix_incorrect_toc(toc_with_page_number, page_list, incorrect_results,
         if r and not isinstance(r, Exception):
             valid_results.append(r)
 
+    # Check if the new indices are correct, several items per prompt
+    check_results = await check_title_appearance_batched(
+        valid_results, page_list, start_index, model,
+        batch_size=batch_size, page_window=page_window
+    )
+    for result, check_result in zip(valid_results, check_results):
+        result['is_valid'] = check_result['answer'] == 'yes'
+
     invalid_results = []
     for result in valid_results:
         if result['is_valid']:
@@ -854,7 +1169,7 @@ async def fix_incorrect_toc(toc_with_page_number, page_list, incorrect_results,
 
 
 
-async def fix_incorrect_toc_with_retries(toc_with_page_number, page_list, incorrect_results, start_index=1, max_attempts=3, model=None, logger=None):
+async def fix_incorrect_toc_with_retries(toc_with_page_number, page_list, incorrect_results, start_index=1, max_attempts=3, model=None, logger=None, batch_size=1, page_window=1):
     print('start fix_incorrect_toc')
     fix_attempt = 0
     current_toc = toc_with_page_number
@@ -863,7 +1178,11 @@ async def fix_incorrect_toc_with_retries(toc_with_page_number, page_list, incorr
     while current_incorrect:
         print(f"Fixing {len(current_incorrect)} incorrect results")
         
-        current_toc, current_incorrect = await fix_incorrect_toc(current_toc, page_list, current_incorrect, start_index, model, logger)
+        if budget_low():
+            get_document_budget().note('stopped fixing incorrect toc items')
+            break
+
+        current_toc, current_incorrect = await fix_incorrect_toc(current_toc, page_list, current_incorrect, start_index, model, logger, batch_size=batch_size, page_window=page_window)
                 
         fix_attempt += 1
         if fix_attempt >= max_attempts:
@@ -876,7 +1195,8 @@ async def fix_incorrect_toc_with_retries(toc_with_page_number, page_list, incorr
 
 
 ################### verify toc #########################################################
-async def verify_toc(page_list, list_result, start_index=1, N=None, model=None):
+@tag_stage('verify_toc')
+async def verify_toc(page_list, list_result, start_index=1, N=None, model=None, batch_size=1, page_window=1, title_match=None, indices=None):
     print('start verify_toc')
     # Find the last non-None physical_index
     last_physical_index = None
@@ -889,7 +1209,10 @@ async def verify_toc(page_list, list_result, start_index=1, N=None, model=None):
         return 0, []
     
     # Determine which items to check
-    if N is None:
+    if indices is not None:
+        print(f'check {len(indices)} given items')
+        sample_indices = indices
+    elif N is None:
         print('check all items')
         sample_indices = range(0, len(list_result))
     else:
@@ -905,11 +1228,26 @@ async def verify_toc(page_list, list_result, start_index=1, N=None, model=None):
             item_with_index['list_index'] = idx
             indexed_sample_list.append(item_with_index)
 
-    tasks = [
-        check_title_appearance(item, page_list, start_index, model)
-        for item in indexed_sample_list
-    ]
-    results = await asyncio.gather(*tasks)
+    # Titles the local matcher is sure about are settled here; only the uncertain band goes to the LLM
+    results = []
+    uncertain = []
+    for item in indexed_sample_list:
+        list_idx = int(item['physical_index']) - start_index
+        answer = None
+        if 0 <= list_idx < len(page_list):
+            answer = local_title_answer(item['title'], page_list[list_idx][0], title_match)
+        if answer is None:
+            uncertain.append(item)
+        else:
+            results.append({'list_index': item['list_index'], 'answer': answer, 'title': item['title'], 'page_number': int(item['physical_index'])})
+    if title_match:
+        print(f'{len(results)} items matched locally, {len(uncertain)} sent to the LLM')
+
+    results += await check_title_appearance_batched(
+        uncertain, page_list, start_index, model,
+        batch_size=batch_size, page_window=page_window
+    )
+    results.sort(key=lambda result: result['list_index'])
     
     correct_count = 0
     incorrect_results = []
@@ -926,16 +1264,18 @@ async def verify_toc(page_list, list_result, start_index=1, N=None, model=None):
 
 
 ################### main process #########################################################
-async def meta_processor(page_list, mode=None, toc_content=None, toc_page_list=None, start_index=1, opt=None, logger=None):
+async def meta_processor(page_list, mode=None, toc_content=None, toc_page_list=None, start_index=1, opt=None, logger=None, best_so_far=None, page_map=None):
     print(mode)
     print(f'start_index: {start_index}')
     
+    # These stages make blocking LLM calls: run them off the event loop, which must stay free
+    # to finish the calls holding the scheduler slots they wait for
     if mode == 'process_toc_with_page_numbers':
-        toc_with_page_number = process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_check_page_num=opt.toc_check_page_num, model=opt.model, logger=logger)
+        toc_with_page_number = await asyncio.to_thread(process_toc_with_page_numbers, toc_content, toc_page_list, page_list, toc_check_page_num=opt.toc_check_page_num, model=opt.model, logger=logger, min_confidence=alignment_threshold(opt), page_map=page_map)
     elif mode == 'process_toc_no_page_numbers':
-        toc_with_page_number = process_toc_no_page_numbers(toc_content, toc_page_list, page_list, model=opt.model, logger=logger)
+        toc_with_page_number = await asyncio.to_thread(process_toc_no_page_numbers, toc_content, toc_page_list, page_list, model=opt.model, logger=logger, min_confidence=alignment_threshold(opt))
     else:
-        toc_with_page_number = process_no_toc(page_list, start_index=start_index, model=opt.model, logger=logger)
+        toc_with_page_number = await asyncio.to_thread(process_no_toc, page_list, start_index=start_index, model=opt.model, logger=logger)
             
     toc_with_page_number = [item for item in toc_with_page_number if item.get('physical_index') is not None] 
     
@@ -946,7 +1286,14 @@ async def meta_processor(page_list, mode=None, toc_content=None, toc_page_list=N
         logger=logger
     )
     
-    accuracy, incorrect_results = await verify_toc(page_list, toc_with_page_number, start_index=start_index, model=opt.model)
+    batch_size = int(getattr(opt, 'verify_batch_size', 1))
+    page_window = int(getattr(opt, 'verify_batch_page_window', 1))
+    # Low on budget: check a random sample instead of every item
+    verify_sample = None
+    if budget_low():
+        verify_sample = int(getattr(opt, 'doc_budget_verify_sample', 10))
+        get_document_budget().note('sampled verification')
+    accuracy, incorrect_results = await verify_toc(page_list, toc_with_page_number, start_index=start_index, N=verify_sample, model=opt.model, batch_size=batch_size, page_window=page_window, title_match=title_match_thresholds(opt))
         
     if logger:
         logger.info({
@@ -957,20 +1304,31 @@ async def meta_processor(page_list, mode=None, toc_content=None, toc_page_list=N
     if accuracy == 1.0 and len(incorrect_results) == 0:
         return toc_with_page_number
     if accuracy > 0.6 and len(incorrect_results) > 0:
-        toc_with_page_number, incorrect_results = await fix_incorrect_toc_with_retries(toc_with_page_number, page_list, incorrect_results,start_index=start_index, max_attempts=3, model=opt.model, logger=logger)
+        toc_with_page_number, incorrect_results = await fix_incorrect_toc_with_retries(toc_with_page_number, page_list, incorrect_results,start_index=start_index, max_attempts=3, model=opt.model, logger=logger, batch_size=batch_size, page_window=page_window)
         return toc_with_page_number
     else:
+        if len(toc_with_page_number) > len(best_so_far or []):
+            best_so_far = toc_with_page_number
+        # No budget left for another full pass: keep the best structure we have
+        if budget_low() or budget_exhausted():
+            get_document_budget().note(f'stopped fallback after {mode}')
+            return best_so_far or []
         if mode == 'process_toc_with_page_numbers':
-            return await meta_processor(page_list, mode='process_toc_no_page_numbers', toc_content=toc_content, toc_page_list=toc_page_list, start_index=start_index, opt=opt, logger=logger)
+            return await meta_processor(page_list, mode='process_toc_no_page_numbers', toc_content=toc_content, toc_page_list=toc_page_list, start_index=start_index, opt=opt, logger=logger, best_so_far=best_so_far)
         elif mode == 'process_toc_no_page_numbers':
-            return await meta_processor(page_list, mode='process_no_toc', start_index=start_index, opt=opt, logger=logger)
+            return await meta_processor(page_list, mode='process_no_toc', start_index=start_index, opt=opt, logger=logger, best_so_far=best_so_far)
         else:
             raise Exception('Processing failed')
         
  
+@tag_stage('process_large_node_recursively')
 async def process_large_node_recursively(node, page_list, opt=None, logger=None):
     if node['end_index'] <= node['start_index']:
         return node
+
+    if budget_low():
+        get_document_budget().note('stopped large-node recursion')
+        return node
         
     node_page_list = page_list[node['start_index']-1:node['end_index']]
     token_num = sum([page[1] for page in node_page_list])
@@ -979,7 +1337,7 @@ async def process_large_node_recursively(node, page_list, opt=None, logger=None)
         print('large node:', node['title'], 'start_index:', node['start_index'], 'end_index:', node['end_index'], 'token_num:', token_num)
 
         node_toc_tree = await meta_processor(node_page_list, mode='process_no_toc', start_index=node['start_index'], opt=opt, logger=logger)
-        node_toc_tree = await check_title_appearance_in_start_concurrent(node_toc_tree, page_list, model=opt.model, logger=logger)
+        node_toc_tree = await check_title_appearance_in_start_concurrent(node_toc_tree, page_list, model=opt.model, logger=logger, title_match=title_match_thresholds(opt))
         
         valid_node_toc_items = [item for item in node_toc_tree if item.get('physical_index') is not None]
         
@@ -1001,8 +1359,18 @@ async def process_large_node_recursively(node, page_list, opt=None, logger=None)
     
     return node
 
-async def tree_parser(page_list, opt, doc=None, logger=None):
-    check_toc_result = check_toc(page_list, opt)
+async def tree_parser(page_list, opt, doc=None, logger=None, original_pages=None):
+    # Titles and printed page numbers are looked up in the text as extracted, headers and all
+    raw_pages = page_list if original_pages is None else original_pages
+    outline_items = outline_toc(doc, raw_pages, opt, logger=logger) if doc is not None else None
+    if outline_items:
+        # Bookmarks already point at the page each section starts on: no LLM is needed for the TOC,
+        # only (for the titles the local matcher cannot settle) to tell whether it starts at the top
+        toc_with_page_number = add_preface_if_needed(outline_items)
+        toc_with_page_number = await check_title_appearance_in_start_concurrent(toc_with_page_number, page_list, model=opt.model, logger=logger, title_match=title_match_thresholds(opt))
+        return await build_toc_tree(toc_with_page_number, page_list, opt, logger=logger)
+
+    check_toc_result = await asyncio.to_thread(check_toc, page_list, opt)
     if logger: logger.info(check_toc_result)
 
     if check_toc_result.get("toc_content") and check_toc_result["toc_content"].strip() and check_toc_result["page_index_given_in_toc"] == "yes":
@@ -1013,7 +1381,8 @@ async def tree_parser(page_list, opt, doc=None, logger=None):
             toc_content=check_toc_result['toc_content'], 
             toc_page_list=check_toc_result['toc_page_list'], 
             opt=opt,
-            logger=logger)
+            logger=logger,
+            page_map=printed_page_map(doc, raw_pages, opt, logger=logger))
     else:
         toc_with_page_number = await meta_processor(
             page_list, 
@@ -1023,8 +1392,11 @@ async def tree_parser(page_list, opt, doc=None, logger=None):
             logger=logger)
 
     toc_with_page_number = add_preface_if_needed(toc_with_page_number)
-    toc_with_page_number = await check_title_appearance_in_start_concurrent(toc_with_page_number, page_list, model=opt.model, logger=logger)
-    
+    toc_with_page_number = await check_title_appearance_in_start_concurrent(toc_with_page_number, page_list, model=opt.model, logger=logger, title_match=title_match_thresholds(opt))
+    return await build_toc_tree(toc_with_page_number, page_list, opt, logger=logger)
+
+
+async def build_toc_tree(toc_with_page_number, page_list, opt, logger=None):
     valid_toc_items = [item for item in toc_with_page_number if item.get('physical_index') is not None]
     
     toc_tree = post_processing(valid_toc_items, len(page_list))
@@ -1037,6 +1409,128 @@ async def tree_parser(page_list, opt, doc=None, logger=None):
     return toc_tree
 
 
+def _set_end_indices(items, end_idx):
+    # Same rule as post_processing: a section runs up to where the next one starts
+    for i, item in enumerate(items):
+        next_start = items[i + 1]['physical_index'] if i + 1 < len(items) else None
+        item['start_index'] = item['physical_index']
+        item['end_index'] = end_idx if next_start is None else max(next_start, item['physical_index'])
+
+
+async def incremental_tree_parser(page_list, structure, diff, opt, logger=None):
+    """
+    Updates the structure of a previous revision in place for a new one.
+
+    Section starts on unchanged pages follow their page; the others are placed
+    again, locally where possible. Sections are never added, only moved,
+    redone or dropped: new_sections_on_changed_pages decides beforehand
+    whether the new revision needs a full run instead. Only nodes whose page range touches a changed
+    page, or moved relative to the pages around it, are verified, fixed and
+    split if large. Returns the structure and the nodes whose text and summary
+    must be redone. Everything else, node ids included, is kept as it was.
+    """
+    flat = flatten_nodes(structure)
+    items = []
+    for node, _ in flat:
+        item = {'title': node.get('title') or ''}
+        new_start = diff.mapping.get(int(node.get('start_index') or 0))
+        if new_start is not None:
+            item['physical_index'] = new_start
+        items.append(item)
+    relocated = {i for i, item in enumerate(items) if 'physical_index' not in item}
+    if logger: logger.info({'incremental': {'nodes': len(items), 'changed_pages': len(diff.changed), 'relocated': len(relocated)}})
+    print(f'incremental: {len(diff.changed)} changed pages, {len(relocated)} of {len(items)} sections to place again')
+
+    items = await asyncio.to_thread(process_none_page_numbers, items, page_list, model=opt.model, min_confidence=alignment_threshold(opt))
+    items = validate_and_truncate_physical_indices(items, len(page_list), logger=logger)
+
+    kept = []
+    for i in range(len(flat) - 1, -1, -1):
+        if items[i].get('physical_index') is None:
+            drop_node(*flat[i])
+    for i, (node, _) in enumerate(flat):
+        if items[i].get('physical_index') is not None:
+            kept.append((i, node, items[i]))
+    kept_items = [item for _, _, item in kept]
+    _set_end_indices(kept_items, len(page_list))
+
+    def is_dirty(position):
+        i, node, item = kept[position]
+        old_range = (diff.mapping.get(int(node.get('start_index') or 0)), diff.mapping.get(int(node.get('end_index') or 0)))
+        return (i in relocated
+                or diff.touches_changed(item['start_index'], item['end_index'])
+                or old_range != (item['start_index'], item['end_index']))
+
+    dirty = [position for position in range(len(kept)) if is_dirty(position)]
+    if dirty:
+        batch_size = int(getattr(opt, 'verify_batch_size', 1))
+        page_window = int(getattr(opt, 'verify_batch_page_window', 1))
+        accuracy, incorrect_results = await verify_toc(page_list, kept_items, N=None, model=opt.model, batch_size=batch_size, page_window=page_window, title_match=title_match_thresholds(opt), indices=dirty)
+        if incorrect_results:
+            await fix_incorrect_toc_with_retries(kept_items, page_list, incorrect_results, max_attempts=3, model=opt.model, logger=logger, batch_size=batch_size, page_window=page_window)
+            _set_end_indices(kept_items, len(page_list))
+            dirty = [position for position in range(len(kept)) if is_dirty(position)]
+
+    for _, node, item in kept:
+        node['start_index'], node['end_index'] = item['start_index'], item['end_index']
+
+    dirty_nodes = [kept[position][1] for position in dirty]
+    leaves = [node for node in dirty_nodes if not node.get('nodes')]
+    await asyncio.gather(*[process_large_node_recursively(node, page_list, opt, logger=logger) for node in leaves])
+    # Sections found inside large dirty leaves are new: they need text and summaries too
+    for node in leaves:
+        dirty_nodes.extend(child for child, _ in flatten_nodes(node.get('nodes') or []))
+    print(f'incremental: {len(dirty_nodes)} sections updated')
+    return structure, dirty_nodes
+
+
+@tag_stage('incremental_new_sections')
+async def new_sections_on_changed_pages(page_list, structure, diff, opt, logger=None):
+    """
+    Titles of sections starting on a changed page that the previous structure
+    does not have, which incremental_tree_parser cannot add by itself.
+
+    Headings are read off each run of changed pages as for a document without
+    a TOC; a title counts as known when it reads as one of the structure's
+    titles. Headings the previous run never indexed (say, a subsection of a
+    small section) count as new too.
+    """
+    if getattr(opt, 'incremental_new_sections', 'no') != 'yes' or not diff.changed:
+        return []
+    known = [node.get('title') or '' for node, _ in flatten_nodes(structure)]
+    runs = []
+    for page in sorted(diff.changed):
+        if runs and page == runs[-1][1] + 1:
+            runs[-1][1] = page
+        else:
+            runs.append([page, page])
+    new = []
+    for lo, hi in runs:
+        items = await asyncio.to_thread(process_no_toc, page_list[lo - 1:hi], start_index=lo, model=opt.model, logger=logger)
+        for item in items:
+            title = item.get('title') or ''
+            if item.get('physical_index') not in diff.changed or not normalize_title_text(title):
+                continue
+            if not any(heading_match_score(title, other) >= 0.9 for other in known):
+                new.append(title)
+    if logger: logger.info({'incremental_new_sections': new})
+    return new
+
+
+# Options a previous run must have been built with for an incremental run to reuse it
+INCREMENTAL_OPTIONS = (
+    'model', 'toc_check_page_num', 'max_page_num_each_node', 'max_token_num_each_node',
+    'if_add_node_id', 'if_add_node_summary', 'if_add_node_text',
+    'toc_alignment', 'toc_alignment_min_confidence', 'use_pdf_outline', 'page_labels',
+    'strip_boilerplate', 'boilerplate_edge_lines', 'boilerplate_min_fraction',
+    'boilerplate_min_repeats', 'boilerplate_min_line_length',
+)
+
+
+def incremental_options(opt):
+    return {key: getattr(opt, key, None) for key in INCREMENTAL_OPTIONS}
+
+
 def page_index_main(doc, opt=None):
     logger = JsonLogger(doc)
     
@@ -1048,30 +1542,109 @@ def page_index_main(doc, opt=None):
         raise ValueError("Unsupported input type. Expected a PDF file path or BytesIO object.")
 
     print('Parsing PDF...')
-    page_list = get_page_tokens(doc)
+    page_list = get_page_tokens(
+        doc,
+        model=opt.model,
+        workers=int(getattr(opt, 'pdf_extract_workers', 1)),
+        min_parallel_pages=int(getattr(opt, 'pdf_parallel_min_pages', 64)),
+        mmap_dir=getattr(opt, 'page_mmap_dir', None) if getattr(opt, 'page_mmap', 'no') == 'yes' else None,
+        mmap_min_pages=int(getattr(opt, 'page_mmap_min_pages', 500)),
+    )
 
     logger.info({'total_page_number': len(page_list)})
     logger.info({'total_token': sum([page[1] for page in page_list])})
 
+    # Prompts are built from the text without running headers/footers; node text keeps the original
+    original_pages = page_list
+    if getattr(opt, 'strip_boilerplate', 'no') == 'yes':
+        page_list, boilerplate = normalize_page_list(
+            page_list,
+            model=opt.model,
+            edge_lines=int(getattr(opt, 'boilerplate_edge_lines', 3)),
+            min_fraction=float(getattr(opt, 'boilerplate_min_fraction', 0.3)),
+            min_repeats=int(getattr(opt, 'boilerplate_min_repeats', 4)),
+            min_line_length=int(getattr(opt, 'boilerplate_min_line_length', 40)),
+        )
+        logger.info({'boilerplate': boilerplate.stats(), 'total_token_normalized': sum([page[1] for page in page_list])})
+
+    # The previous revision's results and page hashes, to only redo what changed
+    full_save_path = os.path.join("results", f"{get_pdf_name(doc)}_full.json")
+    hashes = [page_hash(page[0]) for page in original_pages]
+    previous, diff = None, None
+    if getattr(opt, 'incremental', 'no') == 'yes':
+        previous = load_previous_run(full_save_path, PAGE_EXTRACTOR_VERSION, incremental_options(opt))
+        if previous is not None:
+            diff = PageDiff(previous[1], hashes)
+            if diff.unchanged_ratio < float(getattr(opt, 'incremental_min_unchanged', 0.5)):
+                print(f'only {diff.unchanged_ratio*100:.0f}% of the pages are unchanged, indexing from scratch')
+                previous = None
+
+    metrics_port = int(getattr(opt, 'metrics_port', 0) or 0)
+    if metrics_port:
+        start_metrics_server(metrics_port)
+
     async def page_index_builder():
-        structure = await tree_parser(page_list, opt, doc=doc, logger=logger)
-        if opt.if_add_node_id == 'yes':
-            write_node_id(structure)    
-        if opt.if_add_node_text == 'yes':
-            add_node_text(structure, page_list)
-        if opt.if_add_node_summary == 'yes':
-            if opt.if_add_node_text == 'no':
+        budget = DocumentBudget.from_opt(opt)
+        try:
+            with run_report(get_pdf_name(doc)) as llm_report, document_budget(budget):
+                structure = await build_structure()
+        finally:
+            # aiohttp sessions are bound to this event loop; close them before asyncio.run tears it down
+            await close_async_client()
+        logger.info({'llm_budget': budget.report()})
+        if budget.partial:
+            print(f"[Warning] LLM budget ran low, returning a partial structure: {budget.degradations}")
+        # Per-run LLM telemetry next to the JsonLogger dump
+        llm_report.write(os.path.join("logs", logger.filename.replace(".json", "_llm_metrics.json")))
+        logger.info({'llm_metrics': llm_report.to_dict()['by_leaf_stage']})
+        return structure
+
+    async def build_structure():
+        incremental = previous is not None
+        if incremental:
+            new_sections = await new_sections_on_changed_pages(page_list, previous[0], diff, opt, logger=logger)
+            if new_sections:
+                print(f'{len(new_sections)} new sections on the changed pages, indexing from scratch')
+                incremental = False
+        if incremental:
+            structure, dirty_nodes = await incremental_tree_parser(page_list, previous[0], diff, opt, logger=logger)
+            if opt.if_add_node_id == 'yes':
+                assign_new_node_ids(structure)
+            for node in dirty_nodes:
+                # Whatever the previous run attached to a redone section is stale now
+                node.pop('text', None)
+                node.pop('summary', None)
+            if opt.if_add_node_summary == 'yes':
+                for node in dirty_nodes:
+                    add_node_text(node, page_list)
+                await generate_summaries_for_structure(structure, model=opt.model, nodes=dirty_nodes)
+            if opt.if_add_node_text == 'yes' or opt.if_add_node_summary == 'yes':
+                for node in dirty_nodes:
+                    add_node_text(node, original_pages)
+        else:
+            structure = await tree_parser(page_list, opt, doc=doc, logger=logger, original_pages=original_pages)
+            if opt.if_add_node_id == 'yes':
+                write_node_id(structure)    
+            if opt.if_add_node_summary == 'yes':
+                # Summaries are prompted from the normalized text...
                 add_node_text(structure, page_list)
-            await generate_summaries_for_structure(structure, model=opt.model)
+                await generate_summaries_for_structure(structure, model=opt.model)
+            if opt.if_add_node_text == 'yes' or opt.if_add_node_summary == 'yes':
+                # ...while the saved text is the page text as extracted
+                add_node_text(structure, original_pages)
+
+        # The document ran out of LLM budget somewhere: flag the top-level nodes as partial
+        budget = get_document_budget()
+        if budget and budget.partial:
+            for node in structure:
+                node['partial'] = True
 
         # --- 1. 先把包含完整正文的数据保存到硬盘 (Full Version) ---
         
         # 深度拷贝一份，防止瘦身操作影响到我们要保存的文件
         full_structure = copy.deepcopy(structure)
         
-        # 自动获取文件名（例如 aidishengtest_full.json）
-        pdf_name = get_pdf_name(doc)
-        full_save_path = os.path.join("results", f"{pdf_name}_full.json")
+        # 自动获取文件名（例如 aidishengtest_full.json）: full_save_path
         
         # 确保目录存在
         os.makedirs("results", exist_ok=True)
@@ -1079,6 +1652,8 @@ def page_index_main(doc, opt=None):
         # 保存完整版
         with open(full_save_path, 'w', encoding='utf-8') as f:
             json.dump(full_structure, f, ensure_ascii=False, indent=2)
+        # Page hashes of this revision, for the next incremental run
+        save_page_hashes(full_save_path, hashes, PAGE_EXTRACTOR_VERSION, incremental_options(opt))
         
         # 在控制台打印一条绿色提示，告诉你文件在哪
         print(f"\n[SUCCESS] 完整召回数据已存至: {os.path.abspath(full_save_path)}")
@@ -1086,11 +1661,26 @@ def page_index_main(doc, opt=None):
         # --- 2. 强制执行瘦身操作，防止 GUI 卡死 (Slim Version) ---
         # 不管 opt.remove_text 是什么，我们都把打印给界面的 text 删掉
         remove_structure_text(structure)
+
+        llm_cache = get_llm_cache()
+        if llm_cache:
+            logger.info({'llm_cache': llm_cache.stats()})
+        logger.info({'llm_endpoints': get_endpoint_pool().snapshot()})
         
         # 返回瘦身后的结构，这样 pgui.py 的控制台就不会因为打印万字长文而崩溃了
         return structure  
 
-    return asyncio.run(page_index_builder())
+    try:
+        return asyncio.run(page_index_builder())
+    finally:
+        # Working copies only; the page store keeps the text across runs
+        for pages in {id(pages): pages for pages in (page_list, original_pages)}.values():
+            if isinstance(pages, MappedPageList):
+                pages.close()
+                try:
+                    os.remove(pages.path)
+                except OSError:
+                    pass
 
 
 def page_index(doc, model=None, toc_check_page_num=None, max_page_num_each_node=None, max_token_num_each_node=None,
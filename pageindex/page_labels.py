@@ -0,0 +1,213 @@
+import logging
+import re
+from collections import Counter, defaultdict
+
+import PyPDF2
+
+_ROMAN_VALUES = [(1000, "m"), (900, "cm"), (500, "d"), (400, "cd"), (100, "c"), (90, "xc"),
+                 (50, "l"), (40, "xl"), (10, "x"), (9, "ix"), (5, "v"), (4, "iv"), (1, "i")]
+_ROMAN = re.compile(r"^m{0,3}(cm|cd|d?c{0,3})(xc|xl|l?x{0,3})(ix|iv|v?i{0,3})$")
+# A header/footer line that is just a page number: "12", "- 12 -", "Page 12", "Page 12 of 300", "第12页", "xiv"
+_PAGE_LINE = re.compile(
+    r"^[\s\-–—|·•]*(?:page\s+|p\.\s*|第\s*)?(\d{1,4}|[ivxlcdm]{1,8})(?:\s*页)?(?:\s+of\s+\d+)?[\s\-–—|·•]*$",
+    re.IGNORECASE,
+)
+# ... or a short line starting or ending with one next to a running title: "12 | Annual Report 2024"
+_PAGE_EDGE = re.compile(r"^\s*(\d{1,4})\s*[|·•]\s*\S|\S\s*[|·•]\s*(\d{1,4})\s*$")
+
+
+def int_to_roman(number):
+    out = []
+    for value, numeral in _ROMAN_VALUES:
+        while number >= value:
+            out.append(numeral)
+            number -= value
+    return "".join(out)
+
+
+def roman_to_int(text):
+    text = (text or "").strip().lower()
+    if not text or not _ROMAN.match(text):
+        return None
+    total, i = 0, 0
+    for value, numeral in _ROMAN_VALUES:
+        while text.startswith(numeral, i):
+            total += value
+            i += len(numeral)
+    return total
+
+
+def normalize_label(label):
+    """Comparable form of a printed page label: '012' -> '12', 'XIV' -> 'xiv'."""
+    label = str(label).strip().lower()
+    if label.isdigit():
+        return str(int(label))
+    return label
+
+
+def _format_label(style, number):
+    if style == "/D":
+        return str(number)
+    if style in ("/R", "/r"):
+        return int_to_roman(number)
+    if style in ("/A", "/a"):
+        # A..Z, then AA..ZZ, ...
+        letter = chr(ord("a") + (number - 1) % 26)
+        return letter * ((number - 1) // 26 + 1)
+    return ""
+
+
+def read_pdf_page_labels(pdf):
+    """
+    The /PageLabels of a PDF as one label per page (lower case), or None when
+    it has none. Ranges with no numbering style get their prefix only.
+    """
+    try:
+        reader = pdf if isinstance(pdf, PyPDF2.PdfReader) else PyPDF2.PdfReader(pdf)
+        root = reader.trailer["/Root"].get_object()
+        tree = root.get("/PageLabels")
+        if tree is None:
+            return None
+        num_pages = len(reader.pages)
+
+        ranges = []
+        pending = [tree.get_object()]
+        while pending:
+            node = pending.pop()
+            nums = node.get("/Nums")
+            if nums is not None:
+                nums = nums.get_object()
+                for i in range(0, len(nums) - 1, 2):
+                    ranges.append((int(nums[i]), nums[i + 1].get_object()))
+            for kid in node.get("/Kids") or []:
+                pending.append(kid.get_object())
+    except Exception as e:
+        logging.warning(f"Could not read the PDF page labels ({type(e).__name__}: {e})")
+        return None
+    if not ranges:
+        return None
+
+    ranges.sort(key=lambda entry: entry[0])
+    labels = []
+    for r, (start, spec) in enumerate(ranges):
+        end = ranges[r + 1][0] if r + 1 < len(ranges) else num_pages
+        style = spec.get("/S")
+        prefix = str(spec.get("/P", ""))
+        first = int(spec.get("/St", 1))
+        for page in range(max(start, len(labels)), min(end, num_pages)):
+            labels.append((prefix + _format_label(style, first + page - start)).lower())
+    labels += [""] * (num_pages - len(labels))
+    return labels
+
+
+def page_number_of_line(line):
+    """The page number a header/footer line shows ("12", "Page 12 of 300", "xiv", "12 | Title"), or None."""
+    line = line.strip()
+    match = _PAGE_LINE.match(line)
+    if match:
+        return match.group(1).lower()
+    if len(line) <= 80:
+        match = _PAGE_EDGE.search(line)
+        if match:
+            return match.group(1) or match.group(2)
+    return None
+
+
+def _page_number_candidates(text, edge_lines=3):
+    lines = [line.strip() for line in (text or "").splitlines() if line.strip()]
+    edges = lines[:edge_lines] + lines[-edge_lines:] if len(lines) > 2 * edge_lines else lines
+    return [label for label in map(page_number_of_line, edges) if label is not None]
+
+
+def detect_printed_labels(page_texts, window=2):
+    """
+    Printed page number of each page read from its first and last lines, or None.
+
+    A candidate only counts when a page within `window` pages has a candidate
+    of the same numbering at the same offset, so stray numbers (years, figure
+    counts) drop out; front matter in roman numerals is recognised the same way.
+    Pages left in between two detected pages of one run are filled in.
+    """
+    candidates = []
+    for text in page_texts:
+        parsed = []
+        for label in _page_number_candidates(text):
+            if label.isdigit():
+                parsed.append(("d", int(label)))
+            else:
+                value = roman_to_int(label)
+                if value:
+                    parsed.append(("r", value))
+        candidates.append(parsed)
+
+    labels = [None] * len(candidates)
+    for page, parsed in enumerate(candidates):
+        for kind, value in parsed:
+            offset = page - value
+            neighbours = range(max(0, page - window), min(len(candidates), page + window + 1))
+            if any(other != page and (kind, other - offset) in candidates[other] for other in neighbours):
+                labels[page] = (kind, value)
+                break
+
+    # Fill undetected pages lying between two detected pages of the same run
+    previous = None
+    for page, label in enumerate(labels):
+        if label is None:
+            continue
+        if previous is not None and page - previous > 1:
+            kind, value = labels[previous]
+            if label[0] == kind and label[1] - value == page - previous:
+                for gap in range(previous + 1, page):
+                    labels[gap] = (kind, value + gap - previous)
+        previous = page
+
+    return [None if label is None else str(label[1]) if label[0] == "d" else int_to_roman(label[1]) for label in labels]
+
+
+class PageLabelMap:
+    """
+    Printed page label -> physical page index (1-based), for all pages.
+
+    A label can occur more than once when the numbering restarts between parts;
+    `physical_index` then takes the first occurrence at or after the page the
+    previous TOC entry resolved to.
+    """
+    def __init__(self, labels, start_index=1):
+        self.labels = labels
+        self._pages = defaultdict(list)
+        for offset, label in enumerate(labels):
+            if label:
+                self._pages[normalize_label(label)].append(start_index + offset)
+
+    @property
+    def coverage(self):
+        return sum(1 for label in self.labels if label) / len(self.labels) if self.labels else 0.0
+
+    def physical_index(self, label, after=None):
+        pages = self._pages.get(normalize_label(label))
+        if not pages:
+            return None
+        if after is None:
+            return pages[0]
+        # Never step back before the previous entry
+        return next((page for page in pages if page >= after), None)
+
+    def dominant_offset(self):
+        """Most common physical-minus-printed difference over arabic-numbered pages (0 if none)."""
+        offsets = Counter()
+        for label, pages in self._pages.items():
+            if label.isdigit():
+                for page in pages:
+                    offsets[page - int(label)] += 1
+        return offsets.most_common(1)[0][0] if offsets else 0
+
+
+def page_label_map(page_texts, pdf=None, start_index=1):
+    """
+    PageLabelMap from the PDF's own /PageLabels when they carry real information
+    (anything other than plain 1..N), otherwise from the printed page numbers.
+    """
+    labels = read_pdf_page_labels(pdf) if pdf is not None else None
+    if labels and any(label != str(i + 1) for i, label in enumerate(labels)):
+        return PageLabelMap(labels, start_index)
+    return PageLabelMap(detect_printed_labels(page_texts), start_index)
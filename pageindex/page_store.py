@@ -0,0 +1,235 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from io import BytesIO
+
+
+def pdf_sha256(pdf):
+    """SHA-256 of a PDF given as a path, BytesIO or any seekable binary file object."""
+    digest = hashlib.sha256()
+    if isinstance(pdf, (str, os.PathLike)):
+        with open(pdf, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+    elif isinstance(pdf, BytesIO):
+        digest.update(pdf.getbuffer())
+    else:
+        position = pdf.tell()
+        pdf.seek(0)
+        for block in iter(lambda: pdf.read(1024 * 1024), b""):
+            digest.update(block)
+        pdf.seek(position)
+    return digest.hexdigest()
+
+
+class PageStore:
+    """
+    Disk-backed store of extracted page text on SQLite.
+
+    A document is keyed by its content hash plus the extractor version, so a new
+    extractor never serves stale text. Page texts are stored once per document;
+    token counts are stored next to them per tokenizer encoding, so switching
+    models only needs the pages counted again, not the PDF extracted again.
+    Whole documents are evicted least recently used first to keep the stored
+    text under `max_bytes`.
+    """
+    def __init__(self, path, max_bytes=1024 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " key TEXT PRIMARY KEY,"
+            " num_pages INTEGER NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        if self._conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'pages'").fetchone():
+            # Older stores kept one token count per page under tokenizer-specific keys: start over
+            self._conn.execute("DROP TABLE pages")
+            self._conn.execute("DELETE FROM documents")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS page_texts ("
+            " key TEXT NOT NULL,"
+            " page INTEGER NOT NULL,"
+            " text TEXT NOT NULL,"
+            " PRIMARY KEY (key, page)) WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS page_tokens ("
+            " key TEXT NOT NULL,"
+            " encoding TEXT NOT NULL,"
+            " counts BLOB NOT NULL,"
+            " PRIMARY KEY (key, encoding)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_accessed ON documents(accessed)")
+        self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM documents").fetchone()[0]
+
+    def _touch(self, key):
+        row = self._conn.execute("SELECT num_pages FROM documents WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self._stats["misses"] += 1
+            return None
+        self._conn.execute("UPDATE documents SET accessed = ? WHERE key = ?", (time.time(), key))
+        self._stats["hits"] += 1
+        return row[0]
+
+    def get(self, key, encoding):
+        """
+        All pages of a document as [(text, tokens)] with `encoding`'s token
+        counts, or None if the document or its counts for `encoding` are not stored.
+        """
+        with self._lock:
+            if self._touch(key) is None:
+                return None
+            row = self._conn.execute("SELECT counts FROM page_tokens WHERE key = ? AND encoding = ?", (key, encoding)).fetchone()
+            if row is None:
+                return None
+            rows = self._conn.execute("SELECT text FROM page_texts WHERE key = ? ORDER BY page", (key,)).fetchall()
+        counts = array("q")
+        counts.frombytes(row[0])
+        return [(text, tokens) for (text,), tokens in zip(rows, counts)]
+
+    def iter_pages(self, key, encoding, batch_size=256):
+        """
+        (number of pages, iterator of `(text, tokens)`) for a stored document
+        with `encoding`'s token counts, or None like `get`. The texts are read
+        `batch_size` pages at a time, so a large document is never held whole.
+        """
+        with self._lock:
+            num_pages = self._touch(key)
+            if num_pages is None:
+                return None
+            row = self._conn.execute("SELECT counts FROM page_tokens WHERE key = ? AND encoding = ?", (key, encoding)).fetchone()
+            if row is None:
+                return None
+        counts = array("q")
+        counts.frombytes(row[0])
+
+        def pages():
+            for start in range(0, len(counts), batch_size):
+                with self._lock:
+                    rows = self._conn.execute(
+                        "SELECT text FROM page_texts WHERE key = ? AND page >= ? AND page < ? ORDER BY page",
+                        (key, start, start + batch_size),
+                    ).fetchall()
+                for (text,), tokens in zip(rows, counts[start:start + batch_size]):
+                    yield text, tokens
+
+        return len(counts), pages()
+
+    def get_texts(self, key):
+        """All page texts of a document, or None if it is not stored."""
+        with self._lock:
+            if self._touch(key) is None:
+                return None
+            rows = self._conn.execute("SELECT text FROM page_texts WHERE key = ? ORDER BY page", (key,)).fetchall()
+        return [row[0] for row in rows]
+
+    def get_range(self, key, start, end):
+        """Texts of pages [start, end) (0-based, clipped to the document), or None if not stored."""
+        with self._lock:
+            num_pages = self._touch(key)
+            if num_pages is None:
+                return None
+            rows = self._conn.execute(
+                "SELECT text FROM page_texts WHERE key = ? AND page >= ? AND page < ? ORDER BY page",
+                (key, max(0, start), min(end, num_pages)),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def put(self, key, pages, encoding):
+        """Stores `(text, tokens)` pages, with token counts from `encoding`."""
+        now = time.time()
+        size = count = 0
+        counts = array("q")
+
+        def rows():
+            # Streamed into SQLite page by page, so a mapped page list is never copied whole
+            nonlocal size, count
+            for i, (text, tokens) in enumerate(pages):
+                size += len(text.encode("utf-8"))
+                count += 1
+                counts.append(tokens)
+                yield (key, i, text)
+
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM documents WHERE key = ?", (key,)).fetchone()
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("DELETE FROM page_texts WHERE key = ?", (key,))
+                self._conn.execute("DELETE FROM page_tokens WHERE key = ?", (key,))
+                self._conn.executemany("INSERT INTO page_texts (key, page, text) VALUES (?, ?, ?)", rows())
+                self._conn.execute(
+                    "INSERT INTO page_tokens (key, encoding, counts) VALUES (?, ?, ?)",
+                    (key, encoding, counts.tobytes()),
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO documents (key, num_pages, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (key, count, size, now, now),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._total += size - (old[0] if old else 0)
+            self._stats["stores"] += 1
+            self._evict(keep=key)
+
+    def put_tokens(self, key, encoding, counts):
+        """Adds the token counts from another encoding to a stored document."""
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM documents WHERE key = ?", (key,)).fetchone() is None:
+                return
+            self._conn.execute(
+                "INSERT OR REPLACE INTO page_tokens (key, encoding, counts) VALUES (?, ?, ?)",
+                (key, encoding, array("q", counts).tobytes()),
+            )
+
+    def _evict(self, keep=None):
+        if not self.max_bytes or self._total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM documents ORDER BY accessed ASC").fetchall()
+        total = self._total
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self._conn.execute("DELETE FROM page_texts WHERE key = ?", (key,))
+            self._conn.execute("DELETE FROM page_tokens WHERE key = ?", (key,))
+            self._conn.execute("DELETE FROM documents WHERE key = ?", (key,))
+            self._stats["evictions"] += 1
+            total -= size
+        self._total = total
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+                "size_bytes": self._total,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM page_texts")
+            self._conn.execute("DELETE FROM page_tokens")
+            self._conn.execute("DELETE FROM documents")
+            self._total = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,235 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at `rate_per_min`.
+
+    `reserve` debits immediately (the balance may go negative) and returns how
+    long the caller has to wait before its reservation is covered, so concurrent
+    callers queue up fairly without polling.
+    """
+    def __init__(self, rate_per_min, capacity=None):
+        self.rate = rate_per_min / 60.0
+        self.capacity = float(capacity if capacity is not None else rate_per_min)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount=1):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # A single request larger than the bucket can never be covered; cap it
+            self._tokens -= min(amount, self.capacity)
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def refund(self, amount):
+        """Gives back (or, with a negative amount, takes) tokens after the real cost is known."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+
+# Call priorities, most urgent first
+PRIORITY_CRITICAL = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2
+
+PRIORITIES = {
+    "critical": PRIORITY_CRITICAL,
+    "normal": PRIORITY_NORMAL,
+    "background": PRIORITY_BACKGROUND,
+}
+
+
+class _Waiter:
+    __slots__ = ("event", "loop", "future", "granted", "priority", "enqueued", "seq")
+
+    def __init__(self, loop=None, priority=PRIORITY_NORMAL):
+        self.loop = loop
+        self.future = loop.create_future() if loop else None
+        self.event = None if loop else threading.Event()
+        self.granted = False
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.seq = 0
+
+    def wake(self):
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._set_result)
+
+    def _set_result(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class LLMScheduler:
+    """
+    Process-wide gate for LLM calls.
+
+    Caps the number of in-flight requests and enforces requests/min and
+    tokens/min budgets. Works from plain threads (`slot`) and from coroutines
+    (`slot_async`) alike, and across event loops, so the blocking and the
+    asyncio clients share the same limits. A limit of 0 disables it.
+
+    Freed slots go to the most urgent waiter first (FIFO within a priority).
+    `critical_reserve` slots are held back for critical calls, and every
+    `aging` seconds spent waiting raise a call by one priority level, so
+    background work is delayed but never starved.
+    """
+    def __init__(self, max_concurrency=16, requests_per_min=0, tokens_per_min=0, critical_reserve=0, aging=30.0):
+        self.max_concurrency = max_concurrency
+        self.critical_reserve = min(critical_reserve, max(0, max_concurrency - 1))
+        self.aging = aging
+        self._available = max_concurrency
+        self._waiters = []
+        self._seq = 0
+        self._lock = threading.Lock()
+        self.request_bucket = TokenBucket(requests_per_min) if requests_per_min > 0 else None
+        self.token_bucket = TokenBucket(tokens_per_min) if tokens_per_min > 0 else None
+
+    # --- concurrency slots ---
+    def _effective_priority(self, waiter, now):
+        if self.aging <= 0:
+            return waiter.priority
+        return waiter.priority - int((now - waiter.enqueued) / self.aging)
+
+    def _floor(self, priority):
+        """Slots that must stay free after a call of this priority takes one."""
+        return 0 if priority <= PRIORITY_CRITICAL else self.critical_reserve
+
+    def _can_take(self, priority):
+        return self._available > self._floor(priority)
+
+    def _try_take(self, waiter):
+        with self._lock:
+            if self.max_concurrency <= 0:
+                return True
+            if not self._waiters and self._can_take(waiter.priority):
+                self._available -= 1
+                return True
+            self._seq += 1
+            waiter.seq = self._seq
+            self._waiters.append(waiter)
+            return False
+
+    def _dispatch(self):
+        # Called with the lock held. Waiter lists are short (one entry per blocked
+        # call), so a scan is cheaper than keeping a heap ordered under aging.
+        now = time.monotonic()
+        while self._waiters:
+            best = min(self._waiters, key=lambda w: (self._effective_priority(w, now), w.seq))
+            if not self._can_take(self._effective_priority(best, now)):
+                return
+            self._waiters.remove(best)
+            self._available -= 1
+            best.wake()
+
+    def _release(self):
+        if self.max_concurrency <= 0:
+            return
+        with self._lock:
+            self._available += 1
+            self._dispatch()
+
+    def _cancel(self, waiter):
+        with self._lock:
+            if not waiter.granted:
+                self._waiters.remove(waiter)
+                # A waiter blocked on the critical reserve may be first in line now
+                self._dispatch()
+                return
+        # Granted while being cancelled: pass the slot on
+        self._release()
+
+    # --- rate budgets ---
+    def _reserve(self, est_tokens):
+        delay = 0.0
+        if self.request_bucket:
+            delay = max(delay, self.request_bucket.reserve(1))
+        if self.token_bucket and est_tokens:
+            delay = max(delay, self.token_bucket.reserve(est_tokens))
+        return delay
+
+    def settle(self, est_tokens, actual_tokens):
+        """Corrects the tokens/min bucket once the real prompt+completion size is known."""
+        if self.token_bucket and actual_tokens is not None:
+            self.token_bucket.refund(est_tokens - actual_tokens)
+
+    # --- public API ---
+    def acquire(self, est_tokens=0, priority=PRIORITY_NORMAL):
+        waiter = _Waiter(priority=priority)
+        if not self._try_take(waiter):
+            waiter.event.wait()
+        delay = self._reserve(est_tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, est_tokens=0, priority=PRIORITY_NORMAL):
+        waiter = _Waiter(asyncio.get_running_loop(), priority)
+        if not self._try_take(waiter):
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                self._cancel(waiter)
+                raise
+        delay = self._reserve(est_tokens)
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self._release()
+                raise
+
+    def try_acquire(self, est_tokens=0, priority=PRIORITY_NORMAL):
+        """
+        Takes a slot only if one is free right now and the rate budgets allow an
+        immediate call; never waits. Used for optional extra work such as hedges.
+        """
+        with self._lock:
+            if self.max_concurrency > 0:
+                if self._waiters or not self._can_take(priority):
+                    return False
+                self._available -= 1
+        delay = self._reserve(est_tokens)
+        if delay > 0:
+            # Over the rate budget: undo the reservation and the slot
+            if self.request_bucket:
+                self.request_bucket.refund(1)
+            if self.token_bucket and est_tokens:
+                self.token_bucket.refund(est_tokens)
+            self._release()
+            return False
+        return True
+
+    def release(self):
+        self._release()
+
+    @contextmanager
+    def slot(self, est_tokens=0, priority=PRIORITY_NORMAL):
+        self.acquire(est_tokens, priority)
+        try:
+            yield self
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def slot_async(self, est_tokens=0, priority=PRIORITY_NORMAL):
+        await self.acquire_async(est_tokens, priority)
+        try:
+            yield self
+        finally:
+            self.release()
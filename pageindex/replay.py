@@ -0,0 +1,194 @@
+"""
+Record/replay harness for the LLM client.
+
+record: every successful streamed call is appended to a JSONL cassette.
+replay: a local OpenAI-compatible SSE server answers from that cassette, with
+configurable time-to-first-token and per-chunk latency, so page_index_main can
+run end to end without network access and with deterministic timing.
+
+Standalone server:
+    python -m pageindex.replay --cassette tests/cassettes/earthmover.jsonl --port 8765
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .llm_cache import make_cache_key
+
+
+def request_key(payload):
+    # The model name is left out on purpose: a cassette recorded against an endpoint
+    # with its own model alias must still match when replayed from the stub.
+    return make_cache_key(None, payload.get("messages"), payload.get("temperature"))
+
+
+class CassetteRecorder:
+    """Appends request/response pairs to a JSONL cassette, one line per call."""
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, payload, response, latency=None, ttft=None):
+        entry = {
+            "key": request_key(payload),
+            "request": {
+                "model": payload.get("model"),
+                "messages": payload.get("messages"),
+                "temperature": payload.get("temperature"),
+            },
+            "response": response,
+            "latency": latency,
+            "ttft": ttft,
+        }
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+def load_cassette(path):
+    """Returns {key: [entries...]}; repeated identical requests are replayed in recorded order."""
+    entries = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            entries.setdefault(entry["key"], []).append(entry)
+    return entries
+
+
+class ReplayServer:
+    """
+    Local OpenAI-compatible chat completions endpoint that streams recorded responses.
+
+    `ttft` seconds pass before the first chunk, then the response is sent in
+    `chunk_chars`-sized deltas `chunk_delay` seconds apart. Unknown requests get
+    a 404 so they surface as non-retryable errors instead of silently hanging.
+    """
+    def __init__(self, cassette_path, host="127.0.0.1", port=0, ttft=0.0, chunk_delay=0.0, chunk_chars=16):
+        self.cassette_path = cassette_path
+        self.entries = load_cassette(cassette_path)
+        self.ttft = ttft
+        self.chunk_delay = chunk_delay
+        self.chunk_chars = max(1, chunk_chars)
+        self.hits = 0
+        self.misses = 0
+        self._cursor = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def _next_response(self, key):
+        with self._lock:
+            recorded = self.entries.get(key)
+            if not recorded:
+                self.misses += 1
+                return None
+            position = self._cursor.get(key, 0)
+            self._cursor[key] = position + 1
+            self.hits += 1
+            # Past the end of the recorded repeats: keep serving the last one
+            return recorded[min(position, len(recorded) - 1)]["response"]
+
+    def _handler_class(self):
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    self._send_json(400, {"error": {"message": "invalid JSON body"}})
+                    return
+                response = server._next_response(request_key(payload))
+                if response is None:
+                    self._send_json(404, {"error": {"message": "request not found in cassette"}})
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                if server.ttft:
+                    time.sleep(server.ttft)
+                for start in range(0, len(response), server.chunk_chars):
+                    delta = response[start:start + server.chunk_chars]
+                    chunk = {"choices": [{"index": 0, "delta": {"content": delta}}]}
+                    self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+                    if server.chunk_delay:
+                        time.sleep(server.chunk_delay)
+                self._write_chunk("data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _write_chunk(self, text):
+                data = text.encode("utf-8")
+                self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            def _send_json(self, status, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return _Handler
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever, name="pageindex-replay", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a recorded LLM cassette as an OpenAI-compatible SSE endpoint")
+    parser.add_argument('--cassette', required=True, help="Path to the JSONL cassette")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--ttft', type=float, default=0.0, help="Seconds before the first chunk")
+    parser.add_argument('--chunk-delay', type=float, default=0.0, help="Seconds between chunks")
+    parser.add_argument('--chunk-chars', type=int, default=16, help="Characters per streamed delta")
+    args = parser.parse_args()
+
+    server = ReplayServer(args.cassette, host=args.host, port=args.port, ttft=args.ttft,
+                          chunk_delay=args.chunk_delay, chunk_chars=args.chunk_chars)
+    print(f"[INFO] Replaying {sum(len(v) for v in server.entries.values())} recorded calls at {server.url}")
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
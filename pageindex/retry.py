@@ -0,0 +1,134 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+
+# --- Typed LLM failures ---
+
+class LLMError(Exception):
+    """Base class for failed LLM calls. `retryable` tells the retry policy whether to try again."""
+    retryable = False
+
+    def __init__(self, message, status=None, retry_after=None, url=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.url = url
+
+
+class LLMAuthError(LLMError):
+    """401/403: bad or missing API key. Retrying cannot help."""
+
+
+class LLMBadRequestError(LLMError):
+    """Other 4xx: the request itself is wrong (payload too large, unknown model, ...)."""
+
+
+class LLMRateLimitError(LLMError):
+    """429: the endpoint asked us to slow down, usually with a Retry-After header."""
+    retryable = True
+
+
+class LLMServerError(LLMError):
+    """5xx, 408 and friends: transient trouble on the server side."""
+    retryable = True
+
+
+class LLMConnectionError(LLMError):
+    """DNS, TCP, TLS or read timeout failures before/while streaming."""
+    retryable = True
+
+
+class LLMEmptyResponseError(LLMError):
+    """200 with a stream that carried no content."""
+    retryable = True
+
+
+class LLMHTMLResponseError(LLMError):
+    """The gateway returned an HTML page (typically a login page) instead of an event stream."""
+
+
+class LLMDeadlineExceeded(LLMError):
+    """The per-call deadline ran out before a successful attempt."""
+
+
+class LLMCancelled(LLMError):
+    """The attempt was abandoned on purpose (e.g. the losing side of a hedged request)."""
+
+
+def parse_retry_after(value):
+    """Parses a Retry-After header (delta-seconds or HTTP-date) into seconds, or None."""
+    if not value:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def error_for_response(status, content_type, retry_after=None, body="", url=None):
+    """Maps an HTTP status/content type to the matching LLMError, or None for a usable 200 stream."""
+    if "text/html" in (content_type or ""):
+        return LLMHTMLResponseError(f"{url} returned HTML (login page?)", status=status, url=url)
+    if status == 200:
+        return None
+    detail = f"{url} failed with {status}: {(body or '')[:200]}"
+    if status in (401, 403):
+        return LLMAuthError(detail, status=status, url=url)
+    if status == 429:
+        return LLMRateLimitError(detail, status=status, retry_after=parse_retry_after(retry_after), url=url)
+    if status in (408, 409, 425) or status >= 500:
+        return LLMServerError(detail, status=status, retry_after=parse_retry_after(retry_after), url=url)
+    return LLMBadRequestError(detail, status=status, url=url)
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter, bounded by a per-call deadline.
+
+    Delay for attempt n (0-based) is uniform(0, min(max_delay, base_delay * 2**n)).
+    A server-provided Retry-After wins over the computed delay. Non-retryable
+    errors, the last attempt, or a delay that would cross the deadline end the call.
+    """
+    def __init__(self, max_attempts=4, base_delay=1.0, max_delay=30.0, deadline=300.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def start(self):
+        """Returns the absolute monotonic deadline for a call starting now (None = no deadline)."""
+        return time.monotonic() + self.deadline if self.deadline else None
+
+    def remaining(self, deadline_at):
+        if deadline_at is None:
+            return None
+        return deadline_at - time.monotonic()
+
+    def next_delay(self, attempt, error, deadline_at=None):
+        """Seconds to wait before the next attempt, or None to give up."""
+        if not getattr(error, "retryable", False):
+            return None
+        if attempt + 1 >= self.max_attempts:
+            return None
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if getattr(error, "retry_after", None) is not None:
+            delay = max(delay, error.retry_after)
+        remaining = self.remaining(deadline_at)
+        if remaining is not None and delay >= remaining:
+            return None
+        return delay
+
+    def timeout_for(self, timeout, deadline_at):
+        """Clamps a per-request timeout to what is left of the deadline."""
+        remaining = self.remaining(deadline_at)
+        if remaining is None:
+            return timeout
+        if remaining <= 0:
+            raise LLMDeadlineExceeded("LLM call deadline exceeded")
+        return min(timeout, remaining)
@@ -0,0 +1,88 @@
+import itertools
+import json
+import sys
+import threading
+
+# Line prefix pgui.WorkerThread looks for on the subprocess's stdout (keep in sync with pgui.py)
+STREAM_PREFIX = "DEBUG_AI_STREAM:"
+
+_call_ids = itertools.count(1)
+
+
+def new_call_id():
+    return str(next(_call_ids))
+
+
+class NullStreamSink:
+    """Drops streamed deltas. Headless runs pay nothing for visualisation."""
+    enabled = False
+
+    def write(self, call_id, text):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class BatchedStreamSink:
+    """
+    Collects streamed deltas per call and writes them out in batches.
+
+    Everything buffered is written as one flush every `interval` seconds, or
+    sooner once `max_chars` are pending. Each batch is one line per call:
+    `DEBUG_AI_STREAM:{"id": <call id>, "text": <deltas>}`; JSON keeps newlines
+    inside the text from breaking the line protocol.
+    """
+    enabled = True
+
+    def __init__(self, stream=None, max_chars=256, interval=0.05):
+        self.stream = stream or sys.stdout
+        self.max_chars = max_chars
+        self.interval = interval
+        self._pending = {}
+        self._pending_chars = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="pageindex-stream-sink", daemon=True)
+        self._thread.start()
+
+    def write(self, call_id, text):
+        with self._lock:
+            self._pending.setdefault(call_id, []).append(text)
+            self._pending_chars += len(text)
+            full = self._pending_chars >= self.max_chars
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending, self._pending_chars = self._pending, {}, 0
+        if not pending:
+            return
+        lines = [
+            STREAM_PREFIX + json.dumps({"id": call_id, "text": "".join(parts)}, ensure_ascii=False) + "\n"
+            for call_id, parts in pending.items()
+        ]
+        try:
+            self.stream.write("".join(lines))
+            self.stream.flush()
+        except (OSError, ValueError):
+            # stdout closed under us (GUI went away): nothing left to show
+            pass
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self._thread.join(timeout=1)
+        self.flush()
+
@@ -0,0 +1,67 @@
+import json
+
+
+class SSEParser:
+    """
+    Incremental parser for OpenAI-compatible `text/event-stream` bodies.
+
+    Feed raw bytes in whatever chunks the transport hands out; complete `data:`
+    payloads come back as strings. Every `data:` line is treated as one event,
+    which is how chat completion streams are framed in practice (one JSON object
+    per line), so a missing blank-line separator does not stall the stream.
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+        self.done = False
+
+    def feed(self, chunk):
+        if self.done or not chunk:
+            return []
+        self._buffer.extend(chunk)
+        payloads = []
+        start = 0
+        while True:
+            end = self._buffer.find(b"\n", start)
+            if end == -1:
+                break
+            payload = self._parse_line(bytes(self._buffer[start:end]))
+            start = end + 1
+            if payload is None:
+                continue
+            if payload == "[DONE]":
+                self.done = True
+                break
+            payloads.append(payload)
+        del self._buffer[:start]
+        return payloads
+
+    def flush(self):
+        """Parses a trailing line that was not terminated by a newline."""
+        if self.done or not self._buffer:
+            return []
+        payload = self._parse_line(bytes(self._buffer))
+        self._buffer.clear()
+        if payload is None:
+            return []
+        if payload == "[DONE]":
+            self.done = True
+            return []
+        return [payload]
+
+    @staticmethod
+    def _parse_line(raw):
+        line = raw.decode("utf-8", errors="replace").strip()
+        if not line.startswith("data:"):
+            # comments (": keep-alive"), event:, id:, retry: and blank lines
+            return None
+        return line[5:].strip()
+
+
+def delta_content(payload):
+    """Returns the text delta carried by one chat completion chunk, or None."""
+    try:
+        data_json = json.loads(payload)
+        delta = data_json['choices'][0].get('delta', {})
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+        return None
+    return delta.get('content')
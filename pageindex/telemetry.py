@@ -0,0 +1,302 @@
+import contextvars
+import functools
+import inspect
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Pipeline stage of the code that is currently calling the LLM, outermost first.
+# asyncio tasks copy the context when they are created, so a stage set around an
+# asyncio.gather applies to every call made inside it.
+_stage_path = contextvars.ContextVar("pageindex_llm_stage", default=())
+_current_run = contextvars.ContextVar("pageindex_llm_run", default=None)
+
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 180, float("inf"))
+
+
+def current_stage():
+    path = _stage_path.get()
+    return "/".join(path) if path else "unattributed"
+
+
+@contextmanager
+def llm_stage(name):
+    """Tags every LLM call made inside the block with pipeline stage `name`."""
+    path = _stage_path.get()
+    if path and path[-1] == name:
+        # recursion (e.g. process_large_node_recursively) stays one stage
+        yield
+        return
+    token = _stage_path.set(path + (name,))
+    try:
+        yield
+    finally:
+        _stage_path.reset(token)
+
+
+def tag_stage(name):
+    """Decorator form of llm_stage for both plain and async functions."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with llm_stage(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with llm_stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class CallTracker:
+    """Measures one logical LLM call (all of its attempts)."""
+    def __init__(self, registry, stage):
+        self.registry = registry
+        self.stage = stage
+        self.started = time.monotonic()
+        self.attempt_started = self.started
+        self.first_token_at = None
+        self.retries = 0
+        self.hedged = False
+        self.endpoint = None
+
+    def begin_attempt(self):
+        self.attempt_started = time.monotonic()
+        self.first_token_at = None
+
+    def retry(self):
+        self.retries += 1
+
+    def on_delta(self, content_str):
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+
+    def finish(self, prompt_tokens=0, completion_tokens=0, cache_hit=False, error=None):
+        now = time.monotonic()
+        record = {
+            'stage': self.stage,
+            'latency': now - self.started,
+            'ttft': (self.first_token_at - self.attempt_started) if self.first_token_at is not None else None,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'retries': self.retries,
+            'hedged': self.hedged,
+            'cache_hit': cache_hit,
+            'error': error,
+            'endpoint': self.endpoint,
+            'timestamp': time.time(),
+        }
+        self.registry.record(record)
+        return record
+
+
+class _StageStats:
+    __slots__ = ("calls", "errors", "cache_hits", "retries", "hedges", "latency_sum", "latency_max",
+                 "ttft_sum", "ttft_count", "prompt_tokens", "completion_tokens", "buckets")
+
+    def __init__(self):
+        self.calls = self.errors = self.cache_hits = self.retries = self.hedges = 0
+        self.latency_sum = self.latency_max = self.ttft_sum = 0.0
+        self.ttft_count = self.prompt_tokens = self.completion_tokens = 0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def add(self, record):
+        self.calls += 1
+        self.errors += 1 if record['error'] else 0
+        self.cache_hits += 1 if record['cache_hit'] else 0
+        self.retries += record['retries']
+        self.hedges += 1 if record.get('hedged') else 0
+        self.latency_sum += record['latency']
+        self.latency_max = max(self.latency_max, record['latency'])
+        if record['ttft'] is not None:
+            self.ttft_sum += record['ttft']
+            self.ttft_count += 1
+        self.prompt_tokens += record['prompt_tokens'] or 0
+        self.completion_tokens += record['completion_tokens'] or 0
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if record['latency'] <= bound:
+                self.buckets[i] += 1
+                break
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'cache_hits': self.cache_hits,
+            'retries': self.retries,
+            'hedges': self.hedges,
+            'latency_total': round(self.latency_sum, 3),
+            'latency_avg': round(self.latency_sum / self.calls, 3) if self.calls else 0.0,
+            'latency_max': round(self.latency_max, 3),
+            'ttft_avg': round(self.ttft_sum / self.ttft_count, 3) if self.ttft_count else None,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+        }
+
+
+class MetricsRegistry:
+    """
+    In-process store of LLM call metrics, aggregated per pipeline stage.
+    Keeps the most recent `max_records` raw call records for reports.
+    """
+    def __init__(self, max_records=10000):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._records = deque(maxlen=max_records)
+
+    def start_call(self, stage=None):
+        return CallTracker(self, stage or current_stage())
+
+    def record(self, record):
+        with self._lock:
+            self._stages.setdefault(record['stage'], _StageStats()).add(record)
+            self._records.append(record)
+        run = _current_run.get()
+        if run is not None:
+            run.add(record)
+
+    def snapshot(self):
+        with self._lock:
+            return {stage: stats.to_dict() for stage, stats in self._stages.items()}
+
+    def recent(self, stage=None, limit=None):
+        with self._lock:
+            records = [r for r in self._records if stage is None or r['stage'] == stage]
+        return records[-limit:] if limit else records
+
+    def to_prometheus(self):
+        """Renders the registry in the Prometheus text exposition format."""
+        with self._lock:
+            items = [(stage, stats) for stage, stats in sorted(self._stages.items())]
+            lines = []
+
+            def metric(name, kind, help_text, values):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(values)
+
+            def label(stage):
+                return stage.replace("\\", "\\\\").replace('"', '\\"')
+
+            metric("pageindex_llm_calls_total", "counter", "LLM calls by pipeline stage.",
+                   [f'pageindex_llm_calls_total{{stage="{label(s)}"}} {st.calls}' for s, st in items])
+            metric("pageindex_llm_errors_total", "counter", "Failed LLM calls by pipeline stage.",
+                   [f'pageindex_llm_errors_total{{stage="{label(s)}"}} {st.errors}' for s, st in items])
+            metric("pageindex_llm_cache_hits_total", "counter", "LLM calls served from the response cache.",
+                   [f'pageindex_llm_cache_hits_total{{stage="{label(s)}"}} {st.cache_hits}' for s, st in items])
+            metric("pageindex_llm_retries_total", "counter", "Retried LLM attempts.",
+                   [f'pageindex_llm_retries_total{{stage="{label(s)}"}} {st.retries}' for s, st in items])
+            metric("pageindex_llm_hedges_total", "counter", "LLM calls that sent a hedged duplicate request.",
+                   [f'pageindex_llm_hedges_total{{stage="{label(s)}"}} {st.hedges}' for s, st in items])
+            metric("pageindex_llm_prompt_tokens_total", "counter", "Prompt tokens sent.",
+                   [f'pageindex_llm_prompt_tokens_total{{stage="{label(s)}"}} {st.prompt_tokens}' for s, st in items])
+            metric("pageindex_llm_completion_tokens_total", "counter", "Completion tokens received.",
+                   [f'pageindex_llm_completion_tokens_total{{stage="{label(s)}"}} {st.completion_tokens}' for s, st in items])
+            metric("pageindex_llm_ttft_seconds_sum", "counter", "Sum of time-to-first-token.",
+                   [f'pageindex_llm_ttft_seconds_sum{{stage="{label(s)}"}} {st.ttft_sum:.6f}' for s, st in items])
+            metric("pageindex_llm_ttft_seconds_count", "counter", "Calls with a measured time-to-first-token.",
+                   [f'pageindex_llm_ttft_seconds_count{{stage="{label(s)}"}} {st.ttft_count}' for s, st in items])
+
+            histogram = []
+            for s, st in items:
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, st.buckets):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    histogram.append(f'pageindex_llm_latency_seconds_bucket{{stage="{label(s)}",le="{le}"}} {cumulative}')
+                histogram.append(f'pageindex_llm_latency_seconds_sum{{stage="{label(s)}"}} {st.latency_sum:.6f}')
+                histogram.append(f'pageindex_llm_latency_seconds_count{{stage="{label(s)}"}} {st.calls}')
+            metric("pageindex_llm_latency_seconds", "histogram", "End-to-end LLM call latency including retries.", histogram)
+        return "\n".join(lines) + "\n"
+
+
+class RunReport:
+    """Collects the LLM calls of one page_index_main run for the per-run JSON report."""
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._calls = 0
+
+    def add(self, record):
+        with self._lock:
+            self._stages.setdefault(record['stage'], _StageStats()).add(record)
+            self._calls += 1
+
+    def to_dict(self):
+        with self._lock:
+            by_stage = {stage: stats.to_dict() for stage, stats in sorted(self._stages.items())}
+        by_leaf = {}
+        for stage, stats in by_stage.items():
+            leaf = by_leaf.setdefault(stage.split("/")[-1], {'calls': 0, 'latency_total': 0.0, 'prompt_tokens': 0, 'completion_tokens': 0})
+            leaf['calls'] += stats['calls']
+            leaf['latency_total'] = round(leaf['latency_total'] + stats['latency_total'], 3)
+            leaf['prompt_tokens'] += stats['prompt_tokens']
+            leaf['completion_tokens'] += stats['completion_tokens']
+        return {
+            'run': self.name,
+            'wall_time': round(time.time() - self.started, 3),
+            'llm_calls': self._calls,
+            'by_stage': by_stage,
+            'by_leaf_stage': by_leaf,
+        }
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2, ensure_ascii=False)
+
+
+@contextmanager
+def run_report(name):
+    """Routes the LLM calls made inside the block into a fresh RunReport."""
+    report = RunReport(name)
+    token = _current_run.set(report)
+    try:
+        yield report
+    finally:
+        _current_run.reset(token)
+
+
+_registry = MetricsRegistry()
+_server = None
+_server_lock = threading.Lock()
+
+
+def get_metrics_registry():
+    return _registry
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """Serves GET /metrics in Prometheus text format from a daemon thread. Idempotent."""
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return _server
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = _registry.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        _server = ThreadingHTTPServer((host, port), _Handler)
+        threading.Thread(target=_server.serve_forever, name="pageindex-metrics", daemon=True).start()
+        return _server
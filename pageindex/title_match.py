@@ -0,0 +1,118 @@
+import re
+import unicodedata
+from difflib import SequenceMatcher
+
+# "1.2", "IV.", "A.", "Chapter 3", "Part II", "第三章", "第12条" ... in front of a title
+_NUMBERING = re.compile(
+    r"^\s*((chapter|part|section|appendix|article)\s+[\w.]+[.:]?\s*"
+    r"|第\s*[\d一二三四五六七八九十百千零〇]+\s*[章节部篇条款编卷]\s*"
+    r"|[\d]+(\.[\d]+)*\.?\s+|[ivxlcdm]+[.)]\s+|[a-z][.)]\s+|[(（][\w一二三四五六七八九十]+[)）]\s*)",
+    re.IGNORECASE,
+)
+# A word broken across lines by a hyphen: "intro-\nduction"
+_HYPHENATION = re.compile(r"(\w)-\s*\n\s*(\w)")
+
+
+def normalize_title_text(text):
+    """Folds width and case, joins hyphenated line breaks and drops spaces and punctuation."""
+    text = unicodedata.normalize("NFKC", text or "")
+    text = _HYPHENATION.sub(r"\1\2", text).lower()
+    return re.sub(r"[\W_]+", "", text)
+
+
+def strip_numbering(title):
+    return _NUMBERING.sub("", title or "", count=1).strip()
+
+
+def _partial_ratio(needle, haystack):
+    """Best similarity of `needle` to any same-length window of `haystack`."""
+    if not needle:
+        return 0.0
+    if needle in haystack:
+        return 1.0
+    if len(haystack) <= len(needle):
+        return SequenceMatcher(None, needle, haystack, autojunk=False).ratio()
+    best = 0.0
+    blocks = SequenceMatcher(None, needle, haystack, autojunk=False).get_matching_blocks()
+    for a, b, size in blocks:
+        if not size:
+            continue
+        # Align the window so the matching block sits where it does in the needle
+        start = max(0, min(b - a, len(haystack) - len(needle)))
+        ratio = SequenceMatcher(None, needle, haystack[start:start + len(needle)], autojunk=False).ratio()
+        if ratio > best:
+            best = ratio
+            if best == 1.0:
+                break
+    return best
+
+
+def _title_candidates(title):
+    full = normalize_title_text(title)
+    if not full:
+        return set()
+    candidates = {full}
+    stripped = normalize_title_text(strip_numbering(title))
+    # A title that is little more than its number is only matched whole
+    if len(stripped) >= 3:
+        candidates.add(stripped)
+    return candidates
+
+
+def title_match_score(title, page_text, at_start=False):
+    """
+    Confidence between 0 and 1 that `title` appears on a page (or, with
+    `at_start`, that the page begins with it), or None when the page has no
+    text to judge by. Whitespace, case, full/half-width forms, hyphenated line
+    breaks and a leading numbering prefix do not count against a match.
+    """
+    page = normalize_title_text(page_text)
+    if not page:
+        return None
+    candidates = _title_candidates(title)
+    if not candidates:
+        return None
+    best = 0.0
+    for candidate in candidates:
+        # Leave room for a numbering prefix or a short running header before the title
+        haystack = page[:len(candidate) + 20] if at_start else page
+        best = max(best, _partial_ratio(candidate, haystack))
+    return best
+
+
+def heading_match_score(title, page_text, at_start=False, max_lines=3):
+    """
+    Confidence between 0 and 1 that `title` stands on a page as a heading:
+    lines that begin with it, after any numbering prefix, and hold little
+    else. A title wrapped over up to `max_lines` lines counts. With
+    `at_start`, the heading has to come within the first 20 characters of the
+    page. None when the page has no text to judge by.
+
+    Unlike `title_match_score`, a mention in running text ("we discuss the
+    risks ...") scores low.
+    """
+    lines = [line for line in (page_text or "").split("\n") if normalize_title_text(line)]
+    if not lines:
+        return None
+    candidates = _title_candidates(title)
+    if not candidates:
+        return None
+    plain = [normalize_title_text(line) for line in lines]
+    unnumbered = [normalize_title_text(strip_numbering(line)) for line in lines]
+    best, before = 0.0, 0
+    for i in range(len(lines)):
+        if at_start and before > 20:
+            break
+        for candidate in candidates:
+            for first in {plain[i], unnumbered[i]}:
+                # Add wrapped lines until the text is as long as the title
+                text = first
+                for j in range(i + 1, i + max_lines + 1):
+                    best = max(best, SequenceMatcher(None, candidate, text, autojunk=False).ratio())
+                    if len(text) >= len(candidate) or j >= len(lines):
+                        break
+                    text += plain[j]
+        if best == 1.0:
+            break
+        before += len(plain[i])
+    return best
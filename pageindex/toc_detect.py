@@ -0,0 +1,50 @@
+import re
+
+_TOC_KEYWORD = re.compile(r"^\s*(table\s+of\s+contents|contents|目\s*录|目\s*錄|目\s*次)\b", re.IGNORECASE)
+# Lists of figures/tables look just like a TOC but are not one; the LLM decides those
+_NOT_TOC_KEYWORD = re.compile(r"list\s+of\s+(figures|tables|illustrations|abbreviations)|[图表插]\s*目\s*录", re.IGNORECASE)
+# Some entry text, then a separator and an arabic or roman page number (a bare page number does not count)
+_ENDS_WITH_PAGE = re.compile(r"\w.*?[\s.…·_-](\d{1,4}|[ivxlcdm]{1,7})\s*$", re.IGNORECASE)
+_DOT_LEADER = re.compile(r"(\.\s?){4,}|…{2,}|·{4,}|_{4,}|-{6,}")
+_NUMBERED = re.compile(
+    r"^\s*(\d+(\.\d+)*\.?\s|[ivxlcdm]+\.\s|(chapter|part|section|appendix)\s+\w+|第\s*[\d一二三四五六七八九十百]+\s*[章节部篇条])",
+    re.IGNORECASE,
+)
+
+
+def has_toc_heading(text):
+    """Whether a "Contents"/"目录" heading opens the page (and it is not a list of figures or tables)."""
+    lines = [line for line in (text or "").splitlines() if line.strip()][:5]
+    return any(_TOC_KEYWORD.search(line) for line in lines) and not _NOT_TOC_KEYWORD.search("\n".join(lines))
+
+
+def toc_page_score(text):
+    """
+    Local estimate, between 0 and 1, of how likely a page is to be a table of contents.
+
+    Signals are a "Contents"/"目录" heading near the top, the share of lines
+    ending in a page number, dot leaders, and numbered or indented entry lines.
+    Long prose lines pull the score down.
+    """
+    lines = [line for line in (text or "").splitlines() if line.strip()]
+    if len(lines) < 3:
+        return 0.0
+
+    ends_with_page = sum(1 for line in lines if _ENDS_WITH_PAGE.search(line)) / len(lines)
+    leaders = sum(1 for line in lines if _DOT_LEADER.search(line)) / len(lines)
+    numbered = sum(1 for line in lines if _NUMBERED.search(line)) / len(lines)
+    indents = {len(line) - len(line.lstrip()) for line in lines if _ENDS_WITH_PAGE.search(line)}
+    keyword = any(_TOC_KEYWORD.search(line) for line in lines[:5])
+
+    score = (
+        0.35 * min(1.0, ends_with_page / 0.6)
+        + 0.25 * min(1.0, leaders / 0.3)
+        + 0.25 * keyword
+        + 0.15 * max(min(1.0, numbered / 0.4), 1.0 if len(indents) > 1 else 0.0)
+    )
+    average_length = sum(len(line.strip()) for line in lines) / len(lines)
+    if average_length > 120:
+        score *= 0.5
+    if _NOT_TOC_KEYWORD.search("\n".join(lines[:5])):
+        score = min(score, 0.5)
+    return score
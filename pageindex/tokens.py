@@ -0,0 +1,110 @@
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+
+import tiktoken
+
+# CJK ideographs, kana and hangul come out at roughly one token per character
+_WIDE_CHARS = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+
+def approximate_tokens(text):
+    """Tokenizer-free estimate: one token per CJK character, four characters per token otherwise."""
+    wide = len(_WIDE_CHARS.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+
+class TokenCounter:
+    """
+    Model-aware token counter on tiktoken with a memo of counts by text hash.
+
+    The encoding is picked per model (`encoding` forces one for every model);
+    models tiktoken does not know use `fallback_encoding`. If no encoding can be
+    loaded (e.g. offline without a tiktoken cache) counts fall back to
+    `approximate_tokens`. Page texts are counted again and again across the
+    pipeline, so up to `max_entries` counts are kept, least recently used first out.
+    """
+    def __init__(self, encoding="auto", fallback_encoding="cl100k_base", max_entries=50000):
+        self.encoding = encoding
+        self.fallback_encoding = fallback_encoding
+        self.max_entries = max_entries
+        self._encodings = {}
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def _encoding_name(self, model):
+        if self.encoding and self.encoding != "auto":
+            return self.encoding
+        if model:
+            try:
+                return tiktoken.encoding_name_for_model(model)
+            except KeyError:
+                pass
+        return self.fallback_encoding
+
+    def _get_encoding(self, name):
+        if name not in self._encodings:
+            try:
+                self._encodings[name] = tiktoken.get_encoding(name)
+            except Exception as e:
+                logging.warning(f"Tokenizer {name} unavailable ({type(e).__name__}: {e}), approximating token counts")
+                self._encodings[name] = None
+        return self._encodings[name]
+
+    def encoding_name(self, model=None):
+        """Name of the encoding counts for `model` come from, or 'approx' without a tokenizer."""
+        name = self._encoding_name(model)
+        return name if self._get_encoding(name) is not None else "approx"
+
+    def count(self, text, model=None):
+        return self.count_batch([text], model)[0]
+
+    def count_batch(self, texts, model=None, batch_size=64):
+        """Token counts of `texts` (any iterable), encoding cache misses `batch_size` at a time."""
+        name = self._encoding_name(model)
+        encoding = self._get_encoding(name)
+        counts, missing = [], []
+
+        def encode_missing():
+            if encoding is not None:
+                found = [len(tokens) for tokens in encoding.encode_ordinary_batch([t for _, _, t in missing])]
+            else:
+                found = [approximate_tokens(t) for _, _, t in missing]
+            with self._lock:
+                for (i, key, _), n in zip(missing, found):
+                    counts[i] = n
+                    self._memo[key] = n
+                while len(self._memo) > self.max_entries:
+                    self._memo.popitem(last=False)
+            missing.clear()
+
+        for i, text in enumerate(texts):
+            text = text or ""
+            key = (name, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest())
+            with self._lock:
+                n = self._memo.get(key)
+                if n is not None:
+                    self._memo.move_to_end(key)
+                    self._stats["hits"] += 1
+                else:
+                    self._stats["misses"] += 1
+            counts.append(n)
+            if n is None:
+                missing.append((i, key, text))
+                if len(missing) >= batch_size:
+                    encode_missing()
+        if missing:
+            encode_missing()
+        return counts
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+                "entries": len(self._memo),
+            }
@@ -1,22 +1,48 @@
 import os
 import re
+import atexit
+import hashlib
 import ssl
 import json
 import time
 import copy
 import asyncio
 import logging
-import requests
+import contextvars
+import threading
 import urllib3
 import yaml
+import math
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from types import SimpleNamespace as config
 
-import tiktoken
 import PyPDF2
 from dotenv import load_dotenv
 
+from .http_client import PooledHTTPClient
+from .async_client import AsyncLLMClient, aiohttp
+from .streaming import SSEParser, delta_content
+from .rate_limit import LLMScheduler, PRIORITY_CRITICAL, PRIORITY_NORMAL, PRIORITY_BACKGROUND
+from .llm_cache import LLMResponseCache, make_cache_key
+from .page_store import PageStore, pdf_sha256
+from .mapped_pages import MappedPageList
+from .tokens import TokenCounter
+from .boilerplate import BoilerplateFilter
+from .retry import (
+    RetryPolicy, LLMError, LLMAuthError, LLMBadRequestError, LLMConnectionError,
+    LLMEmptyResponseError, LLMHTMLResponseError, LLMCancelled, error_for_response,
+)
+from .endpoints import Endpoint, EndpointPool
+from .hedging import HedgePolicy, hedged_call
+from .stream_sink import BatchedStreamSink, NullStreamSink, new_call_id
+from .decision import DecisionReader, read_decision
+from .replay import CassetteRecorder, ReplayServer
+from .budget import get_document_budget, budget_low
+from .telemetry import get_metrics_registry, llm_stage
+
 # 1. Network & Environment Config
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 ssl._create_default_https_context = ssl._create_unverified_context
@@ -29,6 +55,8 @@ load_dotenv()
 # Check environment variable first, fallback to hardcoded
 CHATGPT_API_KEY = os.getenv("CHATGPT_API_KEY", "YOUR API KEY")
 API_ENDPOINT = "https://api.deepseek.com/v1/chat/completions"
+LLM_TARGET_MODEL = "DeepSeek-V3" # Ensure this model name matches your provider's requirements
+LLM_TEMPERATURE = 0.1
 
 # --- Universal Fallback Object (Crash Preventer) ---
 class UniversalFallback(dict):
@@ -54,81 +82,450 @@ class UniversalFallback(dict):
     def get(self, key, default=None):
         return super().get(key, default)
 
-def request_api_stream_sync(model, messages, timeout=180):
-    target_model = "DeepSeek-V3" # Ensure this model name matches your provider's requirements
-    
+# --- Shared HTTP clients (connection pool per endpoint) ---
+_http_client = None
+_async_client = None
+_http_client_lock = threading.Lock()
+
+def get_http_client():
+    """Returns the process-wide pooled client, built from config.yaml on first use."""
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                opt = ConfigLoader().load()
+                _http_client = PooledHTTPClient(
+                    pool_size=int(getattr(opt, 'llm_pool_size', 32)),
+                    keep_alive=getattr(opt, 'llm_keep_alive', 'yes') == 'yes',
+                    dns_cache_ttl=int(getattr(opt, 'llm_dns_cache_ttl', 300)),
+                    verify=False,
+                )
+    return _http_client
+
+def get_async_client():
+    """Returns the process-wide asyncio client, or None when aiohttp is not installed."""
+    global _async_client
+    if aiohttp is None:
+        return None
+    if _async_client is None:
+        with _http_client_lock:
+            if _async_client is None:
+                opt = ConfigLoader().load()
+                _async_client = AsyncLLMClient(
+                    pool_size=int(getattr(opt, 'llm_async_pool_size', 100)),
+                    keep_alive=getattr(opt, 'llm_keep_alive', 'yes') == 'yes',
+                    dns_cache_ttl=int(getattr(opt, 'llm_dns_cache_ttl', 300)),
+                    verify=False,
+                )
+    return _async_client
+
+async def close_async_client():
+    """Closes the aiohttp sessions; call before the event loop shuts down."""
+    if _async_client is not None:
+        await _async_client.close()
+
+# --- Process-wide LLM scheduler (concurrency cap + requests/min + tokens/min) ---
+_llm_scheduler = None
+_completion_token_estimate = 1000
+_stage_priorities = {}
+
+def get_llm_scheduler():
+    """Returns the scheduler every LLM call goes through, built from config.yaml on first use."""
+    global _llm_scheduler, _completion_token_estimate, _stage_priorities
+    if _llm_scheduler is None:
+        with _http_client_lock:
+            if _llm_scheduler is None:
+                opt = ConfigLoader().load()
+                _completion_token_estimate = int(getattr(opt, 'llm_completion_token_estimate', 1000))
+                _stage_priorities = {stage: PRIORITY_BACKGROUND for stage in getattr(opt, 'llm_background_stages', None) or ()}
+                _stage_priorities.update({stage: PRIORITY_CRITICAL for stage in getattr(opt, 'llm_critical_stages', None) or ()})
+                _llm_scheduler = LLMScheduler(
+                    max_concurrency=int(getattr(opt, 'llm_max_concurrency', 16)),
+                    requests_per_min=int(getattr(opt, 'llm_requests_per_min', 0)),
+                    tokens_per_min=int(getattr(opt, 'llm_tokens_per_min', 0)),
+                    critical_reserve=int(getattr(opt, 'llm_critical_reserve', 0)),
+                    aging=float(getattr(opt, 'llm_priority_aging', 30)),
+                )
+    return _llm_scheduler
+
+def stage_priority(stage):
+    """Scheduler priority of a stage path: the innermost stage listed in config.yaml decides."""
+    get_llm_scheduler()
+    for name in reversed(stage.split("/")):
+        if name in _stage_priorities:
+            return _stage_priorities[name]
+    return PRIORITY_NORMAL
+
+def _estimate_prompt_tokens(messages):
+    return sum(count_tokens(m.get('content') or '') for m in messages)
+
+# --- Persistent response cache ---
+_llm_cache = None
+_llm_cache_checked = False
+
+def get_llm_cache():
+    """Returns the on-disk response cache, or None when `llm_cache` is off in config.yaml."""
+    global _llm_cache, _llm_cache_checked
+    if not _llm_cache_checked:
+        replay_mode = get_replay_mode()
+        with _http_client_lock:
+            if not _llm_cache_checked:
+                opt = ConfigLoader().load()
+                # Recording and replaying must see every call, so the cache stays out of the way
+                if getattr(opt, 'llm_cache', 'no') == 'yes' and replay_mode == 'off':
+                    _llm_cache = LLMResponseCache(
+                        getattr(opt, 'llm_cache_path', './cache/llm_cache.sqlite'),
+                        max_bytes=int(float(getattr(opt, 'llm_cache_max_mb', 512)) * 1024 * 1024),
+                        ttl=int(float(getattr(opt, 'llm_cache_ttl_days', 30)) * 24 * 3600),
+                    )
+                _llm_cache_checked = True
+    return _llm_cache
+
+def _llm_cache_key(messages, model, decision_key=None):
+    """Key of a reply from `model`, the model named in the request payload."""
+    # Early-stopped decision replies are truncated, so they never share an entry with full ones
+    if decision_key:
+        model = f"{model}#decision:{decision_key}"
+    return make_cache_key(model, messages, LLM_TEMPERATURE)
+
+# --- Record/replay harness ---
+_replay_mode = None
+_replay_server = None
+_cassette_recorder = None
+
+def get_replay_mode():
+    """'off', 'record' or 'replay', from `llm_replay_mode` in config.yaml (env PAGEINDEX_LLM_REPLAY wins)."""
+    global _replay_mode, _cassette_recorder
+    if _replay_mode is None:
+        opt = ConfigLoader().load()
+        mode = os.getenv("PAGEINDEX_LLM_REPLAY") or getattr(opt, 'llm_replay_mode', 'off') or 'off'
+        cassette = os.getenv("PAGEINDEX_LLM_CASSETTE") or getattr(opt, 'llm_cassette', 'tests/cassettes/llm_cassette.jsonl')
+        if mode == 'record':
+            _cassette_recorder = CassetteRecorder(cassette)
+        _replay_mode = mode
+    return _replay_mode
+
+def get_replay_server():
+    """Starts (once) the local SSE stub that serves the cassette in replay mode."""
+    global _replay_server
+    if _replay_server is None:
+        opt = ConfigLoader().load()
+        cassette = os.getenv("PAGEINDEX_LLM_CASSETTE") or getattr(opt, 'llm_cassette', 'tests/cassettes/llm_cassette.jsonl')
+        _replay_server = ReplayServer(
+            cassette,
+            ttft=float(getattr(opt, 'llm_replay_ttft', 0.0)),
+            chunk_delay=float(getattr(opt, 'llm_replay_chunk_delay', 0.0)),
+        ).start()
+        print(f"[INFO] Replaying LLM calls from {cassette} via {_replay_server.url}")
+    return _replay_server
+
+def _record_call(payload, content, started, tracker):
+    if get_replay_mode() != 'record':
+        return
+    ttft = None
+    if tracker and tracker.first_token_at is not None:
+        ttft = tracker.first_token_at - tracker.attempt_started
+    _cassette_recorder.record(payload, content, latency=time.monotonic() - started, ttft=ttft)
+
+# --- Endpoint pool (failover + latency-aware routing) ---
+_endpoint_pool = None
+
+def get_endpoint_pool():
+    """Returns the shared EndpointPool, built from `llm_endpoints` in config.yaml on first use."""
+    global _endpoint_pool
+    if _endpoint_pool is None:
+        replay_url = get_replay_server().url if get_replay_mode() == 'replay' else None
+        with _http_client_lock:
+            if _endpoint_pool is None and replay_url:
+                _endpoint_pool = EndpointPool([Endpoint(replay_url, api_key='replay', name='replay')])
+            if _endpoint_pool is None:
+                opt = ConfigLoader().load()
+                _endpoint_pool = EndpointPool.from_config(
+                    getattr(opt, 'llm_endpoints', None),
+                    default_url=API_ENDPOINT,
+                    default_api_key=CHATGPT_API_KEY,
+                    failure_threshold=int(getattr(opt, 'llm_breaker_failures', 5)),
+                    cooldown=float(getattr(opt, 'llm_breaker_cooldown', 30)),
+                )
+    return _endpoint_pool
+
+def _build_llm_request(endpoint, messages):
     headers = {
         "Content-Type": "application/json",
-        "Authorization": f"Bearer {CHATGPT_API_KEY}",
+        "Authorization": f"Bearer {endpoint.api_key}",
         "Accept": "application/json",
         "User-Agent": "PostmanRuntime/7.26.8"
     }
     
     payload = {
-        "model": target_model,
+        "model": endpoint.model or LLM_TARGET_MODEL,
         "messages": messages,
         "stream": True,
-        "temperature": 0.1
+        "temperature": LLM_TEMPERATURE
     }
-    
-    urls_to_try = [
-        "https://api.deepseek.com/v1/chat/completions"
-        "https://api.deepseek.com/v1/chat/completions"
-        
-    ]
+    return headers, payload
 
-    for url in urls_to_try:
-        try:
-            response = requests.post(
-                url, 
-                headers=headers, 
-                json=payload, 
-                timeout=timeout, 
-                verify=False,
-                stream=True 
-            )
-            
-            if "text/html" in response.headers.get("Content-Type", ""):
-                logging.warning(f"⚠️ URL {url} returned HTML (Login Page). Skipping...")
-                continue
-            
-            # 401 Handling
-            if response.status_code == 401:
-                logging.error(f"⚠️ URL {url} failed with 401 Unauthorized. Check your API KEY.")
-                continue
+# --- Stream sink (live view of the generated text) ---
+_stream_sink = None
+
+def get_stream_sink():
+    """
+    Where streamed deltas go: `llm_stream_sink` in config.yaml, or env PAGEINDEX_STREAM_SINK
+    (pgui sets "gui"). "none" drops them; "gui" batches them onto stdout for pgui.
+    """
+    global _stream_sink
+    if _stream_sink is None:
+        with _http_client_lock:
+            if _stream_sink is None:
+                opt = ConfigLoader().load()
+                kind = os.getenv("PAGEINDEX_STREAM_SINK") or getattr(opt, 'llm_stream_sink', 'none') or 'none'
+                if kind == 'gui':
+                    _stream_sink = BatchedStreamSink(
+                        max_chars=int(getattr(opt, 'llm_stream_batch_chars', 256)),
+                        interval=float(getattr(opt, 'llm_stream_batch_ms', 50)) / 1000,
+                    )
+                    atexit.register(_stream_sink.close)
+                else:
+                    _stream_sink = NullStreamSink()
+    return _stream_sink
 
-            if response.status_code != 200:
-                logging.warning(f"⚠️ URL {url} failed with {response.status_code}")
-                continue
+def _log_llm_error(error):
+    if isinstance(error, LLMAuthError):
+        logging.error(f"⚠️ {error} Check your API KEY.")
+    elif isinstance(error, LLMHTMLResponseError):
+        logging.warning(f"⚠️ {error}. Skipping...")
+    else:
+        logging.warning(f"⚠️ {type(error).__name__}: {error}")
 
+def _delta_handler(tracker, first_token=None, emit=True):
+    """Per-stream delta callback: feeds time-to-first-token into telemetry, then the stream sink."""
+    sink = get_stream_sink() if emit else None
+    if sink is not None and not sink.enabled:
+        sink = None
+    if tracker is None and first_token is None and sink is None:
+        return None
+    call_id = new_call_id()
+    def on_delta(content_str):
+        if tracker is not None:
+            tracker.on_delta(content_str)
+        if first_token is not None:
+            first_token.set()
+        if sink is not None:
+            sink.write(call_id, content_str)
+    return on_delta
+
+def _stream_url_sync(url, headers, payload, timeout, on_delta=None, cancel=None, stop_when=None):
+    """
+    One streaming attempt against one URL. Returns the content or raises an LLMError.
+    Once `stop_when(delta)` returns True the rest of the stream is abandoned.
+    """
+    try:
+        # Pooled session: the TCP/TLS connection is reused across calls.
+        # The context manager hands the connection back to the pool when done.
+        with get_http_client().post(
+            url, 
+            headers=headers, 
+            json=payload, 
+            timeout=timeout, 
+            stream=True 
+        ) as response:
+            if cancel is not None:
+                cancel.bind(response)
+            error = error_for_response(
+                response.status_code,
+                response.headers.get("Content-Type", ""),
+                retry_after=response.headers.get("Retry-After"),
+                body=response.text if response.status_code != 200 else "",
+                url=url,
+            )
+            if error:
+                raise error
+
+            parser = SSEParser()
             full_content = ""
-            for line in response.iter_lines():
-                if not line: continue
-                line_str = line.decode('utf-8').strip()
-                if line_str.startswith("data:"):
-                    data_part = line_str[5:].strip()
-                    if data_part == "[DONE]": break
-                    try:
-                        data_json = json.loads(data_part)
-                        delta = data_json['choices'][0].get('delta', {})
-                        if 'content' in delta:
-                            content_str = delta['content']
-                            full_content += content_str
-                            
-                            # === 【新增功能】 实时将字符输出到 stdout 供 GUI 捕获 ===
-                            # DEBUG_AI_CHAR 是 pgui.py 识别的特殊标记
-                            print(f"DEBUG_AI_CHAR:{content_str}", flush=True)
-                            # ===================================================
-
-                    except: continue
-            
-            if full_content:
-                return full_content
-        except Exception as e:
-            logging.error(f"Connection error to {url}: {e}")
+            stopped = False
+            for chunk in response.iter_content(chunk_size=None):
+                for data_part in parser.feed(chunk):
+                    content_str = delta_content(data_part)
+                    if content_str:
+                        full_content += content_str
+                        if on_delta: on_delta(content_str)
+                        if stop_when and stop_when(content_str):
+                            stopped = True
+                            break
+                if parser.done or stopped: break
+            if cancel is not None and cancel.cancelled:
+                raise LLMCancelled(f"{url} attempt cancelled", url=url)
+            if not stopped:
+                for data_part in parser.flush():
+                    content_str = delta_content(data_part)
+                    if content_str:
+                        full_content += content_str
+                        if on_delta: on_delta(content_str)
+    except LLMError:
+        raise
+    except Exception as e:
+        if cancel is not None and cancel.cancelled:
+            raise LLMCancelled(f"{url} attempt cancelled", url=url) from e
+        raise LLMConnectionError(f"Connection error to {url}: {e}", url=url) from e
+
+    if not full_content.strip():
+        raise LLMEmptyResponseError(f"{url} returned an empty stream", status=200, url=url)
+    return full_content
+
+def _decision_stop(decision_key):
+    # A fresh reader per stream: a failed or retried attempt must not leak its partial text
+    return DecisionReader(decision_key).feed if decision_key else None
+
+def _request_stream_sync(model, messages, timeout=180, tracker=None, cancel=None, first_token=None, emit=True, decision_key=None):
+    """
+    Tries each endpoint at most once, healthiest first; raises the last LLMError if none answered.
+    With `decision_key` the stream stops as soon as that JSON field has been read.
+    Returns (content, model the answering endpoint was sent).
+    """
+    pool = get_endpoint_pool()
+    tried = []
+    last_error = LLMConnectionError("No LLM endpoint configured")
+    while True:
+        endpoint = pool.choose(exclude=tried)
+        if endpoint is None:
+            raise last_error
+        tried.append(endpoint)
+        headers, payload = _build_llm_request(endpoint, messages)
+        if tracker:
+            tracker.endpoint = endpoint.name
+            tracker.begin_attempt()
+        started = time.monotonic()
+        try:
+            content = _stream_url_sync(endpoint.url, headers, payload, timeout,
+                                       on_delta=_delta_handler(tracker, first_token, emit), cancel=cancel,
+                                       stop_when=_decision_stop(decision_key))
+        except LLMCancelled:
+            pool.record_failure(endpoint, counts_against=False)
+            raise
+        except LLMError as e:
+            pool.record_failure(endpoint, counts_against=not isinstance(e, LLMBadRequestError))
+            _log_llm_error(e)
+            if isinstance(e, LLMBadRequestError):
+                raise
+            last_error = e
+            continue
+        except BaseException:
+            pool.record_failure(endpoint, counts_against=False)
+            raise
+        pool.record_success(endpoint, time.monotonic() - started)
+        _record_call(payload, content, started, tracker)
+        return content, payload["model"]
+
+async def _request_stream_async(model, messages, timeout=180, tracker=None, decision_key=None):
+    client = get_async_client()
+    pool = get_endpoint_pool()
+    tried = []
+    last_error = LLMConnectionError("No LLM endpoint configured")
+    while True:
+        endpoint = pool.choose(exclude=tried)
+        if endpoint is None:
+            raise last_error
+        tried.append(endpoint)
+        headers, payload = _build_llm_request(endpoint, messages)
+        if tracker:
+            tracker.endpoint = endpoint.name
+            tracker.begin_attempt()
+        started = time.monotonic()
+        try:
+            content = await client.stream_chat(endpoint.url, headers, payload, timeout=timeout,
+                                               on_delta=_delta_handler(tracker), stop_when=_decision_stop(decision_key))
+        except LLMError as e:
+            pool.record_failure(endpoint, counts_against=not isinstance(e, LLMBadRequestError))
+            _log_llm_error(e)
+            if isinstance(e, LLMBadRequestError):
+                raise
+            last_error = e
             continue
+        except BaseException:
+            # cancelled mid-stream: not the endpoint's fault
+            pool.record_failure(endpoint, counts_against=False)
+            raise
+        pool.record_success(endpoint, time.monotonic() - started)
+        _record_call(payload, content, started, tracker)
+        return content, payload["model"]
+
+def request_api_stream_sync(model, messages, timeout=180):
+    try:
+        return _request_stream_sync(model, messages, timeout)[0]
+    except LLMError:
+        return "Error"
+
+async def request_api_stream_async(model, messages, timeout=180):
+    """Same contract as request_api_stream_sync, but streams on the event loop."""
+    try:
+        return (await _request_stream_async(model, messages, timeout))[0]
+    except LLMError:
+        return "Error"
+
+# --- Retry policy ---
+_retry_policy = None
+LLM_REQUEST_TIMEOUT = 180
+
+def get_retry_policy():
+    """Returns the shared RetryPolicy, built from config.yaml on first use."""
+    global _retry_policy
+    if _retry_policy is None:
+        opt = ConfigLoader().load()
+        _retry_policy = RetryPolicy(
+            max_attempts=int(getattr(opt, 'llm_max_attempts', 4)),
+            base_delay=float(getattr(opt, 'llm_retry_base_delay', 1.0)),
+            max_delay=float(getattr(opt, 'llm_retry_max_delay', 30.0)),
+            deadline=float(getattr(opt, 'llm_call_deadline', 300.0)),
+        )
+    return _retry_policy
+
+# --- Hedged requests (tail latency on the sequential stages) ---
+_hedge_policy = None
+_hedge_policy_checked = False
+
+def get_hedge_policy():
+    """Returns the HedgePolicy, or None when `llm_hedging` is off in config.yaml."""
+    global _hedge_policy, _hedge_policy_checked
+    if not _hedge_policy_checked:
+        with _http_client_lock:
+            if not _hedge_policy_checked:
+                opt = ConfigLoader().load()
+                if getattr(opt, 'llm_hedging', 'no') == 'yes':
+                    _hedge_policy = HedgePolicy.from_opt(opt)
+                _hedge_policy_checked = True
+    return _hedge_policy
+
+def _request_stream_hedged(model, messages, timeout, tracker, hedge, scheduler, est_tokens, prompt_tokens, budget, decision_key=None,
+                           priority=PRIORITY_NORMAL):
+    """
+    _request_stream_sync with a duplicate request sent when the first token is late.
+    The duplicate needs its own scheduler slot, so hedges never exceed the global
+    concurrency cap; when no slot is free right away the call simply is not hedged.
+    """
+    delay = hedge.delay_for(tracker.stage, get_metrics_registry())
+
+    def primary(cancel, first_token):
+        return _request_stream_sync(model, messages, timeout, tracker=tracker, cancel=cancel, first_token=first_token,
+                                    decision_key=decision_key)
+
+    def duplicate(cancel, first_token):
+        # Only the primary streams to the GUI, so the two answers never interleave
+        return _request_stream_sync(model, messages, timeout, cancel=cancel, first_token=first_token, emit=False,
+                                    decision_key=decision_key)
 
-    return "Error"
+    def on_hedge():
+        tracker.hedged = True
+        if budget: budget.charge(1, prompt_tokens)
+        logging.info(f"Hedging LLM call in stage {tracker.stage} after {delay:.1f}s without a first token")
+
+    def release_hedge():
+        scheduler.settle(est_tokens, prompt_tokens)
+        scheduler.release()
+
+    return hedged_call(primary, duplicate, delay,
+                       acquire_hedge=lambda: scheduler.try_acquire(est_tokens, priority),
+                       release_hedge=release_hedge, on_hedge=on_hedge)
 
 # --- Framework Adapters ---
 
@@ -138,23 +535,168 @@ def clean_deepseek_content(content):
     content = re.sub(r'<think>.*?</think>', '', content, flags=re.DOTALL)
     return content.strip()
 
-def ChatGPT_API_with_finish_reason(model, prompt, api_key=None, chat_history=None):
-    messages = chat_history + [{"role": "user", "content": prompt}] if chat_history else [{"role": "user", "content": prompt}]
-    for i in range(3):
-        raw = request_api_stream_sync(model, messages)
-        if raw != "Error" and raw.strip():
-            return clean_deepseek_content(raw), "finished"
-        print(f'************* API Retry ({i+1}) *************')
-        time.sleep(3)
-    return "Error", "failed"
+def _build_messages(prompt, chat_history=None):
+    return chat_history + [{"role": "user", "content": prompt}] if chat_history else [{"role": "user", "content": prompt}]
+
+def _lookup_cached_response(messages, decision_key=None):
+    """
+    Returns (cache, cached_response); cache is None when caching is off.
+    Only a reply from the model of the endpoint the call would go to is served.
+    """
+    cache = get_llm_cache()
+    if not cache:
+        return None, None
+    endpoint = get_endpoint_pool().peek()
+    return cache, cache.get(_llm_cache_key(messages, endpoint.model or LLM_TARGET_MODEL, decision_key))
+
+def _retry_delay_or_none(policy, attempt, error, deadline_at):
+    delay = policy.next_delay(attempt, error, deadline_at)
+    if delay is None:
+        logging.error(f"LLM call failed after {attempt+1} attempt(s): {type(error).__name__}: {error}")
+    else:
+        print(f'************* API Retry ({attempt+1}) in {delay:.1f}s: {type(error).__name__} *************')
+    return delay
+
+def ChatGPT_API_with_finish_reason(model, prompt, api_key=None, chat_history=None, decision_key=None):
+    messages = _build_messages(prompt, chat_history)
+    tracker = get_metrics_registry().start_call()
+    prompt_tokens = _estimate_prompt_tokens(messages)
+    cache, cached = _lookup_cached_response(messages, decision_key)
+    if cached is not None:
+        tracker.finish(prompt_tokens, count_tokens(cached), cache_hit=True)
+        return clean_deepseek_content(cached), "finished"
+
+    scheduler = get_llm_scheduler()
+    policy = get_retry_policy()
+    deadline_at = policy.start()
+    est_tokens = prompt_tokens + _completion_token_estimate
+    priority = stage_priority(tracker.stage)
+    budget = get_document_budget()
+    hedge = get_hedge_policy()
+    if hedge and not hedge.applies(tracker.stage):
+        hedge = None
+    attempt = 0
+    while True:
+        if budget and budget.exhausted():
+            budget.refuse()
+            tracker.finish(prompt_tokens, 0, error='BudgetExhausted')
+            return "Error", "budget_exhausted"
+        try:
+            with scheduler.slot(est_tokens, priority):
+                timeout = policy.timeout_for(LLM_REQUEST_TIMEOUT, deadline_at)
+                if hedge:
+                    raw, sent_model = _request_stream_hedged(model, messages, timeout, tracker, hedge, scheduler, est_tokens, prompt_tokens, budget,
+                                                 decision_key=decision_key, priority=priority)
+                else:
+                    raw, sent_model = _request_stream_sync(model, messages, timeout=timeout, tracker=tracker, decision_key=decision_key)
+        except LLMError as e:
+            scheduler.settle(est_tokens, prompt_tokens)
+            if budget: budget.charge(1, 0)
+            delay = _retry_delay_or_none(policy, attempt, e, deadline_at)
+            if delay is None:
+                tracker.finish(prompt_tokens, 0, error=type(e).__name__)
+                return "Error", "failed"
+            time.sleep(delay)
+            tracker.retry()
+            attempt += 1
+            continue
+        completion_tokens = count_tokens(raw)
+        scheduler.settle(est_tokens, prompt_tokens + completion_tokens)
+        if budget: budget.charge(1, prompt_tokens + completion_tokens)
+        tracker.finish(prompt_tokens, completion_tokens)
+        if cache: cache.put(_llm_cache_key(messages, sent_model, decision_key), raw)
+        return clean_deepseek_content(raw), "finished"
+
+async def ChatGPT_API_with_finish_reason_async(model, prompt, api_key=None, chat_history=None, decision_key=None):
+    if get_async_client() is None:
+        # aiohttp not installed: fall back to the blocking client on the default executor.
+        # run_in_executor does not carry contextvars over, so copy them for stage attribution.
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(None, ctx.run, ChatGPT_API_with_finish_reason, model, prompt, api_key, chat_history, decision_key)
+
+    messages = _build_messages(prompt, chat_history)
+    tracker = get_metrics_registry().start_call()
+    prompt_tokens = _estimate_prompt_tokens(messages)
+    cache, cached = _lookup_cached_response(messages, decision_key)
+    if cached is not None:
+        tracker.finish(prompt_tokens, count_tokens(cached), cache_hit=True)
+        return clean_deepseek_content(cached), "finished"
+
+    scheduler = get_llm_scheduler()
+    policy = get_retry_policy()
+    deadline_at = policy.start()
+    est_tokens = prompt_tokens + _completion_token_estimate
+    priority = stage_priority(tracker.stage)
+    budget = get_document_budget()
+    attempt = 0
+    while True:
+        if budget and budget.exhausted():
+            budget.refuse()
+            tracker.finish(prompt_tokens, 0, error='BudgetExhausted')
+            return "Error", "budget_exhausted"
+        try:
+            async with scheduler.slot_async(est_tokens, priority):
+                raw, sent_model = await _request_stream_async(model, messages, timeout=policy.timeout_for(LLM_REQUEST_TIMEOUT, deadline_at),
+                                                  tracker=tracker, decision_key=decision_key)
+        except LLMError as e:
+            scheduler.settle(est_tokens, prompt_tokens)
+            if budget: budget.charge(1, 0)
+            delay = _retry_delay_or_none(policy, attempt, e, deadline_at)
+            if delay is None:
+                tracker.finish(prompt_tokens, 0, error=type(e).__name__)
+                return "Error", "failed"
+            await asyncio.sleep(delay)
+            tracker.retry()
+            attempt += 1
+            continue
+        completion_tokens = count_tokens(raw)
+        scheduler.settle(est_tokens, prompt_tokens + completion_tokens)
+        if budget: budget.charge(1, prompt_tokens + completion_tokens)
+        tracker.finish(prompt_tokens, completion_tokens)
+        if cache: cache.put(_llm_cache_key(messages, sent_model, decision_key), raw)
+        return clean_deepseek_content(raw), "finished"
 
 def ChatGPT_API(model, prompt, api_key=None, chat_history=None):
     res, _ = ChatGPT_API_with_finish_reason(model, prompt, api_key, chat_history)
     return res
 
-async def ChatGPT_API_async(model, prompt, api_key=None):
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, ChatGPT_API, model, prompt)
+async def ChatGPT_API_async(model, prompt, api_key=None, chat_history=None):
+    res, _ = await ChatGPT_API_with_finish_reason_async(model, prompt, api_key, chat_history)
+    return res
+
+# --- Yes/no decisions ---
+_answer_first = None
+
+def decision_reply_format(key, answer_spec, thinking_spec):
+    """
+    Reply-format block for yes/no prompts. The decision comes before the reasoning
+    (unless `llm_answer_first` is off), so the stream can be cut right after it.
+    """
+    global _answer_first
+    if _answer_first is None:
+        _answer_first = getattr(ConfigLoader().load(), 'llm_answer_first', 'yes') == 'yes'
+    fields = [f'"{key}": {answer_spec}', f'"thinking": {thinking_spec}']
+    if not _answer_first:
+        fields.reverse()
+    return "{\n        " + ",\n        ".join(fields) + "\n    }"
+
+def _decision_value(response, key, default):
+    if not response or response == "Error":
+        return default
+    value = read_decision(response, key)
+    if value is None:
+        value = extract_json(response).get(key, default)
+    return value
+
+def ChatGPT_API_decision(model, prompt, key, default="no"):
+    """Returns the `key` field of a JSON yes/no reply, closing the stream as soon as it is known."""
+    response, _ = ChatGPT_API_with_finish_reason(model, prompt, decision_key=key)
+    return _decision_value(response, key, default)
+
+async def ChatGPT_API_decision_async(model, prompt, key, default="no"):
+    response, _ = await ChatGPT_API_with_finish_reason_async(model, prompt, decision_key=key)
+    return _decision_value(response, key, default)
 
 def get_json_content(content):
     """Helper to extract pure JSON string from markdown code blocks"""
@@ -204,8 +746,28 @@ def extract_json(content):
 
 # --- Helper Functions ---
 
+_token_counter = None
+
+def get_token_counter():
+    """Returns the process-wide TokenCounter configured by `token_encoding` in config.yaml."""
+    global _token_counter
+    if _token_counter is None:
+        with _http_client_lock:
+            if _token_counter is None:
+                opt = ConfigLoader().load()
+                _token_counter = TokenCounter(
+                    encoding=getattr(opt, 'token_encoding', 'auto'),
+                    fallback_encoding=getattr(opt, 'token_fallback_encoding', 'cl100k_base'),
+                    max_entries=int(getattr(opt, 'token_count_cache_size', 50000)),
+                )
+    return _token_counter
+
 def count_tokens(text, model=None):
-    return len(text) // 2
+    return get_token_counter().count(text or '', model)
+
+def count_tokens_batch(texts, model=None):
+    """Token counts of many texts at once; unseen texts are encoded in batches."""
+    return get_token_counter().count_batch(texts, model)
 
 def write_node_id(data, node_id=0):
     if isinstance(data, dict):
@@ -245,14 +807,180 @@ class JsonLogger:
     def info(self, m): self.log("INFO", m)
     def error(self, m): self.log("ERROR", m)
 
-def get_page_tokens(pdf_path, model=None):
-    page_list = []
+def _extract_page_range(source, start, end):
+    """Process-pool worker: opens the PDF itself and extracts pages [start, end)."""
+    reader = PyPDF2.PdfReader(BytesIO(source) if isinstance(source, bytes) else source)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+def _pdf_source_for_workers(pdf_path):
+    # Paths are reopened by each worker; in-memory documents are shipped as bytes
+    if isinstance(pdf_path, (str, os.PathLike)):
+        return os.fspath(pdf_path)
+    if isinstance(pdf_path, BytesIO):
+        return pdf_path.getvalue()
+    position = pdf_path.tell()
+    pdf_path.seek(0)
+    data = pdf_path.read()
+    pdf_path.seek(position)
+    return data
+
+# --- Persistent page-text store ---
+# Bump when extraction or the per-page token count changes, so stored pages are not reused
+PAGE_EXTRACTOR_VERSION = f"PyPDF2-{getattr(PyPDF2, '__version__', 'unknown')}/2"
+_page_store = None
+_page_store_checked = False
+_pdf_digests = {}
+
+def get_page_store():
+    """Returns the on-disk page-text store, or None when `page_store` is off in config.yaml."""
+    global _page_store, _page_store_checked
+    if not _page_store_checked:
+        with _http_client_lock:
+            if not _page_store_checked:
+                opt = ConfigLoader().load()
+                if getattr(opt, 'page_store', 'no') == 'yes':
+                    _page_store = PageStore(
+                        getattr(opt, 'page_store_path', './cache/page_store.sqlite'),
+                        max_bytes=int(float(getattr(opt, 'page_store_max_mb', 1024)) * 1024 * 1024),
+                    )
+                _page_store_checked = True
+    return _page_store
+
+def _page_store_key(pdf_path):
+    if isinstance(pdf_path, (str, os.PathLike)):
+        # Hashing a large PDF is not free; remember it while the file is unchanged
+        st = os.stat(pdf_path)
+        memo = (os.path.abspath(pdf_path), st.st_mtime_ns, st.st_size)
+        if memo not in _pdf_digests:
+            _pdf_digests[memo] = pdf_sha256(pdf_path)
+        digest = _pdf_digests[memo]
+    else:
+        digest = pdf_sha256(pdf_path)
+    return f"{digest}:{PAGE_EXTRACTOR_VERSION}"
+
+def _iter_page_texts(pdf_path, reader, workers, min_parallel_pages):
+    """Yields page texts in order, from a process pool for large documents."""
+    num_pages = len(reader.pages)
+    workers = min(workers or os.cpu_count() or 1, num_pages)
+    done = 0
+    if workers > 1 and num_pages >= min_parallel_pages:
+        # A few ranges per worker so one slow range does not hold up the rest
+        step = max(1, math.ceil(num_pages / (workers * 4)))
+        starts = list(range(0, num_pages, step))
+        ends = [min(start + step, num_pages) for start in starts]
+        source = _pdf_source_for_workers(pdf_path)
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for page_range in executor.map(_extract_page_range, [source] * len(starts), starts, ends):
+                    for text in page_range:
+                        yield text
+                        done += 1
+        except Exception as e:
+            logging.warning(f"Parallel PDF extraction failed ({type(e).__name__}: {e}), extracting the rest serially")
+    for i in range(done, num_pages):
+        yield reader.pages[i].extract_text() or ""
+
+def _with_token_counts(texts, model, batch_size=64):
+    """Pairs streamed page texts with their token counts, tokenizing `batch_size` pages at a time."""
+    batch = []
+    for text in texts:
+        batch.append(text)
+        if len(batch) >= batch_size:
+            yield from zip(batch, count_tokens_batch(batch, model))
+            batch = []
+    if batch:
+        yield from zip(batch, count_tokens_batch(batch, model))
+
+def get_page_tokens(pdf_path, model=None, workers=1, min_parallel_pages=64, mmap_dir=None, mmap_min_pages=0):
+    """
+    Extracts the text of every page as [(text, tokens)], in page order, with
+    token counts from `model`'s tokenizer.
+
+    Pages already in the page store are returned without parsing the PDF (and
+    only counted again when stored with another tokenizer's counts). Otherwise, with `workers` > 1 (0 = one per CPU) and at least
+    `min_parallel_pages` pages, the pages are split into ranges extracted by a
+    process pool; smaller documents, or a pool that cannot be started, are
+    extracted serially.
+
+    With `mmap_dir`, documents of at least `mmap_min_pages` pages come back as a
+    MappedPageList over a page file in that directory instead of a list; stored
+    or extracted pages are streamed into it, never held whole in memory.
+    """
+    store = get_page_store()
+    store_key = _page_store_key(pdf_path) if store or mmap_dir else None
+    encoding = get_token_counter().encoding_name(model)
+    mmap_path = None
+    if mmap_dir:
+        # A page file holds token counts too, so it is only valid for one tokenizer
+        mmap_path = os.path.join(mmap_dir, hashlib.sha256(f"{store_key}:{encoding}".encode("utf-8")).hexdigest() + ".pages")
+
+    stored = store.iter_pages(store_key, encoding) if store else None
+    if stored is not None:
+        num_pages, pages = stored
+        if mmap_path and num_pages >= mmap_min_pages:
+            return MappedPageList.build(pages, mmap_path)
+        return list(pages)
+
+    page_list = None
+    if store:
+        texts = store.get_texts(store_key)
+        if texts is not None:
+            # Extracted before, counted with another tokenizer: count again, keep the text
+            page_list = list(_with_token_counts(texts, model))
+            store.put_tokens(store_key, encoding, [tokens for _, tokens in page_list])
+            if mmap_path and len(page_list) >= mmap_min_pages:
+                page_list = MappedPageList.build(page_list, mmap_path)
+            return page_list
+
     reader = PyPDF2.PdfReader(pdf_path)
-    for page in reader.pages:
-        t = page.extract_text() or ""
-        page_list.append((t, len(t)))
+    texts = _iter_page_texts(pdf_path, reader, workers, min_parallel_pages)
+    if mmap_path and len(reader.pages) >= mmap_min_pages:
+        # Stream straight into the page file; the document is never held in memory as a list
+        page_list = MappedPageList.build(_with_token_counts(texts, model), mmap_path)
+    else:
+        page_list = list(_with_token_counts(texts, model))
+    if store:
+        store.put(store_key, page_list, encoding)
     return page_list
 
+def _clean_pages(page_list, boilerplate, model, batch_size=64):
+    """Streams cleaned `(text, tokens)` pairs; only pages that lost lines are tokenized again."""
+    def recount(batch):
+        stale = iter(count_tokens_batch([text for text, tokens in batch if tokens is None], model))
+        return [(text, next(stale) if tokens is None else tokens) for text, tokens in batch]
+
+    batch = []
+    for i, page in enumerate(page_list):
+        text = page[0]
+        clean = boilerplate.clean_page(i, text)
+        batch.append((clean, page[1] if clean is text else None))
+        if len(batch) >= batch_size:
+            yield from recount(batch)
+            batch = []
+    if batch:
+        yield from recount(batch)
+
+def normalize_page_list(page_list, model=None, edge_lines=3, min_fraction=0.3, min_repeats=4, min_line_length=40):
+    """
+    Returns (page_list, BoilerplateFilter): the pages with running headers,
+    footers, page numbers and repeated notices stripped, for the prompts, and
+    the filter that maps them back to the extracted text.
+
+    A MappedPageList is cleaned into a page file next to its own; the input
+    list is returned as is when nothing repeats.
+    """
+    boilerplate = BoilerplateFilter(
+        (page[0] for page in page_list),
+        edge_lines=edge_lines, min_fraction=min_fraction,
+        min_repeats=min_repeats, min_line_length=min_line_length,
+    )
+    if not boilerplate.repeated:
+        return page_list, boilerplate
+    pages = _clean_pages(page_list, boilerplate, model)
+    if isinstance(page_list, MappedPageList):
+        return MappedPageList.build(pages, os.path.splitext(page_list.path)[0] + ".clean.pages"), boilerplate
+    return list(pages), boilerplate
+
 def list_to_tree(data):
     nodes, roots = {}, []
     for item in data:
@@ -354,7 +1082,19 @@ def convert_physical_index_to_int(data):
                     data[i]['physical_index'] = None
     return data
 
-def get_text_of_pages(pdf_path, start, end, tag=True):
+def get_text_of_pages(pdf_path, start, end, tag=True, model=None):
+    if get_page_store():
+        # Served from the page store; a first call extracts and stores the whole document
+        store_key = _page_store_key(pdf_path)
+        start = max(1, start)
+        texts = get_page_store().get_range(store_key, start - 1, end)
+        if texts is None:
+            get_page_tokens(pdf_path, model=model)
+            texts = get_page_store().get_range(store_key, start - 1, end) or []
+        if not tag:
+            return "".join(texts)
+        return "".join(f"<start_index_{i}>\n{t}\n<end_index_{i}>\n" for i, t in enumerate(texts, start))
+
     reader = PyPDF2.PdfReader(pdf_path)
     text = ""
     # Add bounds checking
@@ -413,6 +1153,9 @@ def convert_page_to_int(toc_list):
     for item in toc_list:
         if isinstance(item, dict) and 'page' in item:
             original_page = str(item['page'])
+            if item['page'] is not None and not original_page.strip().isdigit() and original_page.strip():
+                # Printed labels like "xii" or "A-3" are kept for the page label map
+                item['page_label'] = original_page.strip()
             nums = re.findall(r'\d+', original_page)
             if nums:
                 item['page'] = int(nums[0])
@@ -458,12 +1201,14 @@ def add_node_text(structure, page_list):
         if 'nodes' in structure:
             add_node_text(structure['nodes'], page_list)
 
-async def generate_summaries_for_structure(structure, model=None):
+async def generate_summaries_for_structure(structure, model=None, nodes=None):
     """
-    Generates summaries for every node in the tree structure using the LLM.
+    Generates summaries for every node in the tree structure using the LLM,
+    or only for `nodes` when given (summaries are then set on those nodes).
     """
     # Get all nodes flattened
-    nodes = get_nodes(structure)
+    if nodes is None:
+        nodes = get_nodes(structure)
     tasks = []
     
     # Define the async worker for a single node
@@ -473,11 +1218,18 @@ async def generate_summaries_for_structure(structure, model=None):
             node['summary'] = ""
             return
 
+        # Summaries are the first thing to go when the document budget runs low
+        if budget_low():
+            get_document_budget().note('skipped summaries')
+            node['summary'] = ""
+            return
+
         # Limit text to avoid token overflow, simple prompt
         prompt = f"Summarize the following section text in one concise sentence:\n\n{text_content[:4000]}"
         
         # Call the async API wrapper
-        summary = await ChatGPT_API_async(model, prompt)
+        with llm_stage('summaries'):
+            summary = await ChatGPT_API_async(model, prompt)
         node['summary'] = summary.strip()
 
     # Create tasks for all nodes
@@ -20,6 +20,8 @@ except ImportError:
         def move(self, x, y): pass
 
 CONFIG_FILE = "gui_configs.json"
+# Batched stream lines written by pageindex/stream_sink.py: DEBUG_AI_STREAM:{"id": ..., "text": ...}
+STREAM_PREFIX = "DEBUG_AI_STREAM:"
 
 
 VECTOR_GEN_SCRIPT = r'''
@@ -329,13 +331,15 @@ DEFAULT_MODEL = "DeepSeek-V3"
 class WorkerThread(QThread):
     log_signal = pyqtSignal(str)      
     stream_signal = pyqtSignal(str)   
+    stream_batch_signal = pyqtSignal(str, str)  # (call id, text) for views that separate calls
 
     def __init__(self, command):
         super().__init__()
         self.command = command
-        self.line_buffer = ""
 
     def run(self):
+        # PageIndex batches its streamed output onto stdout only when asked to
+        env = dict(os.environ, PAGEINDEX_STREAM_SINK="gui")
         process = subprocess.Popen(
             self.command,
             stdout=subprocess.PIPE,
@@ -344,39 +348,30 @@ class WorkerThread(QThread):
             text=True,
             encoding='utf-8',
             errors='replace',
-            bufsize=0
+            bufsize=1,
+            env=env
         )
 
-        while True:
-            char = process.stdout.read(1)
-            if not char and process.poll() is not None:
-                break
-            if char:
-                self.process_char(char)
-        
-        self.flush_buffer()
+        for line in process.stdout:
+            self.process_line(line)
         process.wait()
 
-    def flush_buffer(self):
-        if self.line_buffer:
-            line = self.line_buffer.strip()
-            if line:
-                self.emit_log_line(line)
-            self.line_buffer = ""
-
-    def process_char(self, char):
-        self.line_buffer += char
-        if char == "\n":
-            line = self.line_buffer.strip()
-            if line: 
-                if line.startswith("DEBUG_AI_CHAR:"):
-                    try:
-                        content = line.split("DEBUG_AI_CHAR:", 1)[1]
-                        self.stream_signal.emit(content)
-                    except: pass
-                else:
-                    self.emit_log_line(line)
-            self.line_buffer = ""
+    def process_line(self, line):
+        line = line.strip()
+        if not line:
+            return
+        if line.startswith(STREAM_PREFIX):
+            try:
+                batch = json.loads(line[len(STREAM_PREFIX):])
+                self.stream_signal.emit(batch["text"])
+                self.stream_batch_signal.emit(str(batch["id"]), batch["text"])
+            except (ValueError, KeyError, TypeError):
+                pass
+        elif line.startswith("DEBUG_AI_CHAR:"):
+            # Per-delta protocol still used by run_vector_gen.py
+            self.stream_signal.emit(line.split("DEBUG_AI_CHAR:", 1)[1])
+        else:
+            self.emit_log_line(line)
 
     def emit_log_line(self, line):
         if "[SUCCESS]" in line:
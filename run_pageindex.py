@@ -23,7 +23,8 @@ def main():
 
     # Create the configuration object using 'config' (SimpleNamespace) imported from utils
     # This fixes the "NameError: name 'config' is not defined"
-    opt = config(
+    # Options not given here (batching, LLM limits, ...) come from pageindex/config.yaml
+    opt = ConfigLoader().load(config(
         pdf_path=args.pdf_path,
         model=args.model,
         toc_check_page_num=args.toc_check_pages,
@@ -34,7 +35,7 @@ def main():
         if_add_node_text='yes',
         if_add_node_summary='yes',
         if_add_doc_description='no'
-    )
+    ))
 
     print(f"[INFO] Starting indexing for: {args.pdf_path}")
     
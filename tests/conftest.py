@@ -0,0 +1,44 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# Tests import the package from the checkout, without installing it
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeLLM:
+    """Answers LLM requests with `answer(prompt)` and keeps the prompts it was sent."""
+    model = "fake-model"
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.prompts = []
+
+    def reply(self, messages):
+        prompt = messages[-1]["content"]
+        self.prompts.append(prompt)
+        return self.answer(prompt), self.model
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """
+    Routes LLM calls to a FakeLLM (no network, no response cache, no hedging);
+    set `.answer` to script the replies.
+    """
+    utils = importlib.import_module("pageindex.utils")
+    llm = FakeLLM(lambda prompt: "")
+
+    def request_sync(model, messages, *args, **kwargs):
+        return llm.reply(messages)
+
+    async def request_async(model, messages, *args, **kwargs):
+        return llm.reply(messages)
+
+    monkeypatch.setattr(utils, "_request_stream_sync", request_sync)
+    monkeypatch.setattr(utils, "_request_stream_async", request_async)
+    monkeypatch.setattr(utils, "get_llm_cache", lambda: None)
+    monkeypatch.setattr(utils, "get_hedge_policy", lambda: None)
+    return llm
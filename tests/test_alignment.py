@@ -0,0 +1,65 @@
+import importlib
+
+from pageindex.alignment import PageAligner
+from pageindex.telemetry import current_stage
+
+page_index = importlib.import_module("pageindex.page_index")
+
+PAGES = [
+    "Contents\n1 Introduction\n2 Related work\n3 Method",
+    "1 Introduction\nWe study how documents are structured.",
+    "The introduction continues with more background.",
+    "2 Related work\nPrior systems index documents by chunks.",
+    "3 Method\nOur method builds a tree of sections.",
+]
+
+
+def test_heading_page_outscores_mention():
+    scores = PageAligner(PAGES[1:], ["Introduction"], first_page=2).scores("Introduction")
+    assert scores[2] > scores[3]
+    assert scores[2] - scores[3] >= 0.3
+
+
+def test_align_is_monotone_and_skips_toc_pages():
+    aligner = PageAligner(PAGES, ["1 Introduction", "2 Related work", "3 Method"], skip_pages=[1])
+    placements = aligner.align()
+    assert [page for page, _ in placements] == [2, 4, 5]
+    assert all(confidence > 0.5 for _, confidence in placements)
+
+
+def test_align_honours_first_page():
+    aligner = PageAligner(PAGES[1:], ["Related work", "Method"], first_page=10)
+    assert [page for page, _ in aligner.align()] == [12, 13]
+
+
+def test_unknown_title_is_left_unplaced():
+    placements = PageAligner(PAGES, ["Introduction", "Quantum chromodynamics"], skip_pages=[1]).align()
+    assert placements[0][0] == 2
+    assert placements[1] == (None, 0.0)
+
+
+def test_listing_page_does_not_win_ties():
+    # Every title heads a line of page 1 too; sharing it costs more than moving on
+    placements = PageAligner(PAGES, ["Introduction", "Related work", "Method"]).align()
+    assert [page for page, _ in placements][1:] == [4, 5]
+
+
+def test_only_the_titles_trigrams_are_indexed():
+    aligner = PageAligner(PAGES, ["Method"])
+    assert set(aligner._index) == {"met", "eth", "tho", "hod"}
+    assert set(aligner._headings) == {"method"}
+    assert list(aligner._index["hod"]) == [1, 5]
+
+
+def test_process_toc_no_page_numbers_is_tagged(monkeypatch):
+    stages = []
+
+    def fake_transformer(toc_content, model=None):
+        stages.append(current_stage())
+        return []
+
+    monkeypatch.setattr(page_index, "toc_transformer", fake_transformer)
+    monkeypatch.setattr(page_index, "count_tokens_batch", lambda pages, model=None: [1] * len(pages))
+    page_index.process_toc_no_page_numbers("", [0], [(text, 10) for text in PAGES], min_confidence=0.75)
+    assert stages == ["process_toc_no_page_numbers"]
+    assert page_index.alignment_threshold(type("Opt", (), {"toc_alignment": "yes"})()) == 0.75
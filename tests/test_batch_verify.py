@@ -0,0 +1,41 @@
+import asyncio
+import importlib
+import json
+
+page_index = importlib.import_module("pageindex.page_index")
+
+PAGES = [(f"Section {n}\nText of page {n}.", 10) for n in range(1, 11)]
+
+
+def items(*pages):
+    return [{'list_index': i, 'title': f"Section {page}", 'physical_index': page} for i, page in enumerate(pages)]
+
+
+def test_groups_hold_nearby_pages_only():
+    groups = page_index.group_items_for_batch_check(items(9, 1, 2, 2, 3, 7), batch_size=3, page_window=1)
+    assert [[item['physical_index'] for item in group] for group in groups] == [[1, 2, 2], [3], [7], [9]]
+
+
+def test_one_prompt_answers_a_group_and_omitted_items_are_asked_alone(fake_llm):
+    def answer(prompt):
+        if "for each given section" in prompt:
+            # Only answers the first of the two sections
+            return json.dumps([{"id": 0, "answer": "yes"}])
+        return json.dumps({"answer": "no", "thinking": "not there"})
+
+    fake_llm.answer = answer
+    batch = items(1, 2) + [{'list_index': 2, 'title': "Unplaced"}]
+    results = asyncio.run(page_index.check_title_appearance_batched(batch, PAGES, batch_size=8, page_window=1))
+    assert [result['answer'] for result in results] == ["yes", "no", "no"]
+    assert [result['list_index'] for result in results] == [0, 1, 2]
+    assert results[2]['page_number'] is None
+    # One batched prompt for both pages, then one single check for the omitted item
+    assert len(fake_llm.prompts) == 2
+    assert "<physical_index_1>" in fake_llm.prompts[0] and "<physical_index_2>" in fake_llm.prompts[0]
+
+
+def test_batch_size_one_keeps_one_prompt_per_item(fake_llm):
+    fake_llm.answer = lambda prompt: json.dumps({"answer": "yes", "thinking": ""})
+    results = asyncio.run(page_index.check_title_appearance_batched(items(1, 2, 3), PAGES, batch_size=1))
+    assert [result['answer'] for result in results] == ["yes"] * 3
+    assert len(fake_llm.prompts) == 3
@@ -0,0 +1,89 @@
+import importlib
+import os
+from types import SimpleNamespace
+
+from pageindex.boilerplate import BoilerplateFilter
+from pageindex.mapped_pages import MappedPageList
+
+utils = importlib.import_module("pageindex.utils")
+page_index = importlib.import_module("pageindex.page_index")
+
+
+def numbered_pages(count=8, body=lambda n: f"Body text of page {n}."):
+    return [f"Annual Report 2024\n{body(n)}\n\n\nMore on page {n}.\n{n}" for n in range(1, count + 1)]
+
+
+def test_running_header_and_page_numbers_are_stripped():
+    pages = numbered_pages()
+    boilerplate = BoilerplateFilter(pages)
+    cleaned = [boilerplate.clean_page(i, text) for i, text in enumerate(pages)]
+    # The header stays on its first page, the numbers everywhere but the first
+    assert cleaned[0].startswith("Annual Report 2024\n")
+    assert cleaned[1] == "Body text of page 2.\n\nMore on page 2."
+    assert boilerplate.page_labels == [str(n) for n in range(1, 9)]
+    assert boilerplate.stats()["pages_changed"] == 8
+
+
+def test_lone_numbers_outside_a_page_number_run_are_kept():
+    # A chapter number or year at the edge of the page is not the page's number
+    numerals = ["VII", "2024", "II", "1999", "XL", "2023", "IV", "1848"]
+    pages = [f"Chapter\n{numeral}\nBody text {n}." for n, numeral in enumerate(numerals)]
+    boilerplate = BoilerplateFilter(pages)
+    assert all(label is None for label in boilerplate.page_labels)
+    assert not any(key.startswith("#") for _, key in boilerplate.repeated)
+    cleaned = [boilerplate.clean_page(i, text) for i, text in enumerate(pages)]
+    assert all(numeral in text.split("\n") for numeral, text in zip(numerals, cleaned))
+
+
+def test_original_text_and_lines_come_back():
+    pages = numbered_pages()
+    boilerplate = BoilerplateFilter(pages)
+    for i, text in enumerate(pages):
+        cleaned = boilerplate.clean_page(i, text)
+        assert boilerplate.original_text(i, cleaned) == text
+    assert boilerplate.original_line(1, 0) == 1
+    assert boilerplate.original_line(1, 2) == 4
+
+
+def test_unchanged_page_is_returned_as_is():
+    pages = [f"Unique page {n}\nnothing repeats" for n in range(6)]
+    boilerplate = BoilerplateFilter(pages)
+    assert boilerplate.clean_page(0, pages[0]) is pages[0]
+    assert boilerplate.removed == {}
+
+
+def test_page_index_main_removes_every_page_file(tmp_path, monkeypatch, fake_llm):
+    monkeypatch.chdir(tmp_path)
+    pages = MappedPageList.build([(text, 10) for text in numbered_pages()], str(tmp_path / "doc.pages"))
+    monkeypatch.setattr(page_index, "get_page_tokens", lambda *args, **kwargs: pages)
+
+    async def fake_tree_parser(page_list, opt, doc=None, logger=None, original_pages=None):
+        return [{'title': 'Report', 'start_index': 1, 'end_index': len(page_list)}]
+
+    monkeypatch.setattr(page_index, "tree_parser", fake_tree_parser)
+    pdf = tmp_path / "doc.pdf"
+    pdf.write_bytes(b"%PDF-1.4")
+    opt = SimpleNamespace(model="m", if_add_node_id="no", if_add_node_summary="no", if_add_node_text="no", strip_boilerplate="yes")
+    page_index.page_index_main(str(pdf), opt)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".pages")]
+
+
+def test_toc_entry_does_not_take_the_heading_from_its_chapter():
+    title = "Risk Management and Internal Control Systems"
+    pages = ["Annual Report 2024\nCover", f"Contents\n{title}\n3\nGovernance\n11\nFinancial Statements\n19"]
+    pages += [f"{title}\nBody text of page {n}.\nMore on page {n}." for n in range(3, 11)]
+    boilerplate = BoilerplateFilter(pages)
+    cleaned = [boilerplate.clean_page(i, text) for i, text in enumerate(pages)]
+    assert cleaned[1] == pages[1]
+    # The chapter's first page keeps its heading, the running header goes from the others
+    assert cleaned[2].startswith(title + "\n")
+    assert all(not text.startswith(title) for text in cleaned[3:])
+
+
+def test_running_header_is_kept_on_the_first_page_of_each_run():
+    pages = [f"Chapter One Overview\nBody {n}." for n in range(4)]
+    pages += [f"Chapter Two Details\nBody {n}." for n in range(4, 8)]
+    pages += [f"Chapter One Overview\nBody {n}." for n in range(8, 12)]
+    boilerplate = BoilerplateFilter(pages)
+    cleaned = [boilerplate.clean_page(i, text) for i, text in enumerate(pages)]
+    assert [i for i, text in enumerate(cleaned) if text.startswith("Chapter")] == [0, 4, 8]
@@ -0,0 +1,79 @@
+import asyncio
+import importlib
+import json
+from types import SimpleNamespace
+
+from pageindex.budget import DocumentBudget, document_budget, budget_low, budget_exhausted
+
+utils = importlib.import_module("pageindex.utils")
+page_index = importlib.import_module("pageindex.page_index")
+
+
+def test_unlimited_budget_is_never_low():
+    budget = DocumentBudget()
+    budget.charge(100, 10 ** 6)
+    assert budget.remaining_fraction() == 1.0
+    assert not budget.low() and not budget.exhausted()
+
+
+def test_budget_runs_low_then_out():
+    budget = DocumentBudget(max_calls=10, max_tokens=1000, low_water=0.2)
+    budget.charge(1, 850)
+    assert budget.low() and not budget.exhausted()
+    budget.charge(1, 150)
+    assert budget.exhausted()
+
+
+def test_partial_once_something_was_dropped_or_refused():
+    budget = DocumentBudget(max_calls=1)
+    assert not budget.partial
+    budget.note("skipped summaries")
+    budget.note("skipped summaries")
+    assert budget.partial and budget.report()["degradations"] == ["skipped summaries"]
+    other = DocumentBudget(max_calls=1)
+    other.refuse()
+    assert other.partial and other.report()["refused_calls"] == 1
+
+
+def test_budget_is_scoped_to_the_document():
+    budget = DocumentBudget(max_calls=1)
+    with document_budget(budget):
+        budget.charge(1)
+        assert budget_low() and budget_exhausted()
+    assert not budget_low() and not budget_exhausted()
+
+
+def test_exhausted_budget_refuses_calls_without_a_request(fake_llm):
+    budget = DocumentBudget(max_calls=1)
+    budget.charge(1)
+    with document_budget(budget):
+        assert utils.ChatGPT_API_with_finish_reason("m", "hello") == ("Error", "budget_exhausted")
+    assert fake_llm.prompts == []
+    assert budget.partial
+
+
+def test_toc_generation_keeps_the_structure_built_before_the_budget_ran_out(fake_llm):
+    # Three pages of ~10k tokens each: more than one 20k-token group for generate_toc_*
+    pages = [(f"Chapter {n}\n" + "word " * 8000, 10000) for n in (1, 2, 3)]
+    fake_llm.answer = lambda prompt: json.dumps([
+        {"structure": "1", "title": "Chapter 1", "physical_index": "<physical_index_1>"},
+    ])
+    opt = SimpleNamespace(model="m", local_title_match="yes")
+    budget = DocumentBudget(max_calls=1)
+
+    async def run():
+        with document_budget(budget):
+            return await page_index.meta_processor(pages, mode="process_no_toc", opt=opt)
+
+    structure = asyncio.run(run())
+    assert [item["title"] for item in structure] == ["Chapter 1"]
+    assert len(fake_llm.prompts) == 1
+    assert "stopped TOC generation" in budget.degradations
+
+
+def test_generate_toc_continue_returns_nothing_once_out_of_budget(fake_llm):
+    budget = DocumentBudget(max_calls=1)
+    budget.charge(1)
+    with document_budget(budget):
+        assert page_index.generate_toc_continue([], "<physical_index_2>\ntext\n<physical_index_2>", model="m") == []
+    assert "stopped TOC generation" in budget.degradations
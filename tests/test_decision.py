@@ -0,0 +1,57 @@
+import importlib
+
+from pageindex.decision import DecisionReader, read_decision
+from pageindex.endpoints import Endpoint, EndpointPool
+from pageindex.replay import CassetteRecorder, ReplayServer
+
+utils = importlib.import_module("pageindex.utils")
+
+
+def feed_all(reader, text, size):
+    for i in range(0, len(text), size):
+        if reader.feed(text[i:i + size]):
+            return i + size
+    return None
+
+
+def test_stops_once_the_value_is_complete():
+    reply = '{\n  "toc_detected": "yes",\n  "thinking": "a long explanation that is never read"\n}'
+    reader = DecisionReader("toc_detected")
+    stopped_at = feed_all(reader, reply, 3)
+    assert reader.value == "yes"
+    assert stopped_at < reply.index("thinking")
+
+
+def test_key_split_across_deltas_and_think_block_skipped():
+    reply = '<think>maybe "answer": "no"</think>{"answer": "yes"}'
+    reader = DecisionReader("answer")
+    feed_all(reader, reply, 1)
+    assert reader.value == "yes"
+
+
+def test_truncated_and_missing_values():
+    assert read_decision('{"answer": "ye', "answer") is None
+    assert read_decision('{"thinking": "..."}', "answer") is None
+    assert read_decision('```json\n{"answer": " no "}', "answer") == "no"
+
+
+def test_decision_call_falls_back_to_the_full_json(fake_llm):
+    fake_llm.answer = lambda prompt: '{"thinking": "x", "answer": "yes"}'
+    assert utils.ChatGPT_API_decision("m", "Is it?", "answer") == "yes"
+    fake_llm.answer = lambda prompt: "not json at all"
+    assert utils.ChatGPT_API_decision("m", "Is it?", "answer", default="no") == "no"
+
+
+def test_stream_is_cut_after_the_decision(tmp_path, monkeypatch):
+    messages = [{"role": "user", "content": "Is it?"}]
+    reply = '{"answer": "yes", "thinking": "' + "long reasoning " * 50 + '"}'
+    recorder = CassetteRecorder(str(tmp_path / "cassette.jsonl"))
+    recorder.record({"model": "m", "messages": messages, "temperature": utils.LLM_TEMPERATURE}, reply)
+    server = ReplayServer(recorder.path, chunk_chars=8).start()
+    try:
+        monkeypatch.setattr(utils, "_endpoint_pool", EndpointPool([Endpoint(server.url, api_key="replay")]))
+        content, _ = utils._request_stream_sync("m", messages, decision_key="answer")
+    finally:
+        server.stop()
+    assert content.startswith('{"answer": "yes"')
+    assert len(content) < 40
@@ -0,0 +1,64 @@
+from pageindex import endpoints as endpoints_module
+from pageindex.endpoints import Endpoint, EndpointPool, CLOSED, OPEN, HALF_OPEN
+
+
+def make_pool(**kwargs):
+    return EndpointPool([Endpoint("https://a/v1", name="a"), Endpoint("https://b/v1", name="b")], **kwargs)
+
+
+def test_faster_endpoint_wins_and_load_spreads():
+    pool = make_pool()
+    a, b = pool.endpoints
+    pool.record_success(pool.choose(), 1.0)
+    pool.record_success(pool.choose(exclude=[a]), 3.0)
+    assert pool.peek() is a
+    # Three calls in flight on a make it cost more than b
+    pool.choose(), pool.choose(), pool.choose()
+    assert pool.choose() is b
+    assert pool.choose(exclude=[a, b]) is None
+
+
+def test_peek_has_no_side_effects():
+    pool = make_pool()
+    pool.peek()
+    assert all(endpoint.in_flight == 0 and endpoint.calls == 0 for endpoint in pool.endpoints)
+
+
+def test_breaker_opens_then_lets_one_probe_through(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(endpoints_module.time, "monotonic", lambda: now[0])
+    pool = make_pool(failure_threshold=2, cooldown=30)
+    a, b = pool.endpoints
+    for _ in range(2):
+        pool.record_failure(pool.choose(exclude=[b]))
+    assert a.state == OPEN
+    assert pool.choose() is b
+    pool.record_success(b, 1.0)
+
+    now[0] += 31
+    # Peeking at a cooled-down breaker does not move it to half-open
+    pool.peek()
+    assert a.state == OPEN
+    assert pool.choose(exclude=[b]) is a and a.state == HALF_OPEN
+    # One probe at a time: a is not available while it is out
+    assert not pool._available(a, now[0])
+    pool.record_success(a, 0.5)
+    assert a.state == CLOSED and a.consecutive_failures == 0
+
+
+def test_errors_that_are_not_the_endpoints_fault_do_not_count():
+    pool = make_pool(failure_threshold=1)
+    a = pool.choose()
+    pool.record_failure(a, counts_against=False)
+    assert a.state == CLOSED and a.failures == 0 and a.in_flight == 0
+
+
+def test_pool_from_config(monkeypatch):
+    monkeypatch.setenv("SECOND_KEY", "k2")
+    pool = EndpointPool.from_config(
+        ["https://a/v1", {"url": "https://b/v1", "api_key_env": "SECOND_KEY", "model": "m2", "weight": 2}, {"name": "no url"}],
+        "https://default/v1", "k1",
+    )
+    assert [(e.url, e.api_key, e.model, e.weight) for e in pool.endpoints] == [
+        ("https://a/v1", "k1", None, 1.0), ("https://b/v1", "k2", "m2", 2.0)]
+    assert EndpointPool.from_config([], "https://default/v1", "k1").endpoints[0].url == "https://default/v1"
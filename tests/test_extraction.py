@@ -0,0 +1,43 @@
+import importlib
+import os
+from io import BytesIO
+
+import PyPDF2
+
+utils = importlib.import_module("pageindex.utils")
+
+PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pdfs", "earthmover.pdf")
+
+
+def serial_texts():
+    reader = PyPDF2.PdfReader(PDF)
+    return [page.extract_text() or "" for page in reader.pages]
+
+
+def test_process_pool_keeps_page_order():
+    reader = PyPDF2.PdfReader(PDF)
+    assert list(utils._iter_page_texts(PDF, reader, workers=3, min_parallel_pages=1)) == serial_texts()
+
+
+def test_in_memory_documents_are_shipped_as_bytes():
+    with open(PDF, "rb") as f:
+        data = BytesIO(f.read())
+    reader = PyPDF2.PdfReader(data)
+    assert list(utils._iter_page_texts(data, reader, workers=2, min_parallel_pages=1)) == serial_texts()
+
+
+def test_failed_pool_finishes_serially(monkeypatch):
+    class BrokenPool:
+        def __init__(self, *args, **kwargs):
+            raise OSError("no processes here")
+
+    monkeypatch.setattr(utils, "ProcessPoolExecutor", BrokenPool)
+    reader = PyPDF2.PdfReader(PDF)
+    assert list(utils._iter_page_texts(PDF, reader, workers=4, min_parallel_pages=1)) == serial_texts()
+
+
+def test_get_page_tokens_pairs_texts_with_counts(monkeypatch):
+    monkeypatch.setattr(utils, "get_page_store", lambda: None)
+    pages = utils.get_page_tokens(PDF, model="m", workers=2, min_parallel_pages=1)
+    assert [text for text, _ in pages] == serial_texts()
+    assert [tokens for _, tokens in pages] == utils.count_tokens_batch(serial_texts(), "m")
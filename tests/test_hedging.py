@@ -0,0 +1,71 @@
+import threading
+import time
+
+import pytest
+
+from pageindex.hedging import CancelToken, HedgePolicy, hedged_call
+from pageindex.telemetry import MetricsRegistry
+
+
+def attempt(result, first_token_after=0.0, error=None):
+    def run(cancel, first_token):
+        time.sleep(first_token_after)
+        if cancel.cancelled:
+            raise RuntimeError("cancelled")
+        first_token.set()
+        if error is not None:
+            raise error
+        return result
+    return run
+
+
+def test_fast_primary_is_never_hedged():
+    hedges = []
+    assert hedged_call(attempt("primary"), attempt("hedge"), delay=1.0, on_hedge=lambda: hedges.append(1)) == "primary"
+    assert hedges == []
+
+
+def test_late_first_token_sends_a_hedge_that_can_win():
+    released = threading.Event()
+    result = hedged_call(attempt("primary", first_token_after=1.0), attempt("hedge"), delay=0.05,
+                         release_hedge=released.set)
+    assert result == "hedge"
+    assert released.wait(1)
+
+
+def test_hedge_is_skipped_without_a_free_slot():
+    result = hedged_call(attempt("primary", first_token_after=0.1), attempt("hedge"), delay=0.01,
+                         acquire_hedge=lambda: False)
+    assert result == "primary"
+
+
+def test_primary_error_wins_when_both_fail():
+    with pytest.raises(ValueError):
+        hedged_call(attempt(None, first_token_after=0.1, error=ValueError("primary")),
+                    attempt(None, error=KeyError("hedge")), delay=0.01)
+
+
+def test_cancel_closes_a_bound_response():
+    class Response:
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    token = CancelToken()
+    token.cancel()
+    response = Response()
+    token.bind(response)
+    assert token.cancelled and response.closed
+
+
+def test_delay_follows_the_stage_ttft_percentile():
+    policy = HedgePolicy(["check_title_appearance"], percentile=0.9, min_delay=0.5, initial_delay=15.0, min_samples=5)
+    registry = MetricsRegistry()
+    assert policy.applies("verify_toc/check_title_appearance") and not policy.applies("summaries")
+    assert policy.delay_for("verify_toc/check_title_appearance", registry) == 15.0
+    for ttft in (0.1, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0, 9.0):
+        tracker = registry.start_call("verify_toc/check_title_appearance")
+        tracker.first_token_at = tracker.attempt_started + ttft
+        tracker.finish()
+    assert policy.delay_for("verify_toc/check_title_appearance", registry) == pytest.approx(9.0)
@@ -0,0 +1,56 @@
+import importlib
+from types import SimpleNamespace
+
+import pytest
+
+from pageindex.http_client import DNSCache, PooledHTTPClient
+
+page_index = importlib.import_module("pageindex.page_index")
+
+
+def test_one_session_per_origin():
+    client = PooledHTTPClient(dns_cache_ttl=0)
+    try:
+        first = client.session_for("https://api.example.com/v1/chat/completions")
+        assert client.session_for("https://api.example.com/v1/models") is first
+        assert client.session_for("https://other.example.com/v1/chat/completions") is not first
+        assert first.headers["Connection"] == "keep-alive"
+        assert not first.trust_env
+    finally:
+        client.close()
+
+
+def test_dns_cache_only_caches_watched_hosts():
+    lookups = []
+    cache = DNSCache(ttl=60)
+    cache._original = lambda host, port, *args, **kwargs: lookups.append(host) or [(host, port)]
+    cache.watch("API.example.com")
+    assert cache._getaddrinfo("api.example.com", 443) == [("api.example.com", 443)]
+    cache._getaddrinfo("api.example.com", 443)
+    cache._getaddrinfo("other.example.com", 443)
+    cache._getaddrinfo("other.example.com", 443)
+    assert lookups == ["api.example.com", "other.example.com", "other.example.com"]
+    cache.clear()
+    cache._getaddrinfo("api.example.com", 443)
+    assert lookups.count("api.example.com") == 2
+
+
+def test_async_client_is_closed_when_the_run_fails(tmp_path, monkeypatch, fake_llm):
+    monkeypatch.chdir(tmp_path)
+    closed = []
+
+    async def fake_close():
+        closed.append(True)
+
+    async def failing_tree_parser(page_list, opt, doc=None, logger=None, original_pages=None):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(page_index, "close_async_client", fake_close)
+    monkeypatch.setattr(page_index, "get_page_tokens", lambda *args, **kwargs: [("Page one", 2), ("Page two", 2)])
+    monkeypatch.setattr(page_index, "tree_parser", failing_tree_parser)
+    pdf = tmp_path / "doc.pdf"
+    pdf.write_bytes(b"%PDF-1.4")
+    opt = SimpleNamespace(model="m", if_add_node_id="no", if_add_node_summary="no", if_add_node_text="no", strip_boilerplate="no")
+    with pytest.raises(RuntimeError):
+        page_index.page_index_main(str(pdf), opt)
+    assert closed == [True]
@@ -0,0 +1,140 @@
+import importlib
+import json
+from types import SimpleNamespace
+
+from pageindex.incremental import (
+    PageDiff, page_hash, flatten_nodes, drop_node, assign_new_node_ids,
+    page_hashes_path, save_page_hashes, load_previous_run,
+)
+from pageindex.page_index import incremental_options
+from pageindex.utils import ConfigLoader
+
+page_index = importlib.import_module("pageindex.page_index")
+
+
+def test_diff_follows_shifted_pages():
+    old = [page_hash(text) for text in ["a", "b", "c", "d"]]
+    new = [page_hash(text) for text in ["a", "x", "b", "c", "d"]]
+    diff = PageDiff(old, new)
+    assert diff.mapping == {1: 1, 2: 3, 3: 4, 4: 5}
+    assert diff.changed == {2}
+    assert diff.unchanged_ratio == 0.8
+    assert diff.touches_changed(1, 2) and not diff.touches_changed(3, 5)
+
+
+def test_drop_node_promotes_children_and_new_ids_continue():
+    child = {'title': 'child', 'node_id': '0001'}
+    parent = {'title': 'parent', 'node_id': '0000', 'nodes': [child]}
+    structure = [parent, {'title': 'new'}]
+    assert [node['title'] for node, _ in flatten_nodes(structure)] == ['parent', 'child', 'new']
+    drop_node(parent, structure)
+    assert structure[0] is child
+    assign_new_node_ids(structure)
+    assert [node['node_id'] for node in structure] == ['0001', '0002']
+
+
+def _save(tmp_path, structure, options):
+    results_path = str(tmp_path / "doc_full.json")
+    with open(results_path, "w", encoding="utf-8") as f:
+        json.dump(structure, f)
+    save_page_hashes(results_path, ["h1", "h2"], "extractor", options)
+    return results_path
+
+
+def test_previous_run_is_reused_with_the_same_options(tmp_path):
+    options = incremental_options(SimpleNamespace(model="m", if_add_node_summary="yes"))
+    results_path = _save(tmp_path, [{'title': 'a'}], options)
+    assert page_hashes_path(results_path) == str(tmp_path / "doc_pages.json")
+    assert load_previous_run(results_path, "extractor", dict(options)) == ([{'title': 'a'}], ["h1", "h2"])
+    assert load_previous_run(results_path, "other extractor", options) is None
+
+
+def test_previous_run_with_other_options_is_rebuilt(tmp_path):
+    results_path = _save(tmp_path, [{'title': 'a'}], incremental_options(SimpleNamespace(model="m", if_add_node_summary="no")))
+    changed = incremental_options(SimpleNamespace(model="m", if_add_node_summary="yes"))
+    assert load_previous_run(results_path, "extractor", changed) is None
+
+
+def test_partial_previous_run_is_rebuilt(tmp_path):
+    options = incremental_options(SimpleNamespace(model="m"))
+    results_path = _save(tmp_path, [{'title': 'a', 'partial': True}], options)
+    assert load_previous_run(results_path, "extractor", options) is None
+
+
+def test_revised_document_only_redoes_changed_sections(tmp_path, monkeypatch, fake_llm):
+    monkeypatch.chdir(tmp_path)
+    pdf = tmp_path / "doc.pdf"
+    pdf.write_bytes(b"%PDF-1.4")
+    titles = ["Alpha section", "Beta section", "Gamma section"]
+    revision = [[f"{titles[n // 2]}\nbody {n}" if n % 2 == 0 else f"more text {n}" for n in range(6)]]
+    monkeypatch.setattr(page_index, "get_page_tokens", lambda *args, **kwargs: [(text, 10) for text in revision[0]])
+
+    def answer(prompt):
+        if "generate the tree structure of the document" in prompt:
+            return json.dumps([{"structure": str(n + 1), "title": title, "physical_index": f"<physical_index_{2 * n + 1}>"}
+                               for n, title in enumerate(titles)])
+        if prompt.startswith("Summarize"):
+            return "summary of " + prompt.split("\n\n", 1)[1].split("\n")[0]
+        return json.dumps({"answer": "yes", "toc_detected": "no", "thinking": ""})
+
+    fake_llm.answer = answer
+    opt = ConfigLoader().load({"model": "m"})
+    opt.incremental = "yes"
+
+    def summarized():
+        return [prompt.split("\n\n", 1)[1].split("\n")[0] for prompt in fake_llm.prompts if prompt.startswith("Summarize")]
+
+    first = page_index.page_index_main(str(pdf), opt)
+    assert [node['title'] for node in first] == titles
+    assert sorted(summarized()) == titles
+
+    # Page 4 (inside Beta) changes: only Beta is summarized again
+    fake_llm.prompts.clear()
+    revision[0][3] = "rewritten text"
+    second = page_index.page_index_main(str(pdf), opt)
+    assert [node['node_id'] for node in second] == [node['node_id'] for node in first]
+    assert summarized() == ["Beta section"]
+    # Only the changed page is read for new headings
+    generated = [prompt for prompt in fake_llm.prompts if "generate the tree structure" in prompt]
+    assert len(generated) == 1 and "<physical_index_4>" in generated[0] and "<physical_index_3>" not in generated[0]
+
+    # Another model: the previous run does not count, everything is built again
+    fake_llm.prompts.clear()
+    opt.model = "other"
+    page_index.page_index_main(str(pdf), opt)
+    assert any("generate the tree structure" in prompt for prompt in fake_llm.prompts)
+    assert sorted(summarized()) == titles
+
+
+def test_inserted_section_means_indexing_from_scratch(tmp_path, monkeypatch, fake_llm):
+    monkeypatch.chdir(tmp_path)
+    pdf = tmp_path / "doc.pdf"
+    pdf.write_bytes(b"%PDF-1.4")
+    revision = [["Alpha section\nbody", "more text", "Beta section\nbody", "more text", "Gamma section\nbody", "more text"]]
+    monkeypatch.setattr(page_index, "get_page_tokens", lambda *args, **kwargs: [(text, 10) for text in revision[0]])
+
+    def answer(prompt):
+        if "generate the tree structure of the document" in prompt:
+            # The headings of the pages the prompt shows
+            headings = [(n + 1, text.split("\n")[0]) for n, text in enumerate(revision[0]) if text.endswith("body")]
+            return json.dumps([{"structure": str(i + 1), "title": title, "physical_index": f"<physical_index_{page}>"}
+                               for i, (page, title) in enumerate(headings) if f"<physical_index_{page}>" in prompt])
+        return json.dumps({"answer": "yes", "toc_detected": "no", "thinking": ""})
+
+    fake_llm.answer = answer
+    opt = ConfigLoader().load({"model": "m"})
+    opt.incremental = "yes"
+    opt.if_add_node_summary = "no"
+    first = page_index.page_index_main(str(pdf), opt)
+    assert [node['title'] for node in first] == ["Alpha section", "Beta section", "Gamma section"]
+
+    # A section inserted after Beta cannot be fitted into the previous structure
+    revision[0].insert(4, "Delta section\nbody")
+    second = page_index.page_index_main(str(pdf), opt)
+    assert [node['title'] for node in second] == ["Alpha section", "Beta section", "Delta section", "Gamma section"]
+
+    # Without the check, the incremental run keeps the previous sections only
+    opt.incremental_new_sections = "no"
+    revision[0].insert(2, "Omega section\nbody")
+    third = page_index.page_index_main(str(pdf), opt)
+    assert "Omega section" not in [node['title'] for node in third]
@@ -0,0 +1,80 @@
+import importlib
+
+from pageindex.endpoints import Endpoint, EndpointPool
+from pageindex.llm_cache import LLMResponseCache, make_cache_key
+
+utils = importlib.import_module("pageindex.utils")
+
+MESSAGES = [{"role": "user", "content": "Is this a table of contents?"}]
+
+
+def test_cache_key_depends_on_model_messages_and_temperature():
+    key = make_cache_key("model-a", MESSAGES, 0)
+    assert key == make_cache_key("model-a", [dict(MESSAGES[0])], 0)
+    assert key != make_cache_key("model-b", MESSAGES, 0)
+    assert key != make_cache_key("model-a", MESSAGES, 0.5)
+    assert key != make_cache_key("model-a", [{"role": "user", "content": "other"}], 0)
+
+
+def test_get_put_and_stats(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite"))
+    assert cache.get("k") is None
+    cache.put("k", "answer")
+    assert cache.get("k") == "answer"
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["stores"]) == (1, 1, 1)
+    cache.close()
+
+
+def test_entries_expire_after_ttl(tmp_path, monkeypatch):
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite"), ttl=10)
+    cache.put("k", "answer")
+    now = utils.time.time()
+    monkeypatch.setattr("pageindex.llm_cache.time.time", lambda: now + 11)
+    assert cache.get("k") is None
+    assert cache.stats()["expired"] == 1
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr("pageindex.llm_cache.time.time", lambda: next(clock))
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite"), max_bytes=20, ttl=0)
+    cache.put("old", "x" * 8)
+    cache.put("used", "y" * 8)
+    cache.get("old")
+    cache.put("new", "z" * 8)
+    assert cache.get("used") is None
+    assert cache.get("old") == "x" * 8
+    assert cache.stats()["evictions"] == 1
+    cache.close()
+
+
+def test_cached_replies_are_kept_per_endpoint_model(tmp_path, monkeypatch):
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite"))
+    endpoint_a = Endpoint("http://a.invalid", model="model-a", name="a")
+    endpoint_b = Endpoint("http://b.invalid", model="model-b", name="b")
+    pool = EndpointPool([endpoint_a, endpoint_b])
+    sent = []
+
+    def request(model, messages, timeout=180, tracker=None, decision_key=None, **kwargs):
+        endpoint = pool.choose()
+        pool.record_success(endpoint, 0.1)
+        sent.append(endpoint.model)
+        return f"reply from {endpoint.model}", endpoint.model
+
+    monkeypatch.setattr(utils, "get_llm_cache", lambda: cache)
+    monkeypatch.setattr(utils, "get_endpoint_pool", lambda: pool)
+    monkeypatch.setattr(utils, "get_hedge_policy", lambda: None)
+    monkeypatch.setattr(utils, "_request_stream_sync", request)
+
+    endpoint_b.latency_ewma = 5.0
+    assert utils.ChatGPT_API("ignored", MESSAGES[0]["content"]) == "reply from model-a"
+    assert utils.ChatGPT_API("ignored", MESSAGES[0]["content"]) == "reply from model-a"
+    assert sent == ["model-a"]
+
+    # Routed to model-b now: model-a's reply must not be served for it
+    endpoint_a.latency_ewma = 10.0
+    assert utils.ChatGPT_API("ignored", MESSAGES[0]["content"]) == "reply from model-b"
+    assert sent == ["model-a", "model-b"]
+    cache.close()
@@ -0,0 +1,69 @@
+import importlib
+import os
+
+import pytest
+
+from pageindex.mapped_pages import MappedPageList, TaggedPages
+
+utils = importlib.import_module("pageindex.utils")
+
+PAGES = [("Première page", 3), ("", 0), ("第三页\nline two", 5), ("last", 1)]
+
+
+@pytest.fixture
+def mapped(tmp_path):
+    pages = MappedPageList.build(iter(PAGES), str(tmp_path / "doc.pages"))
+    yield pages
+    pages.close()
+
+
+def test_behaves_like_the_page_list(mapped):
+    assert len(mapped) == 4
+    assert [tuple(page) for page in mapped] == PAGES
+    assert mapped[-1][0] == "last" and mapped[2][1] == 5
+    text, tokens = mapped[0]
+    assert (text, tokens) == PAGES[0]
+    assert sum(page[1] for page in mapped) == 9
+    assert bytes(mapped.page_bytes(2)) == "第三页\nline two".encode("utf-8")
+    with pytest.raises(IndexError):
+        mapped[4]
+
+
+def test_slices_are_views(mapped):
+    tail = mapped[1:]
+    assert isinstance(tail, MappedPageList) and len(tail) == 3
+    assert [page[0] for page in tail[1:]] == ["第三页\nline two", "last"]
+    assert [page[0] for page in mapped[::2]] == ["Première page", "第三页\nline two"]
+    assert len(mapped[3:1]) == 0
+
+
+def test_reopened_file_and_bad_file(mapped, tmp_path):
+    again = MappedPageList(mapped.path)
+    assert [tuple(page) for page in again] == PAGES
+    again.close()
+    bad = tmp_path / "bad.pages"
+    bad.write_bytes(b"not a page file at all")
+    with pytest.raises(ValueError):
+        MappedPageList(str(bad))
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_tagged_pages_are_built_on_access(mapped):
+    tagged = TaggedPages(mapped, start_index=10)
+    assert tagged[0] == "<physical_index_10>\nPremière page\n<physical_index_10>\n\n"
+    assert tagged[-1].startswith("<physical_index_13>\nlast")
+    assert tagged.pages(12, 20) == [tagged[2], tagged[3]]
+    assert tagged.pages(1, 9) == []
+
+
+def test_large_documents_come_back_mapped(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "get_page_store", lambda: None)
+    pdf = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pdfs", "earthmover.pdf")
+    pages = utils.get_page_tokens(pdf, model="m", mmap_dir=str(tmp_path), mmap_min_pages=5)
+    try:
+        assert isinstance(pages, MappedPageList) and len(pages) == 12
+        assert [tuple(page) for page in pages] == utils.get_page_tokens(pdf, model="m")
+    finally:
+        pages.close()
+    small = utils.get_page_tokens(pdf, model="m", mmap_dir=str(tmp_path / "other"), mmap_min_pages=13)
+    assert isinstance(small, list)
@@ -0,0 +1,66 @@
+import importlib
+import os
+from types import SimpleNamespace
+
+from pageindex.outline import outline_coverage, read_outline
+
+page_index = importlib.import_module("pageindex.page_index")
+
+PDFS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pdfs")
+REPORT = os.path.join(PDFS, "2023-annual-report.pdf")
+
+
+def test_outline_is_flattened_with_structure_numbers():
+    items = read_outline(REPORT)
+    assert len(items) == 50
+    assert items[:5] == [
+        {'structure': '1', 'title': 'Contents', 'physical_index': 3},
+        {'structure': '2', 'title': 'About the Federal Reserve', 'physical_index': 5},
+        {'structure': '3', 'title': '1 Overview', 'physical_index': 7},
+        {'structure': '4', 'title': '2 Monetary Policy and Economic Developments', 'physical_index': 9},
+        {'structure': '4.1', 'title': 'March 2024 Summary', 'physical_index': 9},
+    ]
+    assert read_outline(os.path.join(PDFS, "earthmover.pdf")) == []
+
+
+def test_coverage_needs_titles_on_their_pages_in_order():
+    pages = [("Intro\nsome text", 1), ("", 1), ("Chapter Two\nmore", 1), ("Chapter  three", 1)]
+    items = [
+        {'title': 'Intro', 'physical_index': 1},
+        {'title': 'Scanned page', 'physical_index': 2},
+        {'title': 'CHAPTER TWO', 'physical_index': 3},
+        {'title': 'Chapter Three', 'physical_index': 4},
+    ]
+    assert outline_coverage(items, pages) == 1.0
+    items[2]['physical_index'] = 1
+    items.append({'title': 'Unresolved', 'physical_index': None})
+    # Page 1 goes back before page 2 and does not hold the title; the last entry has no page
+    assert outline_coverage(items, pages) == 3 / 5
+    assert outline_coverage([], pages) == 0.0
+
+
+def test_outline_toc_honours_its_options(monkeypatch):
+    items = [{'structure': str(n), 'title': f'Part {n}', 'physical_index': n} for n in range(1, 5)]
+    pages = [(f"Part {n}", 1) for n in range(1, 5)]
+    monkeypatch.setattr(page_index, "read_outline", lambda doc: items)
+    opt = SimpleNamespace(use_pdf_outline="yes", outline_min_entries=3, outline_min_coverage=0.8)
+    assert page_index.outline_toc("doc.pdf", pages, opt) == items
+    assert page_index.outline_toc("doc.pdf", pages[:2] + [("", 1), ("other", 1)], opt) is None
+    assert page_index.outline_toc("doc.pdf", pages, SimpleNamespace(**dict(vars(opt), outline_min_entries=5))) is None
+    assert page_index.outline_toc("doc.pdf", pages, SimpleNamespace(use_pdf_outline="no")) is None
+
+
+def test_tree_parser_checks_outline_titles_against_the_extracted_text(monkeypatch, fake_llm):
+    import asyncio
+    items = [{'structure': str(n), 'title': f'Part {n} of the report', 'physical_index': n} for n in range(1, 5)]
+    monkeypatch.setattr(page_index, "read_outline", lambda doc: items)
+    raw = [(f"Part {n} of the report\nBody {n}.", 10) for n in range(1, 5)]
+    # Two cleaned pages lost their titles (say, to a running header filter), the extracted ones still have them
+    cleaned = [(f"Body {n}.", 10) for n in range(1, 3)] + raw[2:]
+    opt = SimpleNamespace(model="m", use_pdf_outline="yes", local_title_match="yes",
+                          max_page_num_each_node=10, max_token_num_each_node=20000)
+    tree = asyncio.run(page_index.tree_parser(cleaned, opt, doc="doc.pdf", original_pages=raw))
+    assert [node['title'] for node in tree] == [item['title'] for item in items]
+    # Whether each section starts at the top of its page was still checked
+    assert [item['appear_start'] for item in items] == ['no', 'no', 'yes', 'yes']
+    assert not fake_llm.prompts
@@ -0,0 +1,58 @@
+import importlib
+import os
+
+from pageindex.page_labels import (
+    PageLabelMap, detect_printed_labels, int_to_roman, normalize_label, page_label_map,
+    page_number_of_line, read_pdf_page_labels, roman_to_int,
+)
+
+page_index = importlib.import_module("pageindex.page_index")
+
+PDFS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pdfs")
+
+
+def test_roman_numerals_and_labels():
+    assert [int_to_roman(n) for n in (4, 9, 14, 2024)] == ["iv", "ix", "xiv", "mmxxiv"]
+    assert roman_to_int("XIV") == 14 and roman_to_int("iiii") is None and roman_to_int("") is None
+    assert normalize_label("012") == "12" and normalize_label(" XIV ") == "xiv"
+
+
+def test_page_number_lines():
+    assert page_number_of_line("  - 12 -  ") == "12"
+    assert page_number_of_line("Page 7 of 300") == "7"
+    assert page_number_of_line("第12页") == "12"
+    assert page_number_of_line("xiv") == "xiv"
+    assert page_number_of_line("12 | Annual Report 2024") == "12"
+    assert page_number_of_line("Annual Report 2024 | 13") == "13"
+    assert page_number_of_line("Results for 2024 were strong") is None
+
+
+def test_printed_numbers_are_detected_in_runs_only():
+    front = [f"Preface\ntext\n{int_to_roman(n)}" for n in (1, 2, 3)]
+    body = [f"{n} | Report\ntext\nmore" for n in (1, 2)] + ["A full-page figure"] + [f"text\n{n}" for n in (4, 5)]
+    stray = ["Founded in\n1999\ntext"]
+    labels = detect_printed_labels(front + body + stray)
+    assert labels == ["i", "ii", "iii", "1", "2", "3", "4", "5", None]
+
+
+def test_label_map_resolves_restarts_in_order():
+    page_map = PageLabelMap(["i", "ii", "1", "2", "3", "1", "2", ""], start_index=1)
+    assert page_map.coverage == 7 / 8
+    assert page_map.physical_index("II") == 2
+    assert page_map.physical_index("1") == 3
+    assert page_map.physical_index("1", after=4) == 6
+    assert page_map.physical_index("3", after=6) is None
+    assert page_map.dominant_offset() == 2
+
+
+def test_toc_page_numbers_go_through_the_map():
+    page_map = PageLabelMap(["i", "ii", "1", "2", "3"])
+    toc = [{'title': 'Preface', 'page_label': 'ii'}, {'title': 'One', 'page': 1}, {'title': 'Two', 'page': 9}]
+    page_index.add_page_offset_to_toc_json(toc, page_map.dominant_offset(), page_map=page_map)
+    assert [item.get('physical_index') for item in toc] == [2, 3, 11]
+
+
+def test_pdf_page_labels_are_used_only_when_informative():
+    assert read_pdf_page_labels(os.path.join(PDFS, "earthmover.pdf")) is None
+    page_map = page_label_map([f"text\n{n}" for n in range(1, 6)], pdf=os.path.join(PDFS, "earthmover.pdf"))
+    assert page_map.labels == ["1", "2", "3", "4", "5"]
@@ -0,0 +1,105 @@
+import importlib
+import os
+
+import pytest
+
+from pageindex import tokens
+from pageindex.mapped_pages import MappedPageList
+from pageindex.page_store import PageStore, pdf_sha256
+from pageindex.tokens import TokenCounter
+
+utils = importlib.import_module("pageindex.utils")
+
+PDF = os.path.join(os.path.dirname(__file__), "pdfs", "earthmover.pdf")
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = PageStore(str(tmp_path / "pages.sqlite"))
+    yield store
+    store.close()
+
+
+def test_pages_round_trip_with_counts_per_encoding(store):
+    store.put("doc", [("first page", 2), ("second page", 3)], "enc-a")
+    assert store.get("doc", "enc-a") == [("first page", 2), ("second page", 3)]
+    assert store.get("doc", "enc-b") is None
+    assert store.get_texts("doc") == ["first page", "second page"]
+
+    store.put_tokens("doc", "enc-b", [20, 30])
+    assert store.get("doc", "enc-b") == [("first page", 20), ("second page", 30)]
+    assert store.get("doc", "enc-a") == [("first page", 2), ("second page", 3)]
+
+
+def test_get_range_is_clipped_to_the_document(store):
+    store.put("doc", [("p1", 1), ("p2", 1), ("p3", 1)], "enc")
+    assert store.get_range("doc", 1, 10) == ["p2", "p3"]
+    assert store.get_range("missing", 0, 1) is None
+
+
+def test_pages_are_streamed_in_batches(store):
+    pages = [(f"page {n}", n) for n in range(7)]
+    store.put("doc", pages, "enc")
+    num_pages, stream = store.iter_pages("doc", "enc", batch_size=3)
+    assert num_pages == 7 and list(stream) == pages
+    assert store.iter_pages("doc", "other") is None
+    assert store.iter_pages("missing", "enc") is None
+
+
+def test_stored_pages_are_streamed_into_the_page_file(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "get_page_store", lambda: store)
+    extracted = utils.get_page_tokens(PDF, model="m")
+
+    def no_whole_document(*args, **kwargs):
+        raise AssertionError("the whole document was loaded")
+
+    monkeypatch.setattr(store, "get", no_whole_document)
+    mapped = utils.get_page_tokens(PDF, model="m", mmap_dir=str(tmp_path / "mmap"))
+    try:
+        assert isinstance(mapped, MappedPageList)
+        assert [tuple(page) for page in mapped] == extracted
+    finally:
+        mapped.close()
+
+
+def test_least_recently_used_documents_are_evicted(tmp_path):
+    store = PageStore(str(tmp_path / "pages.sqlite"), max_bytes=10)
+    store.put("old", [("x" * 6, 1)], "enc")
+    store.put("new", [("y" * 6, 1)], "enc")
+    assert store.get_texts("old") is None
+    assert store.get("new", "enc") == [("y" * 6, 1)]
+    store.close()
+
+
+def test_pdf_hash_does_not_depend_on_how_the_pdf_is_given():
+    with open(PDF, "rb") as f:
+        assert pdf_sha256(PDF) == pdf_sha256(f)
+
+
+def test_stored_text_is_shared_across_tokenizers(store, monkeypatch):
+    class CharEncoding:
+        def encode_ordinary_batch(self, texts):
+            return [list(text) for text in texts]
+
+    class WordEncoding:
+        def encode_ordinary_batch(self, texts):
+            return [text.split() for text in texts]
+
+    encodings = {"o200k_base": WordEncoding(), "cl100k_base": CharEncoding()}
+    monkeypatch.setattr(tokens.tiktoken, "get_encoding", encodings.__getitem__)
+    monkeypatch.setattr(utils, "_token_counter", TokenCounter())
+    monkeypatch.setattr(utils, "get_page_store", lambda: store)
+
+    by_words = utils.get_page_tokens(PDF, model="gpt-4o")
+
+    def no_extraction(*args, **kwargs):
+        raise AssertionError("the PDF was extracted again")
+
+    monkeypatch.setattr(utils.PyPDF2, "PdfReader", no_extraction)
+    by_chars = utils.get_page_tokens(PDF, model="gpt-4")
+    assert [text for text, _ in by_chars] == [text for text, _ in by_words]
+    assert [n for _, n in by_chars] == [len(text) for text, _ in by_words]
+    assert [n for _, n in by_words] == [len(text.split()) for text, _ in by_words]
+
+    text = utils.get_text_of_pages(PDF, 1, 2, tag=False)
+    assert text == by_words[0][0] + by_words[1][0]
@@ -0,0 +1,144 @@
+import asyncio
+import importlib
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from pageindex.rate_limit import LLMScheduler, TokenBucket, PRIORITY_BACKGROUND, PRIORITY_CRITICAL, PRIORITY_NORMAL
+
+page_index = importlib.import_module("pageindex.page_index")
+utils = importlib.import_module("pageindex.utils")
+
+
+def test_token_bucket_reserve_returns_wait_once_empty():
+    bucket = TokenBucket(60, capacity=2)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    # Third request waits for one token at 1/s
+    assert bucket.reserve() == pytest.approx(1.0, abs=0.05)
+
+
+def test_token_bucket_caps_oversized_reservation():
+    bucket = TokenBucket(60, capacity=10)
+    assert bucket.reserve(1000) == 0.0
+
+
+def test_slots_are_limited_and_released():
+    scheduler = LLMScheduler(max_concurrency=1)
+    scheduler.acquire()
+    assert not scheduler.try_acquire()
+    scheduler.release()
+    assert scheduler.try_acquire()
+    scheduler.release()
+
+
+def test_freed_slot_goes_to_most_urgent_waiter():
+    scheduler = LLMScheduler(max_concurrency=1, aging=0)
+    scheduler.acquire()
+    order = []
+
+    def call(name, priority):
+        with scheduler.slot(priority=priority):
+            order.append(name)
+
+    threads = [
+        threading.Thread(target=call, args=("background", PRIORITY_BACKGROUND)),
+        threading.Thread(target=call, args=("normal", PRIORITY_NORMAL)),
+        threading.Thread(target=call, args=("critical", PRIORITY_CRITICAL)),
+    ]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    scheduler.release()
+    for thread in threads:
+        thread.join(5)
+    assert order == ["critical", "normal", "background"]
+
+
+def test_long_waiting_background_call_ages_past_newer_calls():
+    scheduler = LLMScheduler(max_concurrency=1, aging=0.1)
+    scheduler.acquire()
+    order = []
+
+    def call(name, priority):
+        with scheduler.slot(priority=priority):
+            order.append(name)
+
+    background = threading.Thread(target=call, args=("background", PRIORITY_BACKGROUND))
+    background.start()
+    time.sleep(0.35)
+    normal = threading.Thread(target=call, args=("normal", PRIORITY_NORMAL))
+    normal.start()
+    time.sleep(0.05)
+    scheduler.release()
+    background.join(5), normal.join(5)
+    assert order == ["background", "normal"]
+
+
+def test_innermost_configured_stage_sets_the_priority(monkeypatch):
+    utils.get_llm_scheduler()
+    monkeypatch.setattr(utils, "_stage_priorities", {"verify_toc": PRIORITY_CRITICAL, "summaries": PRIORITY_BACKGROUND})
+    assert utils.stage_priority("tree_parser/verify_toc/check_title_appearance") == PRIORITY_CRITICAL
+    assert utils.stage_priority("verify_toc/summaries") == PRIORITY_BACKGROUND
+    assert utils.stage_priority("unattributed") == PRIORITY_NORMAL
+
+
+def test_critical_reserve_is_kept_for_critical_calls():
+    scheduler = LLMScheduler(max_concurrency=2, critical_reserve=1)
+    assert scheduler.try_acquire(priority=PRIORITY_NORMAL)
+    assert not scheduler.try_acquire(priority=PRIORITY_NORMAL)
+    assert scheduler.try_acquire(priority=PRIORITY_CRITICAL)
+
+
+def test_async_waiter_cancelled_gives_way():
+    scheduler = LLMScheduler(max_concurrency=1)
+
+    async def main():
+        await scheduler.acquire_async()
+        waiter = asyncio.ensure_future(scheduler.acquire_async())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        scheduler.release()
+        # The cancelled waiter must not have kept the slot
+        assert scheduler.try_acquire()
+
+    asyncio.run(main())
+
+
+def test_meta_processor_runs_blocking_stages_off_the_event_loop(monkeypatch):
+    scheduler = LLMScheduler(max_concurrency=2)
+
+    def process_no_toc(page_list, start_index=1, model=None, logger=None):
+        # A blocking call: waits until the coroutines below hand their slots back
+        with scheduler.slot():
+            return [{"structure": "1", "title": "A", "physical_index": 1}]
+
+    async def verify_toc(page_list, items, **kwargs):
+        return 1.0, []
+
+    monkeypatch.setattr(page_index, "process_no_toc", process_no_toc)
+    monkeypatch.setattr(page_index, "verify_toc", verify_toc)
+
+    async def hold_slot():
+        async with scheduler.slot_async():
+            await asyncio.sleep(0.2)
+
+    async def main():
+        opt = SimpleNamespace(model="test-model")
+        results = await asyncio.gather(
+            hold_slot(), hold_slot(),
+            page_index.meta_processor([("A", 1)], mode="process_no_toc", opt=opt),
+        )
+        return results[-1]
+
+    results = []
+    # On the loop thread the blocking wait would park the loop for good; keep the test from hanging
+    runner = threading.Thread(target=lambda: results.append(asyncio.run(main())), daemon=True)
+    runner.start()
+    runner.join(5)
+    assert not runner.is_alive(), "event loop blocked on a scheduler slot"
+    assert results[0][0]["title"] == "A"
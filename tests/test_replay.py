@@ -0,0 +1,99 @@
+import importlib
+import json
+import os
+
+import requests
+
+from pageindex.endpoints import Endpoint, EndpointPool
+from pageindex.replay import CassetteRecorder, ReplayServer, load_cassette, request_key
+from pageindex.streaming import SSEParser, delta_content
+from pageindex.utils import ConfigLoader
+
+utils = importlib.import_module("pageindex.utils")
+page_index = importlib.import_module("pageindex.page_index")
+
+PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pdfs", "earthmover.pdf")
+
+
+def payload(content):
+    return {"model": "m", "messages": [{"role": "user", "content": content}], "temperature": utils.LLM_TEMPERATURE}
+
+
+def test_cassette_round_trip_and_repeats(tmp_path):
+    recorder = CassetteRecorder(str(tmp_path / "cassette.jsonl"))
+    recorder.record(payload("hi"), "first")
+    recorder.record(payload("hi"), "second")
+    entries = load_cassette(recorder.path)
+    assert [entry["response"] for entry in entries[request_key(payload("hi"))]] == ["first", "second"]
+    # The model is not part of the key
+    assert request_key(dict(payload("hi"), model="other")) == request_key(payload("hi"))
+
+    server = ReplayServer(recorder.path, chunk_chars=2).start()
+    try:
+        replies = []
+        for _ in range(3):
+            parser = SSEParser()
+            chunks = parser.feed(requests.post(server.url, json=payload("hi")).content)
+            assert parser.done
+            replies.append("".join(delta_content(chunk) for chunk in chunks))
+        # Repeats are served in recorded order, then the last one again
+        assert replies == ["first", "second", "second"]
+        assert requests.post(server.url, json=payload("unknown")).status_code == 404
+        assert (server.hits, server.misses) == (3, 1)
+    finally:
+        server.stop()
+
+
+def scripted_answer(prompt):
+    if "generate the tree structure of the document" in prompt:
+        return json.dumps([
+            {"structure": "1", "title": "Earth Mover's Distance based Similarity Search at Scale", "physical_index": "<physical_index_1>"},
+            {"structure": "2", "title": "2.1 Computing the EMD", "physical_index": "<physical_index_3>"},
+        ])
+    if "for each given section" in prompt:
+        return json.dumps([{"id": i, "answer": "yes"} for i in range(50)])
+    if '"answer"' in prompt:
+        return json.dumps({"answer": "yes", "thinking": ""})
+    return "A short summary."
+
+
+def test_page_index_main_replays_through_the_http_clients(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(utils, "get_llm_cache", lambda: None)
+    monkeypatch.setattr(utils, "get_hedge_policy", lambda: None)
+    opt = ConfigLoader().load({"model": "m"})
+    opt.incremental = "no"
+    opt.page_store = "no"
+
+    # Record: a scripted LLM answers, every call goes to the cassette
+    recorder = CassetteRecorder(str(tmp_path / "cassette.jsonl"))
+
+    def reply(messages):
+        answer = scripted_answer(messages[-1]["content"])
+        recorder.record({"model": "m", "messages": messages, "temperature": utils.LLM_TEMPERATURE}, answer)
+        return answer, "m"
+
+    async def reply_async(model, messages, *args, **kwargs):
+        return reply(messages)
+
+    with monkeypatch.context() as recording:
+        recording.setattr(utils, "_request_stream_sync", lambda model, messages, *args, **kwargs: reply(messages))
+        recording.setattr(utils, "_request_stream_async", reply_async)
+        recorded = page_index.page_index_main(PDF, opt)
+    with open(os.path.join("results", "earthmover.pdf_full.json"), encoding="utf-8") as f:
+        recorded_full = json.load(f)
+
+    # Replay: the real sync and async clients stream the cassette from the local stub
+    server = ReplayServer(recorder.path, chunk_chars=7).start()
+    try:
+        monkeypatch.setattr(utils, "_endpoint_pool", EndpointPool([Endpoint(server.url, api_key="replay", name="replay")]))
+        replayed = page_index.page_index_main(PDF, opt)
+    finally:
+        server.stop()
+    with open(os.path.join("results", "earthmover.pdf_full.json"), encoding="utf-8") as f:
+        replayed_full = json.load(f)
+
+    assert replayed == recorded
+    assert replayed_full == recorded_full
+    assert [node["title"] for node in replayed] == ["Earth Mover's Distance based Similarity Search at Scale", "2.1 Computing the EMD"]
+    assert server.misses == 0 and server.hits == sum(len(entries) for entries in load_cassette(recorder.path).values())
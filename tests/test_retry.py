@@ -0,0 +1,76 @@
+import importlib
+import random
+
+import pytest
+
+from pageindex.retry import (
+    RetryPolicy, LLMAuthError, LLMBadRequestError, LLMRateLimitError, LLMServerError,
+    LLMConnectionError, LLMHTMLResponseError, LLMDeadlineExceeded, error_for_response, parse_retry_after,
+)
+
+utils = importlib.import_module("pageindex.utils")
+
+
+@pytest.mark.parametrize("status, content_type, expected", [
+    (401, "application/json", LLMAuthError),
+    (403, "application/json", LLMAuthError),
+    (400, "application/json", LLMBadRequestError),
+    (429, "application/json", LLMRateLimitError),
+    (408, "application/json", LLMServerError),
+    (503, "application/json", LLMServerError),
+    (200, "text/html; charset=utf-8", LLMHTMLResponseError),
+])
+def test_responses_map_to_typed_errors(status, content_type, expected):
+    error = error_for_response(status, content_type, url="https://llm")
+    assert type(error) is expected
+    assert error.retryable == (expected in (LLMRateLimitError, LLMServerError))
+    assert error_for_response(200, "text/event-stream") is None
+
+
+def test_retry_after_seconds_and_dates():
+    assert parse_retry_after("7") == 7.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert parse_retry_after("soon") is None
+    assert error_for_response(429, "", retry_after="12").retry_after == 12.0
+
+
+def test_backoff_is_jittered_exponential_and_capped():
+    random.seed(1)
+    policy = RetryPolicy(max_attempts=10, base_delay=1.0, max_delay=5.0, deadline=None)
+    error = LLMServerError("boom")
+    for attempt in range(8):
+        assert 0 <= policy.next_delay(attempt, error) <= min(5.0, 2 ** attempt)
+    assert policy.next_delay(9, error) is None
+    assert policy.next_delay(0, LLMAuthError("no")) is None
+
+
+def test_retry_after_wins_but_not_past_the_deadline():
+    policy = RetryPolicy(max_attempts=4, base_delay=0.1, deadline=10)
+    deadline_at = policy.start()
+    assert policy.next_delay(0, LLMRateLimitError("slow down", retry_after=3), deadline_at) >= 3
+    assert policy.next_delay(0, LLMRateLimitError("slow down", retry_after=60), deadline_at) is None
+    assert policy.timeout_for(180, deadline_at) <= 10
+    with pytest.raises(LLMDeadlineExceeded):
+        policy.timeout_for(180, deadline_at - 11)
+
+
+def test_transient_failures_are_retried_and_auth_failures_are_not(fake_llm, monkeypatch):
+    monkeypatch.setattr(utils, "get_retry_policy", lambda: RetryPolicy(max_attempts=3, base_delay=0, deadline=None))
+    failures = [LLMConnectionError("reset"), LLMServerError("502")]
+
+    def flaky(prompt):
+        if failures:
+            raise failures.pop(0)
+        return "ok"
+
+    fake_llm.answer = flaky
+    assert utils.ChatGPT_API_with_finish_reason("m", "hello") == ("ok", "finished")
+    assert len(fake_llm.prompts) == 3
+
+    def denied(prompt):
+        raise LLMAuthError("bad key", status=401)
+
+    fake_llm.answer = denied
+    fake_llm.prompts.clear()
+    assert utils.ChatGPT_API_with_finish_reason("m", "hello") == ("Error", "failed")
+    assert len(fake_llm.prompts) == 1
@@ -0,0 +1,49 @@
+import io
+import json
+import os
+
+from pageindex.stream_sink import STREAM_PREFIX, BatchedStreamSink, NullStreamSink, new_call_id
+
+
+def batches(text):
+    lines = text.splitlines()
+    assert all(line.startswith(STREAM_PREFIX) for line in lines)
+    return [json.loads(line[len(STREAM_PREFIX):]) for line in lines]
+
+
+def test_deltas_are_batched_per_call():
+    out = io.StringIO()
+    sink = BatchedStreamSink(stream=out, max_chars=10 ** 6, interval=60)
+    first, second = new_call_id(), new_call_id()
+    for delta in ("Hel", "lo\n", "world"):
+        sink.write(first, delta)
+    sink.write(second, "other")
+    assert out.getvalue() == ""
+    sink.close()
+    assert batches(out.getvalue()) == [{"id": first, "text": "Hello\nworld"}, {"id": second, "text": "other"}]
+
+
+def test_full_buffer_is_flushed_early():
+    out = io.StringIO()
+    sink = BatchedStreamSink(stream=out, max_chars=4, interval=60)
+    sink.write("1", "abcdef")
+    for _ in range(100):
+        if out.getvalue():
+            break
+        sink._thread.join(0.01)
+    assert batches(out.getvalue()) == [{"id": "1", "text": "abcdef"}]
+    sink.close()
+
+
+def test_closed_stream_is_ignored_and_null_sink_is_disabled():
+    out = io.StringIO()
+    sink = BatchedStreamSink(stream=out, interval=60)
+    out.close()
+    sink.write("1", "text")
+    sink.close()
+    assert not NullStreamSink.enabled
+
+
+def test_prefix_matches_the_gui():
+    with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pgui.py"), encoding="utf-8") as f:
+        assert f'STREAM_PREFIX = "{STREAM_PREFIX}"' in f.read()
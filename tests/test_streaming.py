@@ -0,0 +1,39 @@
+import json
+
+from pageindex.streaming import SSEParser, delta_content
+
+
+def chunk(text):
+    return "data: " + json.dumps({"choices": [{"delta": {"content": text}}]}, ensure_ascii=False) + "\n\n"
+
+
+def test_events_split_across_chunks():
+    body = (": keep-alive\n" + chunk("Hel") + chunk("lo") + "data: [DONE]\n\n" + chunk("late")).encode()
+    parser = SSEParser()
+    payloads = []
+    for i in range(0, len(body), 7):
+        payloads += parser.feed(body[i:i + 7])
+    assert [delta_content(payload) for payload in payloads] == ["Hel", "lo"]
+    assert parser.done
+    assert parser.feed(b"data: more\n") == []
+
+
+def test_flush_returns_an_unterminated_last_line():
+    parser = SSEParser()
+    assert parser.feed(b"event: message\ndata: {\"a\": 1}") == []
+    assert parser.flush() == ['{"a": 1}']
+    assert parser.flush() == []
+
+
+def test_multibyte_text_split_mid_character():
+    body = chunk("页码").encode("utf-8")
+    parser = SSEParser()
+    split = body.index("页".encode("utf-8")) + 1
+    payloads = parser.feed(body[:split]) + parser.feed(body[split:])
+    assert [delta_content(payload) for payload in payloads] == ["页码"]
+
+
+def test_delta_content_ignores_malformed_chunks():
+    assert delta_content("not json") is None
+    assert delta_content('{"choices": []}') is None
+    assert delta_content('{"choices": [{"delta": {"role": "assistant"}}]}') is None
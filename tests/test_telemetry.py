@@ -0,0 +1,56 @@
+import asyncio
+import importlib
+
+from pageindex.telemetry import MetricsRegistry, current_stage, llm_stage, run_report, tag_stage
+
+utils = importlib.import_module("pageindex.utils")
+
+
+def test_stages_nest_and_recursion_stays_one_stage():
+    assert current_stage() == "unattributed"
+    with llm_stage("tree_parser"):
+        with llm_stage("verify_toc"), llm_stage("verify_toc"):
+            assert current_stage() == "tree_parser/verify_toc"
+        assert current_stage() == "tree_parser"
+    assert current_stage() == "unattributed"
+
+
+def test_tasks_inherit_the_stage_of_their_gather():
+    @tag_stage("summaries")
+    async def summarize():
+        async def one():
+            await asyncio.sleep(0)
+            return current_stage()
+        return await asyncio.gather(one(), one())
+
+    assert asyncio.run(summarize()) == ["summaries", "summaries"]
+
+
+def test_registry_aggregates_per_stage_and_renders_prometheus():
+    registry = MetricsRegistry()
+    with llm_stage('check "toc"'):
+        tracker = registry.start_call()
+        tracker.on_delta("x")
+        tracker.retry()
+        tracker.finish(100, 20)
+    registry.start_call("other").finish(error="LLMServerError")
+    stats = registry.snapshot()
+    assert stats['check "toc"']['calls'] == 1 and stats['check "toc"']['retries'] == 1
+    assert stats['check "toc"']['prompt_tokens'] == 100 and stats['check "toc"']['ttft_avg'] is not None
+    assert stats['other']['errors'] == 1
+    text = registry.to_prometheus()
+    assert 'pageindex_llm_calls_total{stage="check \\"toc\\""} 1' in text
+    assert 'pageindex_llm_latency_seconds_bucket{stage="other",le="+Inf"} 1' in text
+
+
+def test_run_report_collects_the_calls_of_its_run(fake_llm):
+    fake_llm.answer = lambda prompt: "fine"
+    with run_report("doc") as report:
+        with llm_stage("meta_processor"), llm_stage("check_toc"):
+            utils.ChatGPT_API("m", "hello")
+        utils.ChatGPT_API("m", "hello again")
+    utils.ChatGPT_API("m", "outside the run")
+    result = report.to_dict()
+    assert result['llm_calls'] == 2
+    assert set(result['by_stage']) == {"meta_processor/check_toc", "unattributed"}
+    assert result['by_leaf_stage']['check_toc']['calls'] == 1
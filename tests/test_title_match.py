@@ -0,0 +1,60 @@
+import asyncio
+import importlib
+import json
+
+from pageindex.title_match import normalize_title_text, strip_numbering, title_match_score
+
+page_index = importlib.import_module("pageindex.page_index")
+
+
+def test_normalization_ignores_layout_noise():
+    assert normalize_title_text("Intro-\nduction  to ＥＭＤ!") == "introductiontoemd"
+    assert strip_numbering("2.1 Computing the EMD") == "Computing the EMD"
+    assert strip_numbering("Chapter 3: Results") == "Results"
+    assert strip_numbering("第三章 结果") == "结果"
+
+
+def test_scores():
+    page = "Running header\n2.1  COMPUTING THE\nEMD\nEMD can be computed using linear programming."
+    assert title_match_score("2.1 Computing the EMD", page) == 1.0
+    assert title_match_score("Computing the EMD", page, at_start=True) == 1.0
+    assert title_match_score("Computing the EMD", "x" * 200 + page, at_start=True) < 0.5
+    assert title_match_score("Experimental evaluation", page) < 0.5
+    assert title_match_score("Computing the EMD", "   ") is None
+
+
+def test_local_answer_leaves_the_uncertain_band_to_the_llm():
+    page = "2.1 Computing the EMD\ntext"
+    thresholds = (0.5, 0.9)
+    assert page_index.local_title_answer("Computing the EMD", page, thresholds) == "yes"
+    assert page_index.local_title_answer("Query processing", page, thresholds) == "no"
+    assert page_index.local_title_answer("Computing EMD bounds", page, thresholds) is None
+    assert page_index.local_title_answer("Computing the EMD", page, None) is None
+
+
+def test_verify_toc_only_asks_about_uncertain_titles(fake_llm):
+    fake_llm.answer = lambda prompt: json.dumps({"answer": "yes", "thinking": ""})
+    pages = [("1 Introduction\ntext", 1), ("2.1 Computing the EMD\ntext", 1), ("3 Experiments", 1)]
+    toc = [
+        {'title': 'Introduction', 'physical_index': 1},
+        {'title': 'Computing EMD bounds', 'physical_index': 2},
+        {'title': 'Conclusion', 'physical_index': 3},
+    ]
+    accuracy, incorrect = asyncio.run(page_index.verify_toc(pages, toc, title_match=(0.5, 0.9)))
+    assert len(fake_llm.prompts) == 1 and "Computing EMD bounds" in fake_llm.prompts[0]
+    assert [item['title'] for item in incorrect] == ['Conclusion']
+    assert accuracy == 2 / 3
+
+
+def test_mentions_in_running_text_are_left_to_the_llm():
+    thresholds = (0.5, 0.9)
+    answer = page_index.local_title_answer
+    assert answer("Risk", "Overview\nWe discuss the risks of the plan.", thresholds) is None
+    assert answer("Notes", "Revenue\nSee the notes to the accounts.", thresholds) is None
+    assert answer("Appendix A", "Method\nThe full data set is in Appendix A below.", thresholds) is None
+    assert answer("Summary of findings", "Results\nA summary of findings follows.", thresholds) is None
+    assert answer("Summary", "A summary of results is given below.", thresholds, at_start=True) is None
+    # The same titles standing as headings are still found locally
+    assert answer("Appendix A", "Appendix A\nThe full data set.", thresholds) == "yes"
+    assert answer("Summary of findings", "Results\n4.2 Summary of\nfindings\nText.", thresholds) == "yes"
+    assert answer("Summary", "Summary\nA summary of results.", thresholds, at_start=True) == "yes"
@@ -0,0 +1,53 @@
+import importlib
+import json
+from types import SimpleNamespace
+
+from pageindex.telemetry import current_stage, llm_stage
+from pageindex.toc_detect import toc_page_score
+
+page_index = importlib.import_module("pageindex.page_index")
+
+TOC = """Table of Contents
+1 Introduction ........................ 1
+2 Background .......................... 5
+  2.1 Prior work ...................... 7
+3 Method .............................. 12
+Appendix A ............................ 40"""
+
+PROSE = "\n".join(["This paper studies how to index long documents without chunking them into pieces, "
+                   "and how a reasoning model can navigate the resulting tree to find what matters."] * 6)
+
+FIGURES = """List of Figures
+Figure 1 Architecture ................. 3
+Figure 2 Results ...................... 9
+Figure 3 Ablation ..................... 11"""
+
+
+def test_scores_separate_tocs_from_prose():
+    assert toc_page_score(TOC) >= 0.75
+    assert toc_page_score(PROSE) < 0.2
+    assert toc_page_score("Contents") == 0.0
+    # Lists of figures look like a TOC; the LLM decides those
+    assert 0.2 <= toc_page_score(FIGURES) <= 0.5
+
+
+def test_only_ambiguous_pages_reach_the_llm(fake_llm):
+    stages = []
+
+    def answer(prompt):
+        stages.append(current_stage())
+        return json.dumps({"toc_detected": "no", "thinking": ""})
+
+    fake_llm.answer = answer
+    pages = [(PROSE, 100), (TOC, 50), (FIGURES, 30)]
+    opt = SimpleNamespace(model="m", toc_prefilter="yes", toc_prefilter_reject=0.2, toc_prefilter_accept=0.75)
+    with llm_stage("find_toc_pages"):
+        assert page_index.detect_toc_pages([0, 1, 2], pages, opt) == {0: "no", 1: "yes", 2: "no"}
+    assert len(fake_llm.prompts) == 1 and "List of Figures" in fake_llm.prompts[0]
+    # The worker threads keep the caller's stage
+    assert stages == ["find_toc_pages"]
+
+    fake_llm.prompts.clear()
+    opt.toc_prefilter = "no"
+    page_index.detect_toc_pages([0, 1, 2], pages, opt)
+    assert len(fake_llm.prompts) == 3
@@ -0,0 +1,67 @@
+import pytest
+
+from pageindex import tokens
+from pageindex.tokens import TokenCounter, approximate_tokens
+
+
+class WordEncoding:
+    """Stand-in tiktoken encoding: one token per whitespace-separated word."""
+    def __init__(self):
+        self.calls = 0
+
+    def encode_ordinary_batch(self, texts):
+        self.calls += 1
+        return [text.split() for text in texts]
+
+
+@pytest.fixture
+def word_encoding(monkeypatch):
+    encoding = WordEncoding()
+    monkeypatch.setattr(tokens.tiktoken, "get_encoding", lambda name: encoding)
+    return encoding
+
+
+def test_approximate_tokens_counts_cjk_characters_one_each():
+    assert approximate_tokens("") == 0
+    assert approximate_tokens("abcdefgh") == 2
+    assert approximate_tokens("目录") == 2
+    assert approximate_tokens("目录 abcd") == 2 + 2
+
+
+def test_encoding_is_picked_per_model():
+    counter = TokenCounter()
+    assert counter._encoding_name("gpt-4o-2024-11-20") == "o200k_base"
+    assert counter._encoding_name("gpt-4") == "cl100k_base"
+    assert counter._encoding_name("DeepSeek-V3") == "cl100k_base"
+    assert TokenCounter(encoding="p50k_base")._encoding_name("gpt-4o") == "p50k_base"
+
+
+def test_counts_come_from_the_encoding_and_are_memoized(word_encoding):
+    counter = TokenCounter()
+    assert counter.count_batch(["one two", "three", "one two"], model="gpt-4o") == [2, 1, 2]
+    assert counter.count("one two", model="gpt-4o") == 2
+    assert word_encoding.calls == 1
+    assert counter.stats()["hits"] == 1 and counter.stats()["entries"] == 2
+
+
+def test_memo_keeps_the_most_recently_used_entries(word_encoding):
+    counter = TokenCounter(max_entries=2)
+    counter.count_batch(["a", "b"])
+    counter.count("a")
+    counter.count("c")
+    assert counter.stats()["entries"] == 2
+    calls = word_encoding.calls
+    counter.count("a")
+    assert word_encoding.calls == calls
+    counter.count("b")
+    assert word_encoding.calls == calls + 1
+
+
+def test_unavailable_encoding_falls_back_to_an_approximation(monkeypatch):
+    def unavailable(name):
+        raise ConnectionError("offline")
+
+    monkeypatch.setattr(tokens.tiktoken, "get_encoding", unavailable)
+    counter = TokenCounter()
+    assert counter.encoding_name("gpt-4o") == "approx"
+    assert counter.count("abcdefgh", model="gpt-4o") == 2